@@ -0,0 +1,40 @@
+"""
+Fixtures for the benchmark suite.
+
+Run it with `pytest benchmarks`, and export the results with
+`--benchmark-json results.json` (see pytest-benchmark for comparing runs).
+"""
+import os
+
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from benchmarks.generators import write_config
+from makim import config
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch) -> Path:
+    """Use an empty makim cache directory for each benchmark."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('MAKIM_CACHE_DIR', str(path))
+    config.clear_config_cache()
+    return path
+
+
+@pytest.fixture
+def makim_file(tmp_path) -> Callable[[dict], str]:
+    """Return a function that writes a config and returns its path."""
+
+    def write(data: dict) -> str:
+        return str(write_config(data, tmp_path / '.makim.yaml'))
+
+    return write
+
+
+@pytest.fixture
+def no_exit(monkeypatch):
+    """Fail the benchmark instead of exiting the process on errors."""
+    monkeypatch.setattr(os, '_exit', lambda code: pytest.fail(f'exit {code}'))
@@ -0,0 +1,118 @@
+"""Generators of synthetic makim config files for the benchmarks."""
+from pathlib import Path
+from typing import Optional
+
+import yaml  # type: ignore
+
+
+def generate_config(
+    groups: int = 10,
+    targets: int = 10,
+    env_vars: int = 0,
+    shell: str = 'bash',
+    variables: int = 0,
+) -> dict:
+    """
+    Generate the data for a makim config file.
+
+    Each target has one argument, a help text and a trivial `run` command.
+    `env_vars` env variables and `variables` vars are added to the global,
+    group and target scopes.
+    """
+
+    def env(prefix: str) -> dict:
+        return {f'{prefix}_VAR_{i}': f'value-{i}' for i in range(env_vars)}
+
+    def vars_(prefix: str) -> dict:
+        return {f'{prefix}_{i}': f'value-{i}' for i in range(variables)}
+
+    data: dict = {'version': 1.0, 'shell': shell, 'env': env('GLOBAL')}
+    if variables:
+        data['vars'] = vars_('global')
+    data['groups'] = {}
+
+    for group_id in range(groups):
+        group_targets = {}
+        for target_id in range(targets):
+            group_targets[f'target-{target_id}'] = {
+                'help': f'Target {target_id} of the group {group_id}',
+                'env': env('TARGET'),
+                **({'vars': vars_('target')} if variables else {}),
+                'args': {
+                    'name': {
+                        'help': 'Name to be printed',
+                        'type': 'string',
+                        'default': f'target-{target_id}',
+                    }
+                },
+                'run': 'echo "{{ args.name }}"',
+            }
+        data['groups'][f'group-{group_id}'] = {
+            'help': f'Group {group_id}',
+            'env': env('GROUP'),
+            **({'vars': vars_('group')} if variables else {}),
+            'targets': group_targets,
+        }
+    return data
+
+
+def write_config(data: dict, path: Optional[Path] = None) -> Path:
+    """Write the config data to a makim file."""
+    path = path or Path('.makim-benchmark.yaml')
+    path.write_text(yaml.safe_dump(data, sort_keys=False))
+    return path
+
+
+def generate_chain_config(length: int = 50, shell: str = 'bash') -> dict:
+    """
+    Generate a config with a chain of `length` trivial targets.
+
+    Each target `chain.target-N` depends on `chain.target-{N-1}`, so calling
+    the last one runs the whole chain, one target after the other.
+    """
+    targets: dict = {}
+    for target_id in range(length):
+        targets[f'target-{target_id}'] = {
+            'help': f'Target {target_id} of the chain',
+            'run': f'echo "target {target_id}"',
+        }
+        if target_id:
+            targets[f'target-{target_id}']['dependencies'] = [
+                {'target': f'chain.target-{target_id - 1}'}
+            ]
+    return {
+        'version': 1.0,
+        'shell': shell,
+        'groups': {'chain': {'help': 'Chain of targets', 'targets': targets}},
+    }
+
+
+def generate_fanout_config(width: int = 100, shell: str = 'bash') -> dict:
+    """
+    Generate a config with one target that depends on `width` targets.
+
+    Calling `fanout.all` runs `fanout.target-0` ... `fanout.target-N`, which
+    don't depend on each other.
+    """
+    targets: dict = {
+        f'target-{target_id}': {
+            'help': f'Target {target_id} of the fan-out',
+            'run': f'echo "target {target_id}"',
+        }
+        for target_id in range(width)
+    }
+    targets['all'] = {
+        'help': 'Run all the targets',
+        'dependencies': [
+            {'target': f'fanout.target-{target_id}'}
+            for target_id in range(width)
+        ],
+        'run': 'echo "all"',
+    }
+    return {
+        'version': 1.0,
+        'shell': shell,
+        'groups': {
+            'fanout': {'help': 'Fan-out of targets', 'targets': targets}
+        },
+    }
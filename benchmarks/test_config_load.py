@@ -0,0 +1,53 @@
+"""
+Benchmarks for loading a big config file, with and without the caches.
+
+It compares the cold load (YAML parsing, with the pure Python loader and
+with the loader used by makim), the warm load from the on-disk cache (a
+new process) and the warm load from the in-process cache.
+"""
+import pytest
+import yaml  # type: ignore
+
+from benchmarks.generators import generate_config
+from makim import config
+
+GROUPS = 100
+TARGETS_PER_GROUP = 40
+
+
+@pytest.fixture
+def big_config(makim_file) -> str:
+    """Write the big config file and return its path."""
+    return makim_file(generate_config(GROUPS, TARGETS_PER_GROUP))
+
+
+def test_config_load_pure_python(benchmark, big_config):
+    """Parse the config file with the pure Python YAML loader."""
+
+    def load():
+        with open(big_config) as f:
+            yaml.safe_load(config.escape_template_tag(f.read()))
+
+    benchmark(load)
+
+
+def test_config_load_cold(benchmark, big_config):
+    """Parse the config file with the makim loader, without any cache."""
+    benchmark(config.load_config, big_config, use_cache=False)
+
+
+def test_config_load_warm_disk(benchmark, big_config):
+    """Load the config file from the cache on disk (a new process)."""
+    config.load_config(big_config)
+
+    def load():
+        config.clear_config_cache()
+        config.load_config(big_config)
+
+    benchmark(load)
+
+
+def test_config_load_warm_memory(benchmark, big_config):
+    """Load the config file from the in-process cache."""
+    config.load_config(big_config)
+    benchmark(config.load_config, big_config)
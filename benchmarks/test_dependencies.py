@@ -0,0 +1,55 @@
+"""
+Benchmarks for resolving a deep dependency chain inside a big config.
+
+It resolves (with `--dry-run`) a chain of targets, each one depending on
+the previous one, inside configs with an increasing number of unrelated
+targets. The time and the peak memory used per dependency (stored in the
+`extra_info` of the results) should not depend on the size of the config.
+"""
+import contextlib
+import io
+import tracemalloc
+
+import pytest
+
+from benchmarks.generators import generate_chain_config, generate_config
+from makim import Makim
+
+CHAIN_LENGTH = 200
+TARGETS_PER_GROUP = 100
+
+
+@pytest.mark.parametrize('other_targets', [0, 500, 5000])
+def test_dependencies_chain(benchmark, makim_file, no_exit, other_targets):
+    """Resolve the chain, without the load of the config."""
+    data = generate_chain_config(CHAIN_LENGTH)
+    data['groups'].update(
+        generate_config(
+            groups=other_targets // TARGETS_PER_GROUP,
+            targets=TARGETS_PER_GROUP,
+        )['groups']
+    )
+    path = makim_file(data)
+    makim = Makim()
+    makim.load(path)
+
+    def resolve():
+        with contextlib.redirect_stdout(io.StringIO()):
+            makim.run(
+                {
+                    'target': f'chain.target-{CHAIN_LENGTH - 1}',
+                    'makim_file': path,
+                    'dry_run': True,
+                }
+            )
+
+    tracemalloc.start()
+    try:
+        resolve()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_kib_per_dependency'] = (
+        peak / CHAIN_LENGTH / 1024
+    )
+    benchmark(resolve)
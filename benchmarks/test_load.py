@@ -0,0 +1,45 @@
+"""Benchmarks for loading the config file and building the help text."""
+import pytest
+
+from benchmarks.generators import generate_config
+from makim import Makim, cli, config
+
+CONFIGS = {
+    'small': {'groups': 10, 'targets': 10},
+    'many-groups': {'groups': 200, 'targets': 10},
+    'many-targets': {'groups': 10, 'targets': 400},
+    'large-env': {'groups': 10, 'targets': 10, 'env_vars': 300},
+    'large-vars': {'groups': 10, 'targets': 10, 'variables': 300},
+}
+
+
+@pytest.mark.parametrize('size', CONFIGS)
+def test_load_cold(benchmark, makim_file, size):
+    """Parse the config file, without any cache."""
+    path = makim_file(generate_config(**CONFIGS[size]))
+    benchmark(config.load_config, path, use_cache=False)
+
+
+@pytest.mark.parametrize('size', CONFIGS)
+def test_load_warm(benchmark, makim_file, size):
+    """Load the config file from the cache on disk (a new process)."""
+    path = makim_file(generate_config(**CONFIGS[size]))
+    config.load_config(path)
+
+    def load():
+        config.clear_config_cache()
+        Makim().load(path)
+
+    benchmark(load)
+
+
+@pytest.mark.parametrize('size', CONFIGS)
+def test_help(benchmark, makim_file, size):
+    """Build the help text with all the targets."""
+    path = makim_file(generate_config(**CONFIGS[size]))
+    config.load_config(path)
+
+    def build_help() -> str:
+        return cli._get_args(cli._get_targets_help(path)).format_help()
+
+    benchmark(build_help)
@@ -0,0 +1,66 @@
+"""Benchmarks for resolving the targets and their dependencies."""
+import pytest
+
+from makim.scheduler import TargetGraph
+
+from benchmarks.generators import (
+    generate_chain_config,
+    generate_config,
+    generate_fanout_config,
+)
+from makim import Makim
+
+GRAPHS = {
+    'chain-200': (generate_chain_config(200), 'chain.target-199'),
+    'fanout-500': (generate_fanout_config(500), 'fanout.all'),
+}
+
+
+def _load_graph(path: str, target: str) -> TargetGraph:
+    makim = Makim()
+    makim.load(path)
+    graph = TargetGraph()
+    makim._load_target(
+        {'target': target, 'makim_file': path, 'dry_run': True}, {}, graph
+    )
+    return graph
+
+
+@pytest.mark.parametrize('graph', GRAPHS)
+def test_traverse_dependencies(benchmark, makim_file, no_exit, graph):
+    """Build the dependency graph (rendering the commands and envs)."""
+    data, target = GRAPHS[graph]
+    path = makim_file(data)
+    result = benchmark(_load_graph, path, target)
+    assert len(result.nodes) in (200, 501)
+
+
+@pytest.mark.parametrize('graph', GRAPHS)
+def test_dry_run(benchmark, makim_file, no_exit, graph):
+    """Run a target with `--dry-run`."""
+    data, target = GRAPHS[graph]
+    path = makim_file(data)
+
+    def dry_run():
+        makim = Makim()
+        makim.load(path)
+        makim.run({'target': target, 'makim_file': path, 'dry_run': True})
+
+    benchmark(dry_run)
+
+
+@pytest.mark.parametrize('env_vars', [0, 300])
+def test_dry_run_big_config(benchmark, makim_file, no_exit, env_vars):
+    """Run one target with `--dry-run` inside a config of 4000 targets."""
+    path = makim_file(
+        generate_config(groups=40, targets=100, env_vars=env_vars)
+    )
+
+    def dry_run():
+        makim = Makim()
+        makim.load(path)
+        makim.run(
+            {'target': 'group-0.target-0', 'makim_file': path, 'dry_run': True}
+        )
+
+    benchmark(dry_run)
@@ -0,0 +1,45 @@
+"""Benchmarks for running targets with trivial commands."""
+import shutil
+
+import pytest
+
+from benchmarks.generators import generate_chain_config, generate_fanout_config
+from makim import Makim
+
+CHAIN_LENGTH = 10
+FANOUT_WIDTH = 10
+
+
+@pytest.fixture(params=['bash', 'xonsh'])
+def shell(request) -> str:
+    """Return the shell for the targets, skip it when not installed."""
+    if not shutil.which(request.param):
+        pytest.skip(f'{request.param} is not installed')
+    return request.param
+
+
+def _run(path: str, target: str, **args):
+    makim = Makim()
+    makim.load(path)
+    makim.run({'target': target, 'makim_file': path, **args})
+
+
+@pytest.mark.parametrize('shell_worker', [False, True])
+def test_run_chain(benchmark, makim_file, no_exit, shell, shell_worker):
+    """Run a chain of targets, one after the other."""
+    path = makim_file(generate_chain_config(CHAIN_LENGTH, shell))
+    benchmark.pedantic(
+        _run,
+        args=(path, f'chain.target-{CHAIN_LENGTH - 1}'),
+        kwargs={'shell_worker': shell_worker},
+        rounds=3,
+    )
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_run_fanout(benchmark, makim_file, no_exit, shell, jobs):
+    """Run independent targets, serially and in parallel."""
+    path = makim_file(generate_fanout_config(FANOUT_WIDTH, shell))
+    benchmark.pedantic(
+        _run, args=(path, 'fanout.all'), kwargs={'jobs': jobs}, rounds=3
+    )
@@ -0,0 +1,50 @@
+"""
+Benchmarks for the persistent shell worker (`--shell-worker`).
+
+It runs a chain of trivial targets in a new makim process, with a new
+shell process for each target and with the shell worker, so the startup
+of the shell (e.g. importing xonsh) is included.
+"""
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.generators import generate_chain_config
+
+CHAIN_LENGTH = 50
+
+
+@pytest.fixture(params=['bash', 'xonsh'])
+def shell(request) -> str:
+    """Return the shell for the targets, skip it when not installed."""
+    if not shutil.which(request.param):
+        pytest.skip(f'{request.param} is not installed')
+    return request.param
+
+
+def _run_chain(path: str, flags: list):
+    subprocess.run(
+        [
+            sys.executable,
+            '-m',
+            'makim',
+            '--makim-file',
+            path,
+            '--no-cache',
+            *flags,
+            f'chain.target-{CHAIN_LENGTH - 1}',
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@pytest.mark.parametrize(
+    'flags', [[], ['--shell-worker']], ids=['process', 'shell-worker']
+)
+def test_shell_worker_chain(benchmark, makim_file, shell, flags):
+    """Run the chain in a new makim process."""
+    path = makim_file(generate_chain_config(CHAIN_LENGTH, shell))
+    benchmark.pedantic(_run_chain, args=(path, flags), rounds=3)
@@ -0,0 +1,57 @@
+"""
+Benchmarks for the overhead of each target (spawn, script delivery, wait).
+
+The script of each target is delivered in memory (memfd, the default on
+Linux) or through a temporary file.
+"""
+import shutil
+
+import pytest
+
+from benchmarks.generators import generate_fanout_config
+from makim import Makim, script
+
+FANOUT_WIDTH = 50
+SCRIPTS_PER_ROUND = 100
+
+
+@pytest.fixture(params=['memfd', 'temp file'])
+def delivery(request, monkeypatch) -> str:
+    """Select how the scripts are delivered to the shell."""
+    if request.param == 'temp file':
+        monkeypatch.setattr(script, '_create_memfd', lambda: None)
+    with script.ScriptFile('') as script_file:
+        if request.param == 'memfd' and not script_file.is_memfd:
+            pytest.skip('memfd is not available')
+    return request.param
+
+
+def _run(path: str):
+    makim = Makim()
+    makim.load(path)
+    result = makim.execute(
+        {'target': 'fanout.all', 'makim_file': path, 'no_cache': True}
+    )
+    if not result.ok:
+        pytest.fail(result.message)
+
+
+def _deliver_scripts():
+    for _ in range(SCRIPTS_PER_ROUND):
+        with script.ScriptFile('true\n'):
+            pass
+
+
+def test_target_overhead(benchmark, makim_file, delivery):
+    """Run a fan-out of targets that do nothing."""
+    if not shutil.which('bash'):
+        pytest.skip('bash is not installed')
+    data = generate_fanout_config(FANOUT_WIDTH, 'bash')
+    for target in data['groups']['fanout']['targets'].values():
+        target['run'] = 'true'
+    benchmark.pedantic(_run, args=(makim_file(data),), rounds=3)
+
+
+def test_script_delivery(benchmark, delivery):
+    """Create and release the script files, without running them."""
+    benchmark(_deliver_scripts)
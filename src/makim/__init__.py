@@ -6,4 +6,10 @@ __email__ = 'ivan.ogasawara@gmail.com'
 __version__ = '1.9.1'  # semantic-release
 
 
-from makim.makim import Makim  # noqa: F401
+def __getattr__(name: str):
+    """Import `Makim` on demand, so `import makim` is cheap."""
+    if name == 'Makim':
+        from makim.makim import Makim
+
+        return Makim
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
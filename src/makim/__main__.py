@@ -1,5 +1,21 @@
 """Makim app to be called from `python -m`."""
-from makim.cli import app
+import sys
+
+from makim.daemon import forward
+
+
+def app():
+    """Call makim, through the makim daemon when it is running."""
+    # note: the client for the daemon doesn't import the makim cli at all
+    if '--daemon' not in sys.argv[1:]:
+        returncode = forward(sys.argv)
+        if returncode is not None:
+            sys.exit(returncode)
+
+    from makim.cli import app as cli_app
+
+    cli_app()
+
 
 if __name__ == '__main__':
     app()
@@ -0,0 +1,381 @@
+"""Content-addressed cache for the results of the targets."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from makim.remote import RemoteCache, get_remote_cache
+
+# increase it when the format of the cache entries changes
+CACHE_FORMAT_VERSION = 1
+CACHE_MAX_SIZE_DEFAULT = 1024**3
+CACHE_PREFETCH_JOBS = 8
+
+# files of an entry, stored and downloaded together
+ENTRY_FILES = ('outputs.tar.gz', 'stdout.log', 'stderr.log', 'meta.json')
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_size(value: str) -> int:
+    """Convert a size like `512M` or `2G` to a number of bytes."""
+    value = str(value).strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+    number = value[: len(value) - len(unit)]
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f'The given size `{value}` is not valid.')
+
+
+def format_size(size: float) -> str:
+    """Format a number of bytes for humans."""
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < SIZE_UNITS['K']:
+            return f'{size:.1f}{unit}'
+        size /= SIZE_UNITS['K']
+    return f'{size:.1f}T'
+
+
+def get_cache_dir() -> Path:
+    """Return the directory used by the makim cache."""
+    cache_dir = os.environ.get('MAKIM_CACHE_DIR')
+    if cache_dir:
+        return Path(cache_dir)
+    xdg_cache = os.environ.get('XDG_CACHE_HOME', '')
+    return Path(xdg_cache or Path.home() / '.cache') / 'makim'
+
+
+def hash_file(path: str) -> str:
+    """Return the sha256 of the content of the given file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024**2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_cache_key(target_data: dict, inputs: List[str]) -> str:
+    """
+    Compute the key for the result of a target execution.
+
+    `target_data` holds everything that defines the execution (rendered
+    command, env, vars, shell and outputs). `inputs` is the list of the
+    input files (already expanded), their content is part of the key.
+    """
+    data = {
+        'version': CACHE_FORMAT_VERSION,
+        'target': target_data,
+        'inputs': {path: hash_file(path) for path in sorted(set(inputs))},
+    }
+    content = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+
+def _extract_tar(tar: Any, path: str):
+    """
+    Extract the tarball of a cache entry, that can come from a remote cache.
+
+    Without the `data` filter (Python < 3.12 and old patch releases), the
+    members with absolute paths, `..`, links outside of the tarball or
+    special files are rejected.
+    """
+    import tarfile
+
+    if hasattr(tarfile, 'data_filter'):
+        tar.extractall(path, filter='data')
+        return
+
+    for member in tar.getmembers():
+        names = [member.name]
+        if member.issym():
+            names.append(
+                os.path.join(os.path.dirname(member.name), member.linkname)
+            )
+        elif member.islnk():
+            names.append(member.linkname)
+        is_supported = member.isreg() or member.isdir() or member.issym()
+        if not (is_supported or member.islnk()) or any(
+            os.path.isabs(name)
+            or os.path.normpath(name).split(os.sep)[0] == '..'
+            for name in names
+        ):
+            raise tarfile.TarError(f'Unsafe member in the tarball: {member}')
+    tar.extractall(path)
+
+
+class TaskCache:
+    """
+    Local cache of target results, indexed by the cache key.
+
+    Each entry stores the output files of the target (as a compressed
+    tarball) and its stdout/stderr. The least recently used entries are
+    removed when the total size of the cache is bigger than `max_size`.
+
+    With a `remote` cache (by default, the one from `$MAKIM_REMOTE_CACHE`),
+    the entries missing locally are downloaded from it, and the new
+    entries are uploaded to it.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_size: Optional[int] = None,
+        remote: Optional[RemoteCache] = None,
+    ):
+        self.path = path or get_cache_dir()
+        self.remote = remote or get_remote_cache()
+        # keys missing in the remote cache, found by the last prefetch
+        self._remote_misses: Set[str] = set()
+        if max_size is None:
+            env_max_size = os.environ.get('MAKIM_CACHE_MAX_SIZE')
+            max_size = (
+                parse_size(env_max_size)
+                if env_max_size
+                else CACHE_MAX_SIZE_DEFAULT
+            )
+        self.max_size = max_size
+
+    @property
+    def entries_path(self) -> Path:
+        """Return the directory with all the cache entries."""
+        return self.path / 'entries'
+
+    def _entry_path(self, key: str) -> Path:
+        return self.entries_path / key[:2] / key
+
+    def _read_metadata(self, entry_path: Path) -> dict:
+        with open(entry_path / 'meta.json') as f:
+            return json.load(f)
+
+    def _write_metadata(self, entry_path: Path, metadata: dict):
+        with open(entry_path / 'meta.json', 'w') as f:
+            json.dump(metadata, f)
+
+    def _list_entries(self) -> List[Tuple[Path, dict]]:
+        entries = []
+        for meta_path in self.entries_path.glob('*/*/meta.json'):
+            try:
+                with open(meta_path) as f:
+                    entries.append((meta_path.parent, json.load(f)))
+            except (OSError, ValueError):
+                # incomplete or broken entry
+                shutil.rmtree(meta_path.parent, ignore_errors=True)
+        return entries
+
+    def has(self, key: str) -> bool:
+        """Check if there is an entry for the given key."""
+        return (self._entry_path(key) / 'meta.json').exists()
+
+    def restore(
+        self, key: str, outputs: List[Path]
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Restore the outputs of the entry for the given key.
+
+        Returns the stdout and stderr of the cached execution, or None when
+        there is no entry for the given key.
+        """
+        import tarfile
+
+        entry_path = self._entry_path(key)
+        if not self.fetch(key):
+            return None
+
+        with tempfile.TemporaryDirectory(dir=self.path) as tmp_dir:
+            # note: the entry is checked and extracted before any output is
+            #       replaced, a broken entry is just a cache miss
+            try:
+                metadata = self._read_metadata(entry_path)
+                logs = (
+                    (entry_path / 'stdout.log').read_text(),
+                    (entry_path / 'stderr.log').read_text(),
+                )
+                with tarfile.open(entry_path / 'outputs.tar.gz') as tar:
+                    _extract_tar(tar, tmp_dir)
+                sources = [
+                    Path(tmp_dir) / str(index) for index in range(len(outputs))
+                ]
+                if not all(os.path.lexists(path) for path in sources):
+                    raise ValueError('Missing outputs in the cache entry.')
+            except (OSError, ValueError, EOFError, tarfile.TarError):
+                shutil.rmtree(entry_path, ignore_errors=True)
+                return None
+
+            for source, output in zip(sources, outputs):
+                if output.is_dir():
+                    shutil.rmtree(output)
+                elif output.exists():
+                    output.unlink()
+                output.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(source), str(output))
+
+        metadata['last_access'] = time.time()
+        self._write_metadata(entry_path, metadata)
+        return logs
+
+    def store(
+        self,
+        key: str,
+        target: str,
+        outputs: List[Path],
+        stdout: str,
+        stderr: str,
+    ):
+        """Store the outputs and logs of a target execution."""
+        import tarfile
+
+        self.entries_path.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(key)
+        # write the entry in a temporary directory first, so an entry is
+        # never visible while incomplete
+        tmp_path = Path(tempfile.mkdtemp(dir=self.entries_path))
+        try:
+            with tarfile.open(tmp_path / 'outputs.tar.gz', 'w:gz') as tar:
+                for index, output in enumerate(outputs):
+                    tar.add(str(output), arcname=str(index))
+            (tmp_path / 'stdout.log').write_text(stdout)
+            (tmp_path / 'stderr.log').write_text(stderr)
+            size = sum(
+                f.stat().st_size for f in tmp_path.iterdir() if f.is_file()
+            )
+            now = time.time()
+            self._write_metadata(
+                tmp_path,
+                {
+                    'target': target,
+                    'size': size,
+                    'created': now,
+                    'last_access': now,
+                },
+            )
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            if entry_path.exists():
+                shutil.rmtree(entry_path)
+            tmp_path.rename(entry_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        if self.remote and not self.remote.read_only:
+            self.remote.put(key, self._pack_entry(entry_path))
+        self.prune()
+
+    def _pack_entry(self, entry_path: Path) -> bytes:
+        """Return the files of the entry as a compressed tarball."""
+        import io
+        import tarfile
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            for name in ENTRY_FILES:
+                tar.add(str(entry_path / name), arcname=name)
+        return buffer.getvalue()
+
+    def _unpack_entry(self, key: str, data: bytes) -> bool:
+        """Add an entry downloaded from the remote cache."""
+        import io
+        import tarfile
+
+        self.entries_path.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(key)
+        tmp_path = Path(tempfile.mkdtemp(dir=self.entries_path))
+        try:
+            with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                for name in ENTRY_FILES:
+                    source = tar.extractfile(name)
+                    if source is None:
+                        return False
+                    (tmp_path / name).write_bytes(source.read())
+            metadata = self._read_metadata(tmp_path)
+            metadata['last_access'] = time.time()
+            self._write_metadata(tmp_path, metadata)
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            if not entry_path.exists():
+                tmp_path.rename(entry_path)
+            return True
+        except (OSError, ValueError, KeyError, EOFError, tarfile.TarError):
+            # broken entry, handled as a cache miss
+            return False
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def fetch(self, key: str) -> bool:
+        """
+        Check if there is an entry for the given key, locally or remotely.
+
+        An entry found only in the remote cache is downloaded.
+        """
+        if self.has(key):
+            return True
+        if not self.remote or key in self._remote_misses:
+            return False
+        return self._download(self.remote, key)
+
+    def _download(self, remote: RemoteCache, key: str) -> bool:
+        data = remote.get(key)
+        return data is not None and self._unpack_entry(key, data)
+
+    def prefetch(self, keys: Iterable[str]) -> int:
+        """
+        Download the given entries from the remote cache, concurrently.
+
+        Returns the number of entries downloaded. The keys missing in the
+        remote cache are not requested again by `fetch`.
+        """
+        remote = self.remote
+        missing = [key for key in set(keys) if not self.has(key)]
+        if not remote or not missing:
+            return 0
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(
+            min(CACHE_PREFETCH_JOBS, len(missing))
+        ) as executor:
+            found = list(
+                executor.map(lambda key: self._download(remote, key), missing)
+            )
+        self._remote_misses = {
+            key for key, ok in zip(missing, found) if not ok
+        }
+        self.prune()
+        return sum(found)
+
+    def stats(self) -> dict:
+        """Return the statistics about the cache usage."""
+        entries = self._list_entries()
+        return {
+            'path': str(self.path),
+            'entries': len(entries),
+            'size': sum(metadata['size'] for _, metadata in entries),
+            'max_size': self.max_size,
+        }
+
+    def prune(self, max_size: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Remove the least recently used entries until the cache fits.
+
+        Returns the number of entries and bytes removed.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(
+            self._list_entries(), key=lambda entry: entry[1]['last_access']
+        )
+        total_size = sum(metadata['size'] for _, metadata in entries)
+
+        removed, removed_size = 0, 0
+        for entry_path, metadata in entries:
+            if total_size <= max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= metadata['size']
+            removed += 1
+            removed_size += metadata['size']
+        return removed, removed_size
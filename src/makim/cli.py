@@ -1,11 +1,20 @@
-"""Cli functions to define the arguments and to call Makim."""
+"""
+Cli functions to define the arguments and to call Makim.
+
+Only the light modules are imported at the module level: the version and
+the help text are shown without importing the modules used to run the
+targets. The help text for the targets is built only when it is shown.
+"""
 import argparse
 import os
 import sys
 
 from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
-from makim import Makim, __version__
+from makim import __version__
+from makim.config import get_target_index, load_config
+from makim.output import OUTPUT_LOG_DIR, OUTPUT_MODES
 
 
 class CustomHelpFormatter(argparse.RawTextHelpFormatter):
@@ -33,13 +42,92 @@ class CustomHelpFormatter(argparse.RawTextHelpFormatter):
         )
 
 
-makim = Makim()
+def _get_targets_help(makim_file: str, name: Optional[str] = None) -> str:
+    """
+    Return the help text for the targets of the given makim file.
+
+    `name` filters the help text by a group (e.g. `tests`) or by a target
+    (e.g. `tests.lint`).
+    """
+    if not Path(makim_file).exists():
+        return ''
+
+    global_data = load_config(makim_file)
+    group_filter, _, target_filter = (name or '').partition('.')
+    target_help = []
+    groups = global_data.get('groups', {})
+    for group in groups:
+        if group_filter and group != group_filter:
+            continue
+        target_help.append('\n' + group + ':')
+        target_help.append('-' * (len(group) + 1))
+        for target_name, target_data in groups[group]['targets'].items():
+            if target_filter and target_name != target_filter:
+                continue
+            target_name_qualified = f'{group}.{target_name}'
+            help_text = target_data['help'] if 'help' in target_data else ''
+            target_help.append(f'  {target_name_qualified} => {help_text}')
+
+            if 'args' in target_data:
+                target_help.append('    ARGS:')
+
+                for arg_name, arg_data in target_data['args'].items():
+                    target_help.append(
+                        f'      --{arg_name}: ({arg_data["type"]}) '
+                        f'{arg_data["help"]}'
+                    )
+
+    if name and not target_help:
+        target_help.append(f'\nNo group or target found for `{name}`.')
+    return '\n'.join(target_help)
+
+
+def _parse_memory(value: str) -> str:
+    """Check a memory size given as an argument, e.g. `16G`."""
+    from makim.resources import parse_size
+
+    try:
+        parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def _parse_jobs(value: str) -> int:
+    """Parse the number of jobs, where 0 is the number of CPUs."""
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = -1
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(
+            f'invalid number of jobs `{value}`, it should be 0 (the number '
+            'of CPUs) or more.'
+        )
+    return jobs
+
+
+def _parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard given as `INDEX/COUNT`, e.g. `1/4`."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        index, count = 0, 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            f'invalid shard `{value}`, it should be INDEX/COUNT, '
+            'with 1 <= INDEX <= COUNT.'
+        )
+    return index, count
 
 
-def _get_args():
+def _get_args(targets_help: str = ''):
     """
     Define the arguments for the CLI.
 
+    The help text for the targets (`targets_help`) is built just when the
+    help is shown, see `_get_targets_help`.
+
     note: when added new flags, update the list of flags to be
           skipped at extract_makim_args function.
     """
@@ -62,7 +150,10 @@ def _get_args():
         '--help',
         '-h',
         action='store_true',
-        help='Show the help menu',
+        help=(
+            'Show the help menu. Use `--help <group>` to show just the '
+            'targets of the given group.'
+        ),
     )
 
     parser.add_argument(
@@ -84,67 +175,348 @@ def _get_args():
     )
 
     parser.add_argument(
-        '--makim-file',
+        '--force',
+        action='store_true',
+        help='Run the targets even when their outputs are up to date.',
+    )
+
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=_parse_jobs,
+        default=None,
+        help=(
+            'Number of targets (dependencies) to run in parallel. '
+            'Use 0 for the number of CPUs.'
+        ),
+    )
+
+    parser.add_argument(
+        '--cpus',
+        type=float,
+        default=None,
+        help=(
+            'CPUs available for the targets running at the same time, see '
+            'the `resources`\nattribute of the targets.'
+        ),
+    )
+
+    parser.add_argument(
+        '--memory',
+        type=_parse_memory,
+        default=None,
+        help=(
+            'Memory available for the targets running at the same time '
+            '(e.g. 16G), see the\n`resources` attribute of the targets.'
+        ),
+    )
+
+    parser.add_argument(
+        '--limit-resources',
+        action='store_true',
+        help=(
+            'Limit the memory of each target process to its `resources` '
+            '(Linux).'
+        ),
+    )
+
+    parser.add_argument(
+        '--keep-going',
+        action='store_true',
+        help=(
+            "Keep running the targets that don't depend on a failed one, "
+            'instead of stopping at the first failure.'
+        ),
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Don't use the cache for the targets results.",
+    )
+
+    parser.add_argument(
+        '--remote-cache',
         type=str,
-        default=makim_file_default,
-        help='Specify a custom location for the makim file.',
+        default=None,
+        help=(
+            'URL of the remote cache shared by the machines, e.g. '
+            'http://cache:8080/makim (default: $MAKIM_REMOTE_CACHE).'
+        ),
     )
 
-    try:
-        idx = sys.argv.index('--makim-file')
-        makim_file = sys.argv[idx + 1]
-    except ValueError:
-        makim_file = makim_file_default
+    parser.add_argument(
+        '--remote-cache-read-only',
+        action='store_true',
+        help=(
+            'Download the entries of the remote cache, but never upload '
+            'them (e.g. for untrusted branches).'
+        ),
+    )
 
-    makim.load(makim_file)
-    target_help = []
-    groups = makim.global_data.get('groups', [])
-    for group in groups:
-        target_help.append('\n' + group + ':')
-        target_help.append('-' * (len(group) + 1))
-        for target_name, target_data in groups[group]['targets'].items():
-            target_name_qualified = f'{group}.{target_name}'
-            help_text = target_data['help'] if 'help' in target_data else ''
-            target_help.append(f'  {target_name_qualified} => {help_text}')
+    parser.add_argument(
+        '--shell-worker',
+        action='store_true',
+        help=(
+            'Run the targets scripts in a persistent shell worker, so the '
+            'shell is started just once (useful mainly for xonsh).'
+        ),
+    )
 
-            if 'args' in target_data:
-                target_help.append('    ARGS:')
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help=(
+            'Run the Makim daemon, which keeps Makim warm for the next '
+            'calls of the current user.'
+        ),
+    )
 
-                for arg_name, arg_data in target_data['args'].items():
-                    target_help.append(
-                        f'      --{arg_name}: ({arg_data["type"]}) '
-                        f'{arg_data["help"]}'
-                    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help=(
+            'Run the target again when its `inputs` (or `watch`) files, or '
+            'the config file, change.'
+        ),
+    )
 
     parser.add_argument(
-        'target',
-        nargs='?',
+        '--profile',
+        action='store_true',
+        help='Show how long each phase and target took.',
+    )
+
+    parser.add_argument(
+        '--profile-out',
+        type=str,
+        default=None,
+        help=(
+            'Write the profile as a Chrome trace-event JSON file '
+            '(see chrome://tracing or https://ui.perfetto.dev).'
+        ),
+    )
+
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help=(
+            'Show the execution plan as JSON (targets, dependencies, '
+            'commands, working\ndirectories and env), without running it.'
+        ),
+    )
+
+    parser.add_argument(
+        '--shard',
+        type=_parse_shard,
         default=None,
         help=(
-            'Specify the target command to be performed. Options are:\n'
-            + '\n'.join(target_help)
+            'Run just one part of the targets, given as INDEX/COUNT (e.g. '
+            '1/4), to split\nthe targets across CI jobs.'
+        ),
+    )
+
+    parser.add_argument(
+        '--shard-durations',
+        type=str,
+        default=None,
+        help=(
+            'Balance the shards by the durations of a plan exported with '
+            '--plan (e.g. by\na setup CI job), so all the jobs compute the '
+            'same split.'
+        ),
+    )
+
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help=(
+            'Show the number of executions and the p50/p95 durations of '
+            'the targets.'
+        ),
+    )
+
+    parser.add_argument(
+        '--output',
+        choices=OUTPUT_MODES,
+        default='stream',
+        help=(
+            'How to show the output of the targets: `stream` (default), '
+            '`prefix` (each line\nprefixed by the target name), `group` '
+            '(the whole output of each target when\nit ends) or `log` (in '
+            'one log file for each target, see --log-dir).'
+        ),
+    )
+
+    parser.add_argument(
+        '--log-dir',
+        type=str,
+        default=OUTPUT_LOG_DIR,
+        help='Directory for the log files of `--output log`.',
+    )
+
+    parser.add_argument(
+        '--makim-file',
+        type=str,
+        default=makim_file_default,
+        help='Specify a custom location for the makim file.',
+    )
+
+    parser.add_argument(
+        'target',
+        nargs='*',
+        default=[],
+        help=(
+            'Specify the target commands to be performed, use `--` to '
+            'separate\nthe targets with arguments. Options are:\n'
+            + targets_help
         ),
     )
 
     return parser
 
 
+def _get_cache_args():
+    """Define the arguments for the `makim cache` command."""
+    parser = argparse.ArgumentParser(
+        prog='makim cache',
+        description='Manage the cache for the targets results.',
+        formatter_class=CustomHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Show the cache usage.')
+    prune_parser = subparsers.add_parser(
+        'prune', help='Remove the least recently used cache entries.'
+    )
+    prune_parser.add_argument(
+        '--max-size',
+        type=str,
+        default=None,
+        help=(
+            'Size of the cache after pruning (e.g. 500M), the default is '
+            'the configured maximum size. Use 0 to remove all the entries.'
+        ),
+    )
+    serve_parser = subparsers.add_parser(
+        'serve', help='Run a server for the remote cache (HTTP GET/PUT).'
+    )
+    serve_parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='Address of the server, the default is 127.0.0.1.',
+    )
+    serve_parser.add_argument(
+        '--port',
+        type=int,
+        default=8080,
+        help='Port of the server, the default is 8080.',
+    )
+    serve_parser.add_argument(
+        '--path',
+        type=str,
+        default=None,
+        help=(
+            'Directory for the entries, the default is `remote` in the '
+            'cache directory.'
+        ),
+    )
+    return parser
+
+
+def serve_cache(args: argparse.Namespace):
+    """Run the reference server for the remote cache."""
+    from makim.cache import get_cache_dir
+    from makim.remote import make_server
+
+    path = Path(args.path) if args.path else get_cache_dir() / 'remote'
+    server = make_server(path, args.host, args.port, verbose=True)
+    host, port = server.server_address[:2]
+    print(f'Serving the remote cache from {path} on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def cache_app(argv: list):
+    """Call the `makim cache` command."""
+    from makim.cache import TaskCache, format_size, parse_size
+
+    args = _get_cache_args().parse_args(argv)
+    if args.command == 'serve':
+        return serve_cache(args)
+
+    cache = TaskCache()
+
+    if args.command == 'stats':
+        stats = cache.stats()
+        print(f'Cache directory: {stats["path"]}')
+        print(f'Entries: {stats["entries"]}')
+        print(
+            f'Size: {format_size(stats["size"])} '
+            f'(max: {format_size(stats["max_size"])})'
+        )
+        return
+
+    max_size = None if args.max_size is None else parse_size(args.max_size)
+    removed, removed_size = cache.prune(max_size)
+    print(f'Removed {removed} entries ({format_size(removed_size)}).')
+
+
+def show_stats(makim_file: str):
+    """Show the durations of the targets, from the duration history."""
+    from makim.history import DurationHistory
+
+    stats = DurationHistory().stats(str(Path(makim_file).resolve()))
+    if not stats:
+        print('No target executions recorded for this config file yet.')
+        return
+    print(f'{"TARGET":<50} {"runs":>6} {"p50 s":>9} {"p95 s":>9}')
+    print('-' * 77)
+    for target, runs, p50, p95 in stats:
+        print(f'{target[:50]:<50} {runs:>6} {p50:>9.2f} {p95:>9.2f}')
+
+
 def show_version():
     """Show version."""
     print(__version__)
 
 
-def extract_makim_args():
-    """Extract makim arguments from the CLI call."""
+def extract_makim_args(argv: Optional[List[str]] = None):
+    """Extract makim arguments from the CLI call (or the given `argv`)."""
+    argv = sys.argv if argv is None else argv
     makim_args = {}
     index_to_remove = []
-    for ind, arg in enumerate(list(sys.argv)):
+    for ind, arg in enumerate(list(argv)):
         if arg in [
             '--help',
             '--version',
             '--verbose',
             '--makim-file',
             '--dry-run',
+            '--force',
+            '--jobs',
+            '--keep-going',
+            '--no-cache',
+            '--remote-cache',
+            '--remote-cache-read-only',
+            '--shell-worker',
+            '--profile',
+            '--profile-out',
+            '--watch',
+            '--daemon',
+            '--output',
+            '--log-dir',
+            '--stats',
+            '--plan',
+            '--shard',
+            '--shard-durations',
+            '--cpus',
+            '--memory',
+            '--limit-resources',
         ]:
             continue
 
@@ -154,46 +526,120 @@ def extract_makim_args():
         index_to_remove.append(ind)
 
         arg_name = None
-        arg_value = None
+        arg_value: Union[str, bool, None] = None
 
         next_ind = ind + 1
 
-        arg_name = sys.argv[ind]
+        arg_name = argv[ind]
 
         if (
-            len(sys.argv) == next_ind
-            or len(sys.argv) > next_ind
-            and sys.argv[next_ind].startswith('--')
+            len(argv) == next_ind
+            or len(argv) > next_ind
+            and argv[next_ind].startswith('--')
         ):
             arg_value = True
         else:
-            arg_value = sys.argv[next_ind]
+            arg_value = argv[next_ind]
             index_to_remove.append(next_ind)
 
         makim_args[arg_name] = arg_value
 
-    # remove exclusive makim flags from original sys.argv
+    # remove exclusive makim flags from original argv
     for ind in sorted(index_to_remove, reverse=True):
-        sys.argv.pop(ind)
+        argv.pop(ind)
 
     return makim_args
 
 
+def _split_calls(argv: list) -> list:
+    """Split the CLI arguments by `--`, in groups of targets."""
+    calls: list = [[]]
+    for arg in argv:
+        if arg == '--':
+            calls.append([])
+        else:
+            calls[-1].append(arg)
+    return calls
+
+
+def _has_target(argv: List[str], name: str) -> bool:
+    """Check if the config file given by `argv` has the given target."""
+    makim_file = str(Path(os.getcwd()) / '.makim.yaml')
+    if '--makim-file' in argv[:-1]:
+        makim_file = argv[argv.index('--makim-file') + 1]
+    try:
+        data = load_config(makim_file)
+    except Exception:
+        # note: a missing or broken config file has no targets
+        return False
+
+    groups = data.get('groups') or {}
+    if len(groups) == 1:
+        group_data = next(iter(groups.values())) or {}
+        return name in (group_data.get('targets') or {})
+    return f'default.{name}' in get_target_index(data)
+
+
 def app():
     """Call the makim program with the arguments defined by the user."""
-    makim_args = extract_makim_args()
+    # note: a target called `cache` (in a config with a single group) has
+    #       precedence over the `makim cache` command
+    if sys.argv[1:2] == ['cache'] and not _has_target(sys.argv, 'cache'):
+        return cache_app(sys.argv[2:])
+
+    # fast path: the version doesn't depend on the config file
+    if '--version' in sys.argv[1:]:
+        return show_version()
+
+    # note: each group of targets has its own arguments, e.g.
+    #       `makim tests.unit --cov true -- docs.build`
+    calls = _split_calls(sys.argv[1:])
+    calls_args = [extract_makim_args(call) for call in calls]
     args_parser = _get_args()
-    args = args_parser.parse_args()
+    args = args_parser.parse_args([arg for call in calls for arg in call])
 
     if args.version:
         return show_version()
 
+    if args.daemon:
+        from makim.daemon import serve
+
+        sys.exit(serve())
+
+    if args.stats:
+        return show_stats(args.makim_file)
+
     if not args.target or args.help:
-        return args_parser.print_help()
+        targets_help = _get_targets_help(
+            args.makim_file,
+            args.target[0] if args.help and args.target else None,
+        )
+        return _get_args(targets_help).print_help()
+
+    if args.profile or args.profile_out:
+        from makim import profiler
+
+        profiler.enable()
 
-    if args.help:
-        return args_parser.print_help()
+    from makim.errors import MakimRunError
+    from makim.makim import Makim
 
-    makim.load(args.makim_file)
-    makim_args.update(dict(args._get_kwargs()))
-    return makim.run(makim_args)
+    makim = Makim()
+    kwargs = dict(args._get_kwargs())
+    targets_args = []
+    for call, call_args in zip(calls, calls_args):
+        targets = (
+            args_parser.parse_args(call).target
+            if len(calls) > 1
+            else args.target
+        )
+        targets_args.extend(
+            {**call_args, **kwargs, 'target': target} for target in targets
+        )
+    try:
+        makim.load(args.makim_file)
+        run = makim.watch if args.watch else makim.run
+        return run(targets_args)
+    except MakimRunError as e:
+        # note: the error was already shown
+        sys.exit(e.error.value)
@@ -0,0 +1,144 @@
+"""
+Load the makim config file.
+
+Parsing a big config file with PyYAML is slow, so the parsed data is cached
+in memory (once per process) and on disk (across processes). Both caches
+are keyed by the path, modification time and size of the config file, and
+by the makim version. With a warm cache, `yaml` is not even imported.
+"""
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from makim import __version__
+from makim.cache import get_cache_dir
+
+ConfigKey = Tuple[str, int, int, str]
+
+# parsed config files for the current process
+_configs: Dict[ConfigKey, dict] = {}
+# parsed .env files for the current process
+_env_files: Dict[ConfigKey, Dict[str, Optional[str]]] = {}
+
+
+def escape_template_tag(v: str) -> str:
+    """Escape template tag when processing the template config file."""
+    return v.replace('{{', r'\{\{').replace('}}', r'\}\}')
+
+
+def unescape_template_tag(v: str) -> str:
+    """Unescape template tag when processing the template config file."""
+    return v.replace(r'\{\{', '{{').replace(r'\}\}', '}}')
+
+
+def _get_config_key(makim_file: str) -> ConfigKey:
+    path = Path(makim_file).resolve()
+    stat = path.stat()
+    return (str(path), stat.st_mtime_ns, stat.st_size, __version__)
+
+
+def _get_cache_path(key: ConfigKey) -> Path:
+    path_hash = hashlib.sha256(key[0].encode('utf8')).hexdigest()
+    return get_cache_dir() / 'configs' / f'{path_hash}.pickle'
+
+
+def _read_cache(key: ConfigKey):
+    try:
+        with open(_get_cache_path(key), 'rb') as f:
+            # the cache file is created by makim inside the user cache dir
+            cached_key, data = pickle.load(f)  # nosec
+    except Exception:
+        return None
+    return data if tuple(cached_key) == key else None
+
+
+def _write_cache(key: ConfigKey, data: dict):
+    cache_path = _get_cache_path(key)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # the cache is just an optimization, ignore read-only locations
+        pass
+
+
+def parse_config(content: str) -> dict:
+    """Parse the content of a makim config file."""
+    import yaml  # type: ignore
+
+    # use the libyaml loader when it is available, it is much faster
+    SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+    # escape template tags
+    content_io = io.StringIO(escape_template_tag(content))
+    return yaml.load(content_io, Loader=SafeLoader)  # nosec
+
+
+def load_config(makim_file: str, use_cache: bool = True) -> dict:
+    """
+    Load the data from the given makim config file.
+
+    The returned data is shared by all the callers, so it should be treated
+    as read-only.
+    """
+    key = _get_config_key(makim_file)
+
+    if use_cache:
+        data = _configs.get(key) or _read_cache(key)
+        if data is not None:
+            _configs[key] = data
+            return data
+
+    with open(makim_file, 'r') as f:
+        data = parse_config(f.read())
+
+    if use_cache:
+        # drop the outdated versions of the file (e.g. in `--daemon`)
+        # note: the keys are copied at once, the file can be loaded by
+        #       other threads at the same time
+        for stale_key in [k for k in list(_configs) if k[0] == key[0]]:
+            _configs.pop(stale_key, None)
+        _configs[key] = data
+        _write_cache(key, data)
+    return data
+
+
+def get_target_index(data: dict) -> Dict[str, dict]:
+    """Return the targets of the given config by qualified name."""
+    return {
+        f'{group_name}.{target_name}': target_data
+        for group_name, group_data in data.get('groups', {}).items()
+        for target_name, target_data in group_data.get('targets', {}).items()
+    }
+
+
+def load_env_file(env_file: str) -> Dict[str, Optional[str]]:
+    """
+    Load the variables from the given .env file.
+
+    The parsed files are cached in memory, so a .env file used by many
+    targets is read just once. The returned data should be treated as
+    read-only.
+    """
+    key = _get_config_key(env_file)
+    data = _env_files.get(key)
+    if data is None:
+        import dotenv
+
+        data = dict(dotenv.dotenv_values(env_file))
+        _env_files[key] = data
+    return data
+
+
+def clear_config_cache():
+    """Clear the in-process cache for the parsed config and .env files."""
+    _configs.clear()
+    _env_files.clear()
@@ -0,0 +1,362 @@
+"""
+Makim daemon, to keep makim warm across CLI calls (`makim --daemon`).
+
+Each `makim` call pays the Python startup, the imports, the config parsing
+and the shell resolution. The daemon is a long-lived process, listening on
+a per-user Unix socket, that has the heavy modules already imported and
+keeps the parsed config files in memory (invalidated by their modification
+time).
+
+When the daemon is running, the `makim` CLI is just a thin client: it
+sends its arguments, working directory, environment variables and stdio
+file descriptors to the daemon, which runs the call in a forked child
+process, and then it exits with the exit code of that call. When there is
+no daemon (or it can't handle the call), the CLI runs the call itself.
+"""
+import os
+import signal
+import socket
+import struct
+import sys
+
+from pathlib import Path
+from typing import Any, List, Optional
+
+from makim import __version__
+from makim.ipc import recv_message, send_message
+
+# modules imported lazily by makim, preloaded by the daemon
+PRELOAD_MODULES = (
+    'colorama',
+    'dotenv',
+    'jinja2',
+    'makim.makim',
+    'sh',
+    'yaml',
+)
+# signals sent to the client that are forwarded to the makim call
+FORWARD_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+PEERCRED = struct.Struct('3i')
+# max time to receive a call from a client, in seconds
+REQUEST_TIMEOUT = 5.0
+
+
+def get_socket_path() -> Path:
+    """Return the path of the daemon socket for the current user."""
+    socket_path = os.environ.get('MAKIM_DAEMON_SOCKET', '')
+    if socket_path:
+        return Path(socket_path)
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        import tempfile
+
+        runtime_dir = tempfile.gettempdir()
+    return Path(runtime_dir) / f'makim-{os.getuid()}' / 'daemon.sock'
+
+
+# client side
+
+
+def _connect(socket_path: Path) -> Optional[socket.socket]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _start_call(sock: socket.socket, argv: List[str]) -> bool:
+    """Send the call to the daemon, return False if it was rejected."""
+    try:
+        send_message(
+            sock,
+            {
+                'version': __version__,
+                'argv': argv,
+                'cwd': os.getcwd(),
+                'env': dict(os.environ),
+            },
+            [0, 1, 2],
+        )
+        message, _ = recv_message(sock)
+    except OSError:
+        return False
+    return message is not None and 'pid' in message
+
+
+def forward(argv: List[str]) -> Optional[int]:
+    """
+    Run the makim call in the daemon and return its exit code.
+
+    Returns None when there is no daemon running for the current user (or
+    when `MAKIM_NO_DAEMON` is set), so the call should run in the current
+    process.
+    """
+    if os.environ.get('MAKIM_NO_DAEMON', '') not in ('', '0'):
+        return None
+    socket_path = get_socket_path()
+    # note: checking the path first is faster than trying to connect
+    if not socket_path.exists():
+        return None
+    sock = _connect(socket_path)
+    if sock is None:
+        return None
+
+    with sock:
+        if not _start_call(sock, argv):
+            return None
+
+        # from now on, the call belongs to the daemon
+        def forward_signal(signum, frame):
+            try:
+                send_message(sock, {'signal': signum})
+            except OSError:
+                pass
+
+        handlers = {
+            signum: signal.signal(signum, forward_signal)
+            for signum in FORWARD_SIGNALS
+        }
+        try:
+            message, _ = recv_message(sock)
+        except OSError:
+            message = None
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    if message is None:
+        print('[EE] The makim daemon connection was lost.', file=sys.stderr)
+        return 1
+    returncode = message['returncode']
+    return returncode if returncode >= 0 else 128 - returncode
+
+
+# daemon side
+
+
+def _preload():
+    import importlib
+
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    from makim.template import get_environment
+
+    get_environment()
+
+
+def _get_makim_file(request: dict) -> str:
+    argv = request['argv']
+    makim_file = '.makim.yaml'
+    if '--makim-file' in argv[:-1]:
+        makim_file = argv[argv.index('--makim-file') + 1]
+    return os.path.join(request['cwd'], makim_file)
+
+
+def _warm_config(request: dict):
+    """Parse the config file of the call, before forking the call."""
+    from makim.config import load_config
+
+    try:
+        load_config(_get_makim_file(request))
+    except Exception:
+        # note: the errors are reported by the makim call itself
+        pass
+
+
+def _run_call(request: dict, fds: List[int]):
+    import traceback
+
+    code = 1
+    try:
+        os.setsid()
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, 'w', buffering=1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = request['argv']
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        from makim.cli import app
+
+        try:
+            app()
+            code = 0
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+    except KeyboardInterrupt:
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _forward_signals(conn: socket.socket, pid: int, done: Any):
+    while True:
+        try:
+            message, _ = recv_message(conn)
+        except OSError:
+            message = None
+        if message is None or done.is_set():
+            return
+        try:
+            os.kill(pid, message['signal'])
+        except ProcessLookupError:
+            return
+
+
+def _wait_call(conn: socket.socket, pid: int):
+    import threading
+
+    done = threading.Event()
+    threading.Thread(
+        target=_forward_signals, args=(conn, pid, done), daemon=True
+    ).start()
+    _, status = os.waitpid(pid, 0)
+    done.set()
+    returncode = (
+        os.WEXITSTATUS(status)
+        if os.WIFEXITED(status)
+        else -os.WTERMSIG(status)
+    )
+    try:
+        send_message(conn, {'returncode': returncode})
+    except OSError:
+        pass
+    conn.close()
+
+
+def _get_peer_uid(conn: socket.socket) -> int:
+    peercred = getattr(socket, 'SO_PEERCRED', None)
+    if peercred is None:
+        # note: the socket directory is only accessible by the user
+        return os.getuid()
+    _, uid, _ = PEERCRED.unpack(
+        conn.getsockopt(socket.SOL_SOCKET, peercred, PEERCRED.size)
+    )
+    return uid
+
+
+def _handle(server: socket.socket, conn: socket.socket):
+    fds: List[int] = []
+    request = None
+    try:
+        # note: a stuck client should not block the daemon
+        conn.settimeout(REQUEST_TIMEOUT)
+        request, fds = recv_message(conn)
+        conn.settimeout(None)
+        if request is None or not (
+            isinstance(request, dict)
+            and _get_peer_uid(conn) == os.getuid()
+            and request.get('version') == __version__
+            and all(key in request for key in ('argv', 'cwd', 'env'))
+            and len(fds) == len(('stdin', 'stdout', 'stderr'))
+        ):
+            # the client runs the call by itself
+            send_message(conn, {'error': 'The call was rejected.'})
+            request = None
+    except (OSError, ValueError):
+        request = None
+    if request is None:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        return
+
+    _warm_config(request)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        server.close()
+        conn.close()
+        _run_call(request, fds)
+
+    import threading
+
+    for fd in fds:
+        os.close(fd)
+    try:
+        send_message(conn, {'pid': pid})
+    except OSError:
+        # note: the client is gone, so its call is interrupted (as with a
+        #       Ctrl+C); the call is still waited for by the thread
+        os.kill(pid, signal.SIGINT)
+    threading.Thread(target=_wait_call, args=(conn, pid), daemon=True).start()
+
+
+def _create_server(socket_path: Path) -> Optional[socket.socket]:
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stat = socket_path.parent.stat()
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        print(
+            f'[EE] The directory {socket_path.parent} should be accessible '
+            'only by the current user.',
+            file=sys.stderr,
+        )
+        return None
+
+    sock = _connect(socket_path)
+    if sock is not None:
+        sock.close()
+        print(
+            f'[EE] The makim daemon is already running ({socket_path}).',
+            file=sys.stderr,
+        )
+        return None
+    # a socket file left by a daemon that was killed
+    socket_path.unlink(missing_ok=True)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+
+def serve(socket_path: Optional[Path] = None) -> Any:
+    """Run the daemon until it is interrupted (Ctrl+C or SIGTERM)."""
+    socket_path = socket_path or get_socket_path()
+    server = _create_server(socket_path)
+    if server is None:
+        return 1
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    _preload()
+    print(f'[II] Makim daemon listening on {socket_path}', flush=True)
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                _handle(server, conn)
+            except OSError:
+                # note: a broken connection doesn't stop the daemon
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        socket_path.unlink(missing_ok=True)
+    return 0
@@ -1,5 +1,6 @@
 """Classes and function for handling logs."""
 from enum import Enum
+from typing import Optional
 
 
 class MakimError(Enum):
@@ -14,3 +15,38 @@ class MakimError(Enum):
     MAKIM_VARS_ATTRIBUTE_INVALID = 7
     MAKIM_ARGUMENT_REQUIRED = 8
     MAKIM_ENV_FILE_NOT_FOUND = 9
+    MAKIM_DEPENDENCY_CYCLE = 10
+    MAKIM_MATRIX_INVALID = 11
+    MAKIM_RESOURCES_INVALID = 12
+    MAKIM_SHARD_DURATIONS_INVALID = 13
+
+
+class MakimShellError(Exception):
+    """Error raised when the shell script of a target fails."""
+
+    def __init__(self, shell: str, returncode: int):
+        self.shell = shell
+        self.returncode = returncode
+        super().__init__(
+            f'The shell script for `{shell}` exited with code {returncode}.'
+        )
+
+
+class MakimTimeoutError(Exception):
+    """Error raised when a target runs for longer than its `timeout`."""
+
+    def __init__(self, target: str, timeout: Optional[float]):
+        self.target = target
+        self.timeout = timeout
+        super().__init__(
+            f'The target {target} was killed after {timeout}s '
+            '(timeout).'
+        )
+
+
+class MakimRunError(Exception):
+    """Error that stops a makim run, with the exit code for the CLI."""
+
+    def __init__(self, error: MakimError, message: str = ''):
+        self.error = error
+        super().__init__(message)
@@ -0,0 +1,143 @@
+"""
+Duration history of the targets.
+
+The wall time of each target execution is stored in a small SQLite
+database, inside the makim cache directory, keyed by the config file, the
+qualified name of the target and a hash of its arguments. It is used to
+start the slowest chains of targets first when running in parallel, and by
+`makim --stats`.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from makim.cache import get_cache_dir
+
+# executions kept for each target (and arguments)
+HISTORY_SIZE = 50
+
+HistoryKey = Tuple[str, str]
+
+
+def hash_args(args_input: dict) -> str:
+    """Return a short hash of the resolved arguments of a target."""
+    content = json.dumps(args_input, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf8')).hexdigest()[:16]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Return the given percentile (nearest rank) of the values."""
+    values = sorted(values)
+    rank = max(int(-(-len(values) * percent // 100)), 1)
+    return values[rank - 1]
+
+
+class DurationHistory:
+    """Store and query the durations of the target executions."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or get_cache_dir() / 'history.sqlite3'
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.path), timeout=5)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS durations ('
+            'makim_file TEXT, target TEXT, args_hash TEXT, '
+            'duration REAL, success INTEGER, finished_at REAL)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS durations_key '
+            'ON durations (makim_file, target, args_hash)'
+        )
+        return connection
+
+    def record(
+        self,
+        makim_file: str,
+        durations: Iterable[Tuple[str, str, float, bool]],
+    ):
+        """Store the (target, args hash, duration, success) executions."""
+        now = time.time()
+        rows = [
+            (makim_file, target, args_hash, duration, int(success), now)
+            for target, args_hash, duration, success in durations
+        ]
+        if not rows:
+            return
+        try:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    'INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?)', rows
+                )
+                # keep just the last executions of each target
+                connection.executemany(
+                    'DELETE FROM durations WHERE rowid IN ('
+                    'SELECT rowid FROM durations WHERE makim_file = ? '
+                    'AND target = ? AND args_hash = ? '
+                    'ORDER BY finished_at DESC LIMIT -1 OFFSET ?)',
+                    [
+                        (makim_file, target, args_hash, HISTORY_SIZE)
+                        for target, args_hash in {row[1:3] for row in rows}
+                    ],
+                )
+            connection.close()
+        except (OSError, sqlite3.Error):
+            # the history is just an optimization
+            pass
+
+    def _load(self, makim_file: str) -> List[Tuple[str, str, float]]:
+        if not self.path.exists():
+            return []
+        try:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT target, args_hash, duration FROM durations '
+                'WHERE makim_file = ? AND success = 1',
+                (makim_file,),
+            ).fetchall()
+            connection.close()
+        except (OSError, sqlite3.Error):
+            return []
+        return rows
+
+    def estimates(
+        self, makim_file: str
+    ) -> Tuple[Dict[HistoryKey, float], Dict[str, float]]:
+        """
+        Return the expected duration of the targets of the config file.
+
+        The first dict is the median duration by (target, args hash), the
+        second one is the median duration by target, for new arguments.
+        """
+        by_key: Dict[HistoryKey, List[float]] = {}
+        by_target: Dict[str, List[float]] = {}
+        for target, args_hash, duration in self._load(makim_file):
+            by_key.setdefault((target, args_hash), []).append(duration)
+            by_target.setdefault(target, []).append(duration)
+        return (
+            {k: percentile(v, 50) for k, v in by_key.items()},
+            {k: percentile(v, 50) for k, v in by_target.items()},
+        )
+
+    def stats(self, makim_file: str) -> List[Tuple[str, int, float, float]]:
+        """Return the executions, p50 and p95 durations of each target."""
+        by_target: Dict[str, List[float]] = {}
+        for target, _, duration in self._load(makim_file):
+            by_target.setdefault(target, []).append(duration)
+        return [
+            (
+                target,
+                len(durations),
+                percentile(durations, 50),
+                percentile(durations, 95),
+            )
+            for target, durations in sorted(by_target.items())
+        ]
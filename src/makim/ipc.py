@@ -0,0 +1,69 @@
+"""
+Messages over Unix sockets, used by the shell worker and the daemon.
+
+Each message is a JSON object prefixed by its size, and it can carry file
+descriptors (e.g. the stdio of a call) as ancillary data. This module is
+imported by the daemon client, so it should stay light.
+"""
+import array
+import json
+import socket
+import struct
+
+from typing import List, Optional, Sequence, Tuple
+
+# max file descriptors in a message: stdin, stdout and stderr
+MAX_FDS = 3
+HEADER = struct.Struct('!I')
+
+
+def send_message(
+    sock: socket.socket, data: dict, fds: Sequence[int] = ()
+) -> None:
+    """Send a message, with the given file descriptors."""
+    payload = json.dumps(data).encode('utf8')
+    message = HEADER.pack(len(payload)) + payload
+    if not fds:
+        sock.sendall(message)
+        return
+    # the file descriptors are attached to the first chunk of the message
+    sent = sock.sendmsg(
+        [message],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))],
+    )
+    sock.sendall(message[sent:])
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('The connection was closed.')
+        data += chunk
+    return data
+
+
+def recv_message(sock: socket.socket) -> Tuple[Optional[dict], List[int]]:
+    """Receive a message (None if closed) and its file descriptors."""
+    fds: List[int] = []
+    fds_size = socket.CMSG_SPACE(MAX_FDS * array.array('i').itemsize)
+    header = b''
+    while len(header) < HEADER.size:
+        data, ancdata, _, _ = sock.recvmsg(
+            HEADER.size - len(header),
+            fds_size,
+            getattr(socket, 'MSG_CMSG_CLOEXEC', 0),
+        )
+        if not data:
+            return None, fds
+        header += data
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds_array = array.array('i')
+                fds_array.frombytes(
+                    cdata[: len(cdata) - len(cdata) % fds_array.itemsize]
+                )
+                fds.extend(fds_array)
+    (size,) = HEADER.unpack(header)
+    return json.loads(_recv_exactly(sock, size)), fds
@@ -4,113 +4,325 @@ Makim main class.
 `Makim` or just `makim` is based on `make` and focus on improve
 the way to define targets and dependencies. Instead of using the
 `Makefile` format, it uses `yaml` format.
+
+The heavy dependencies (`sh`, `jinja2`, `yaml`, `dotenv` and `colorama`)
+are imported only when they are needed, so the CLI can show the version
+and the help text without loading them.
 """
-import io
+import copy
+import functools
+import glob
+import itertools
+import json
 import os
-import pprint
+import signal
 import sys
-import tempfile
+import threading
+import time
+import traceback
 import warnings
 
-from copy import deepcopy
+from collections import ChainMap
 from pathlib import Path
-from typing import Dict, Optional, Tuple, Union
-
-import dotenv
-import sh
-import yaml  # type: ignore
-
-from colorama import Fore
-from jinja2 import Template
-
-from makim.errors import MakimError
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from makim.cache import TaskCache, compute_cache_key
+from makim.config import (  # noqa: F401
+    escape_template_tag,
+    get_target_index,
+    load_config,
+    load_env_file,
+    unescape_template_tag,
+)
+from makim.errors import (
+    MakimError,
+    MakimRunError,
+    MakimShellError,
+    MakimTimeoutError,
+)
+from makim.output import OUTPUT_LOG_DIR, TargetOutput
+from makim.profiler import get_profiler, span
+from makim.remote import get_remote_cache
+from makim.resources import (
+    can_limit_memory,
+    get_budget,
+    parse_resources,
+    set_memory_limit,
+)
+from makim.scheduler import (
+    NODE_DONE,
+    NODE_FAILED,
+    NODE_PENDING,
+    NODE_SKIPPED,
+    ExecutionContext,
+    Scheduler,
+    TargetGraph,
+    TargetNode,
+)
+from makim.script import ScriptFile
+from makim.template import is_constant, render_template
+from makim.watcher import match_patterns
+from makim.worker import ShellWorker
 
 SCOPE_GLOBAL = 0
 SCOPE_GROUP = 1
 SCOPE_TARGET = 2
 
+# sh.Command by shell name, for the current process
+_shell_apps: Dict[str, Any] = {}
+# max size of an output line of the targets, for `run_async`
+ASYNC_LINE_LIMIT = 1024 * 1024
+# env variables added to the env of the targets
+MAKIM_ENV = {'RAISE_SUBPROC_ERROR': '1', 'XONSH_SHOW_TRACEBACK': '0'}
 
-def escape_template_tag(v: str) -> str:
-    """Escape template tag when processing the template config file."""
-    return v.replace('{{', r'\{\{').replace('}}', r'\}\}')
 
+def get_shell_args(shell_app: Any) -> List[str]:
+    """Return the arguments for the given shell app."""
+    name = shell_app.__dict__['__name__']
+    if name.endswith('bash'):
+        return ['-e']
+    if name.endswith('xonsh'):
+        # note: the xonsh script cache is keyed by the real path of the
+        #       script, and all the in-memory scripts have the same one
+        return ['--no-script-cache']
+    return []
 
-def unescape_template_tag(v: str) -> str:
-    """Unescape template tag when processing the template config file."""
-    return v.replace(r'\{\{', '{{').replace(r'\}\}', '}}')
+
+def load_yaml_value(value: str) -> Any:
+    """Parse a single value (e.g. a rendered argument) as YAML."""
+    import yaml  # type: ignore
+
+    return yaml.safe_load(value)
 
 
 class PrintPlugin:
     """Logs class."""
 
     def _print_error(self, message: str):
+        from colorama import Fore
+
         print(Fore.RED, message, Fore.RESET, file=sys.stderr)
 
     def _print_info(self, message: str):
+        from colorama import Fore
+
         print(Fore.BLUE, message, Fore.RESET, file=sys.stdout)
 
     def _print_warning(self, message: str):
+        from colorama import Fore
+
         print(Fore.YELLOW, message, Fore.RESET, file=sys.stdout)
 
 
+class RunResult:
+    """Result of a makim run, returned by `Makim.execute`."""
+
+    __slots__ = ('code', 'done', 'duration', 'failed', 'message', 'skipped')
+
+    def __init__(self):
+        # exit code of the run (see `MakimError`), 0 when it succeeded
+        self.code = 0
+        # error message, when the run failed
+        self.message = ''
+        # wall time of the run, in seconds
+        self.duration = 0.0
+        # names of the targets that succeeded, that failed and that were
+        # not run because a dependency failed
+        self.done: List[str] = []
+        self.failed: List[str] = []
+        self.skipped: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        """Check if the run succeeded."""
+        return self.code == 0
+
+    def __repr__(self) -> str:
+        """Return a short description of the result."""
+        return (
+            f'RunResult(code={self.code}, duration={self.duration:.3f}, '
+            f'failed={self.failed}, skipped={self.skipped})'
+        )
+
+
 class Makim(PrintPlugin):
-    """Makim main class."""
+    """
+    Makim main class.
 
-    makim_file: str = '.makim.yaml'
-    global_data: dict = {}
-    shell_app: sh.Command = sh.xonsh
+    All the state is kept in the instance: a loaded `Makim` object can run
+    many calls of `execute` at the same time, from different threads.
+    """
+
+    makim_file: str
+    global_data: dict
+    # target data by qualified name (`group.target`)
+    target_index: Dict[str, dict]
+    # sh.Command for the current shell, defined by `_load_shell_app`
+    shell_app: Any
 
     # temporary variables
-    env: dict = {}  # initial env
-    env_scoped: dict = {}  # current env
+    env: dict  # initial env
+    env_scoped: dict  # current env
+    # env of the makim call, that the env of the targets is based on
+    env_base: Dict[str, str]
     # initial working directory
-    working_directory: Optional[Path] = None
+    working_directory: Optional[Path]
     # current working directory
-    working_directory_scoped: Optional[Path] = None
-    args: Optional[object] = None
-    group_name: str = 'default'
-    group_data: dict = {}
-    target_name: str = ''
-    target_data: dict = {}
+    working_directory_scoped: Optional[Path]
+    args: dict
+    group_name: str
+    group_data: dict
+    target_name: str
+    target_data: dict
+    # persistent shell workers (--shell-worker), by shell command
+    _shell_workers: Dict[tuple, ShellWorker]
+    _shell_workers_lock: Any
+    # nodes to run (--watch, --shard), None to run all of them
+    _selected_nodes: Optional[Set[int]]
 
     def __init__(self):
         """Prepare the Makim class with the default configuration."""
-        os.environ['RAISE_SUBPROC_ERROR'] = '1'
-        os.environ['XONSH_SHOW_TRACEBACK'] = '0'
-
-    def _call_shell_app(self, cmd):
-        fd, filepath = tempfile.mkstemp(suffix='.makim', text=True)
-
-        with open(filepath, 'w') as f:
-            f.write(cmd)
-
-        p = self.shell_app(
-            *self.shell_args,
-            filepath,
-            _in=sys.stdin,
-            _out=sys.stdout,
-            _err=sys.stderr,
-            _bg=True,
-            _bg_exc=False,
-            _no_err=True,
-            _env=os.environ,
-            _new_session=True,
-            _cwd=str(self._resolve_working_directory('target')),
-        )
+        self.makim_file = '.makim.yaml'
+        self.global_data = {}
+        self.target_index = {}
+        self.shell_app = None
+        self.env = {}
+        self.env_scoped = {}
+        self.env_base = {}
+        self.working_directory = None
+        self.working_directory_scoped = None
+        self.args = {}
+        self.group_name = 'default'
+        self.group_data = {}
+        self.target_name = ''
+        self.target_data = {}
+        self._shell_workers = {}
+        self._shell_workers_lock = None
+        self._selected_nodes = None
+        self.cache = TaskCache()
+
+    def _fail(self, error: MakimError, message: str) -> NoReturn:
+        """Show the error and stop the current run."""
+        self._print_error(f'[EE] {message}')
+        raise MakimRunError(error, message)
+
+    def _call_shell_app(
+        self,
+        node: TargetNode,
+        stdout: Optional[Callable[[str], None]] = None,
+        stderr: Optional[Callable[[str], None]] = None,
+        worker: Optional[ShellWorker] = None,
+    ):
+        if worker is not None:
+            return self._call_shell_worker(node, worker, stdout, stderr)
+
+        import sh
+
+        context = node.context
+        with ScriptFile(node.cmd) as script:
+            with span(node.name, 'spawn'):
+                context.process = context.shell_app(
+                    *get_shell_args(context.shell_app),
+                    script.path,
+                    _in=sys.stdin,
+                    _out=stdout or sys.stdout,
+                    _err=stderr or sys.stderr,
+                    _bg=True,
+                    _bg_exc=False,
+                    _no_err=True,
+                    _env=node.env,
+                    _new_session=True,
+                    _cwd=str(context.working_directory),
+                    _pass_fds=set(script.pass_fds),
+                    _preexec_fn=self._get_preexec(node),
+                )
+
+            try:
+                with span(node.name, 'wait'):
+                    context.process.wait(timeout=node.timeout)
+            except sh.TimeoutException:
+                context.process.kill_group()
+                raise MakimTimeoutError(node.name, node.timeout)
+
+    def _call_shell_worker(
+        self,
+        node: TargetNode,
+        worker: ShellWorker,
+        stdout: Optional[Callable[[str], None]] = None,
+        stderr: Optional[Callable[[str], None]] = None,
+    ):
+        context = node.context
+        fds: List[int] = []
+        fds_to_close: List[int] = []
+        pumps: List[threading.Thread] = []
+
+        def pump(fd: int, callback: Callable[[str], Any]):
+            with open(fd, encoding='utf8', errors='replace') as f:
+                for line in f:
+                    callback(line)
 
         try:
-            p.wait()
-        except sh.ErrorReturnCode as e:
-            os.close(fd)
-            self._print_error(str(e))
-            os._exit(MakimError.SH_ERROR_RETURN_CODE.value)
-        except KeyboardInterrupt:
-            os.close(fd)
-            pid = p.pid
-            p.kill_group()
-            self._print_error(f'[EE] Process {pid} killed.')
-            os._exit(MakimError.SH_KEYBOARD_INTERRUPT.value)
-        os.close(fd)
+            fds.append(sys.stdin.fileno())
+        except (AttributeError, OSError, ValueError):
+            fds.append(os.open(os.devnull, os.O_RDONLY))
+            fds_to_close.append(fds[-1])
+
+        for stream, callback in ((sys.stdout, stdout), (sys.stderr, stderr)):
+            if callback is None:
+                try:
+                    stream.flush()
+                    fds.append(stream.fileno())
+                    continue
+                except (AttributeError, OSError, ValueError):
+                    pass
+            read_fd, write_fd = os.pipe()
+            fds.append(write_fd)
+            fds_to_close.append(write_fd)
+            pumps.append(
+                threading.Thread(
+                    target=pump,
+                    args=(read_fd, callback or stream.write),
+                    daemon=True,
+                )
+            )
+
+        try:
+            with span(node.name, 'spawn'):
+                context.process = worker.run(
+                    node.cmd,
+                    node.env,
+                    str(context.working_directory),
+                    fds,
+                    memory=self._get_memory_limit(node),
+                )
+        finally:
+            for fd in fds_to_close:
+                os.close(fd)
+
+        for thread in pumps:
+            thread.start()
+        with span(node.name, 'wait'):
+            try:
+                returncode = context.process.wait(timeout=node.timeout)
+            except TimeoutError:
+                context.process.kill_group()
+                raise MakimTimeoutError(node.name, node.timeout)
+            finally:
+                for thread in pumps:
+                    thread.join()
+
+        if returncode:
+            raise MakimShellError(worker.shell, returncode)
 
     def _check_makim_file(self):
         return Path(self.makim_file).exists()
@@ -122,15 +334,17 @@ class Makim(PrintPlugin):
 
     def _verify_args(self):
         if not self._check_makim_file():
-            self._print_error(
-                '[EE] CONFIG: Config file .makim.yaml not found.'
+            self._fail(
+                MakimError.MAKIM_CONFIG_FILE_NOT_FOUND,
+                'CONFIG: Config file .makim.yaml not found.',
             )
-            os._exit(MakimError.MAKIM_CONFIG_FILE_NOT_FOUND.value)
 
     def _verify_config(self):
         if not len(self.global_data['groups']):
-            self._print_error('[EE] No target groups found.')
-            os._exit(MakimError.MAKIM_NO_TARGET_GROUPS_FOUND.value)
+            self._fail(
+                MakimError.MAKIM_NO_TARGET_GROUPS_FOUND,
+                'No target groups found.',
+            )
 
     def _change_target(self, target_name: str):
         group_name = 'default'
@@ -140,19 +354,21 @@ class Makim(PrintPlugin):
         self.target_name = target_name
         self._change_group_data(group_name)
 
-        for target_name, target_data in self.group_data['targets'].items():
-            if target_name == self.target_name:
-                self.target_data = target_data
-                shell_app = target_data.get('shell')
-                if shell_app:
-                    self._load_shell_app(shell_app)
-                return
-
-        self._print_error(
-            f'[EE] The given target "{self.target_name}" was not found in the '
-            f'configuration file for the group {self.group_name}.'
+        target_data = self.target_index.get(
+            f'{self.group_name}.{self.target_name}'
+        )
+        if target_data is not None:
+            self.target_data = target_data
+            shell_app = target_data.get('shell')
+            if shell_app:
+                self._load_shell_app(shell_app)
+            return
+
+        self._fail(
+            MakimError.MAKIM_TARGET_NOT_FOUND,
+            f'The given target "{self.target_name}" was not found in the '
+            f'configuration file for the group {self.group_name}.',
         )
-        os._exit(MakimError.MAKIM_TARGET_NOT_FOUND.value)
 
     def _change_group_data(self, group_name=None):
         groups = self.global_data['groups']
@@ -162,31 +378,29 @@ class Makim(PrintPlugin):
         shell_app_default = self.global_data.get('shell', 'xonsh')
         if self.group_name == 'default' and len(groups) == 1:
             group = next(iter(groups))
+            self.group_name = group
             self.group_data = groups[group]
 
             shell_app = self.group_data.get('shell', shell_app_default)
             self._load_shell_app(shell_app)
             return
 
-        for group in groups:
-            if group == self.group_name:
-                self.group_data = groups[group]
-                shell_app = groups[group].get('shell', shell_app_default)
-                self._load_shell_app(shell_app)
-                return
+        group_data = groups.get(self.group_name)
+        if group_data is not None:
+            self.group_data = group_data
+            shell_app = group_data.get('shell', shell_app_default)
+            self._load_shell_app(shell_app)
+            return
 
-        self._print_error(
-            f'[EE] The given group target "{self.group_name}" '
-            'was not found in the configuration file.'
+        self._fail(
+            MakimError.MAKIM_GROUP_NOT_FOUND,
+            f'The given group target "{self.group_name}" '
+            'was not found in the configuration file.',
         )
-        os._exit(MakimError.MAKIM_GROUP_NOT_FOUND.value)
 
     def _load_config_data(self):
-        with open(self.makim_file, 'r') as f:
-            # escape template tags
-            content = escape_template_tag(f.read())
-            content_io = io.StringIO(content)
-            self.global_data = yaml.safe_load(content_io)
+        self.global_data = load_config(self.makim_file)
+        self.target_index = get_target_index(self.global_data)
 
     def _resolve_working_directory(self, scope: str) -> Optional[Path]:
         scope_options = ('global', 'group', 'target')
@@ -224,7 +438,13 @@ class Makim(PrintPlugin):
     def _load_shell_app(self, shell_app: str = ''):
         if not shell_app:
             shell_app = self.global_data.get('shell', 'xonsh')
-        self.shell_app = getattr(sh, shell_app)
+
+        # note: creating a sh.Command searches the shell in the PATH
+        if shell_app not in _shell_apps:
+            import sh
+
+            _shell_apps[shell_app] = getattr(sh, shell_app)
+        self.shell_app = _shell_apps[shell_app]
 
     def _load_dotenv(self, data_scope: dict) -> dict:
         env_file = data_scope.get('env-file')
@@ -237,87 +457,98 @@ class Makim(PrintPlugin):
             env_file = str(Path(self.makim_file).parent / env_file)
 
         if not Path(env_file).exists():
-            self._print_error('[EE] The given env-file was not found.')
-            os._exit(MakimError.MAKIM_ENV_FILE_NOT_FOUND.value)
+            self._fail(
+                MakimError.MAKIM_ENV_FILE_NOT_FOUND,
+                'The given env-file was not found.',
+            )
 
-        return dotenv.dotenv_values(env_file)
+        return load_env_file(env_file)
+
+    def _load_scoped_layer(
+        self,
+        scope_key: tuple,
+        data_scope: dict,
+        env: ChainMap,
+        variables: dict,
+        layers: Dict[tuple, tuple],
+    ) -> Tuple[dict, dict]:
+        """
+        Resolve the env and vars defined by one scope.
+
+        A layer without templates doesn't depend on the env below it, so it
+        is reused by all the targets. The other ones are reused only for
+        the same base env (the last map of `env`).
+        """
+        env_base = env.maps[-1]
+        for cached_key in ((scope_key, None), (scope_key, id(env_base))):
+            if cached_key in layers:
+                return layers[cached_key][1:]
+
+        env_layer = dict(self._load_dotenv(data_scope))
+        env_scope = env.new_child(env_layer)
+        constant = True
+        for k, v in data_scope.get('env', {}).items():
+            source = unescape_template_tag(str(v))
+            constant = constant and is_constant(source)
+            env_layer[k] = render_template(
+                source, env=env_scope, vars=variables
+            )
+        vars_layer = {
+            k: v.strip() for k, v in data_scope.get('vars', {}).items()
+        }
+
+        # note: the base env is kept in the cache, so its id is not reused
+        layer_key = (scope_key, None if constant else id(env_base))
+        layers[layer_key] = (env_base, env_layer, vars_layer)
+        return env_layer, vars_layer
 
     def _load_scoped_data(
-        self, scope: str
+        self,
+        scope: str,
+        env_base: Optional[Dict[str, str]] = None,
+        layers: Optional[Dict[tuple, tuple]] = None,
     ) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        Resolve the env and vars for the given scope.
+
+        The env of each scope (global, group and target) is a layer on top
+        of the base env. The resolved layers are stored in `layers`, so they
+        can be reused by the next targets of the same invocation.
+        """
         scope_options = ('global', 'group', 'target')
         if scope not in scope_options:
             raise Exception(f'The given scope `{scope}` is not valid.')
 
-        def _render_env_inplace(
-            env_user: dict, env_file: dict, variables: dict, env: dict
-        ):
-            env.update(env_file)
-            for k, v in env_user.items():
-                env[k] = Template(unescape_template_tag(str(v))).render(
-                    env=env, vars=variables
-                )
-
         scope_id = scope_options.index(scope)
-
-        env = deepcopy(dict(os.environ))
+        env_base = self.env_base if env_base is None else env_base
+        layers = {} if layers is None else layers
+
+        scopes = [
+            (('global',), self.global_data),
+            (('group', self.group_name), self.group_data),
+            (
+                ('target', self.group_name, self.target_name),
+                self.target_data,
+            ),
+        ]
+
+        env: ChainMap = ChainMap(env_base)
         variables: dict = {}
+        with span(f'{self.group_name}.{self.target_name}', 'env'):
+            for scope_key, data_scope in scopes[: scope_id + 1]:
+                env_layer, vars_layer = self._load_scoped_layer(
+                    scope_key, data_scope, env, variables, layers
+                )
+                env = env.new_child(env_layer)
+                variables.update(vars_layer)
 
-        if scope_id >= SCOPE_GLOBAL:
-            env_user = self.global_data.get('env', {})
-            env_file = self._load_dotenv(self.global_data)
-            _render_env_inplace(env_user, env_file, variables, env)
-            variables.update(self._load_scoped_vars('global', env=env))
-
-        if scope_id >= SCOPE_GROUP:
-            env_user = self.group_data.get('env', {})
-            env_file = self._load_dotenv(self.group_data)
-            _render_env_inplace(env_user, env_file, variables, env)
-            variables.update(self._load_scoped_vars('group', env=env))
-
-        if scope_id == SCOPE_TARGET:
-            env_user = self.target_data.get('env', {})
-            env_file = self._load_dotenv(self.target_data)
-            _render_env_inplace(env_user, env_file, variables, env)
-            variables.update(self._load_scoped_vars('target', env=env))
-
-        return env, variables
-
-    def _load_scoped_vars(self, scope: str, env) -> dict:
-        scope_options = ('global', 'group', 'target')
-        if scope not in scope_options:
-            raise Exception(f'The given scope `{scope}` is not valid.')
-        scope_id = scope_options.index(scope)
-
-        variables = {}
-
-        if scope_id >= SCOPE_GLOBAL:
-            variables.update(
-                {
-                    k: v.strip()
-                    for k, v in self.global_data.get('vars', {}).items()
-                }
-            )
-        if scope_id >= SCOPE_GROUP:
-            variables.update(
-                {
-                    k: v.strip()
-                    for k, v in self.group_data.get('vars', {}).items()
-                }
-            )
-        if scope_id == SCOPE_TARGET:
-            variables.update(
-                {
-                    k: v.strip()
-                    for k, v in self.target_data.get('vars', {}).items()
-                }
-            )
-        return variables
+            # the env is copied just once, for the target process
+            return dict(env), variables
 
     def _load_target_args(self):
         for name, value in self.target_data.get('args', {}).items():
             qualified_name = f'--{name}'
-            if self.args.get(qualified_name):
+            if self.args.get(qualified_name) is not None:
                 continue
             default = value.get('default')
             is_bool = value.get('type', '') == 'bool'
@@ -328,27 +559,48 @@ class Makim(PrintPlugin):
     @property
     def shell_args(self):
         """Return the arguments for the defined shell app."""
-        if self.shell_app.__dict__['__name__'].endswith('bash'):
-            return ['-e']
-        return []
+        return get_shell_args(self.shell_app)
+
+    def _save_context(self) -> ExecutionContext:
+        """Return the runtime state of the current target."""
+        context = ExecutionContext()
+        context.args = self.args
+        context.group_name = self.group_name
+        context.group_data = self.group_data
+        context.target_name = self.target_name
+        context.target_data = self.target_data
+        context.shell_app = self.shell_app
+        context.env_scoped = self.env_scoped
+        context.working_directory = self._resolve_working_directory('target')
+        return context
+
+    def _restore_context(self, context: ExecutionContext):
+        """Set the given target runtime state as the current one."""
+        self.args = context.args
+        self.group_name = context.group_name
+        self.group_data = context.group_data
+        self.target_name = context.target_name
+        self.target_data = context.target_data
+        self.shell_app = context.shell_app
+        self.env_scoped = context.env_scoped
 
     # run commands
 
-    def _run_dependencies(self, args: dict):
+    def _load_dependencies(
+        self, args: dict, env: Dict[str, str], graph: TargetGraph
+    ) -> List[int]:
         if not self.target_data.get('dependencies'):
-            return
-        makim_dep = deepcopy(self)
+            return []
+
         args_dep_original = {
             'makim_file': args['makim_file'],
             'help': args.get('help', False),
             'verbose': args.get('verbose', False),
-            'dry-run': args.get('dry-run', False),
+            'dry_run': args.get('dry_run', False),
             'version': args.get('version', False),
             'args': {},
         }
 
-        makim_dep._change_group_data()
-
         # clean double dash prefix in args
         original_args_clean = {}
         for arg_name, arg_value in args.items():
@@ -360,12 +612,12 @@ class Makim(PrintPlugin):
                 else arg_value
             )
 
-        for dep_data in self.target_data['dependencies']:
-            env, variables = makim_dep._load_scoped_data('target')
-            for k, v in env.items():
-                os.environ[k] = v
+        dependencies = []
+        # the dependencies are loaded by this same object, so the state of
+        # the current target is restored after each one of them
+        context = self._save_context()
 
-            makim_dep.env_scoped = deepcopy(env)
+        for dep_data in self.target_data['dependencies']:
             args_dep = {}
 
             # update the arguments
@@ -376,9 +628,9 @@ class Makim(PrintPlugin):
                     else str(arg_value)
                 )
 
-                args_dep[f'--{arg_name}'] = yaml.safe_load(
-                    Template(unescaped_value).render(
-                        args=original_args_clean, env=makim_dep.env_scoped
+                args_dep[f'--{arg_name}'] = load_yaml_value(
+                    render_template(
+                        unescaped_value, args=original_args_clean, env=env
                     )
                 )
 
@@ -388,10 +640,12 @@ class Makim(PrintPlugin):
             # checking for the conditional statement
             if_stmt = dep_data.get('if')
             if if_stmt:
-                result = Template(unescape_template_tag(str(if_stmt))).render(
-                    args=original_args_clean, env=self.env_scoped
+                result = render_template(
+                    unescape_template_tag(str(if_stmt)),
+                    args=original_args_clean,
+                    env=env,
                 )
-                if not yaml.safe_load(result):
+                if not load_yaml_value(result):
                     if args.get('verbose'):
                         self._print_info(
                             '[II] Skipping dependency: '
@@ -399,26 +653,14 @@ class Makim(PrintPlugin):
                         )
                     continue
 
-            makim_dep.run(deepcopy(args_dep))
+            dep_id = self._load_target(args_dep, env, graph)
+            self._restore_context(context)
+            if dep_id is not None:
+                dependencies.append(dep_id)
 
-    def _run_command(self, args: dict):
-        cmd = self.target_data.get('run', '').strip()
-        if 'vars' not in self.group_data:
-            self.group_data['vars'] = {}
-
-        if not isinstance(self.group_data['vars'], dict):
-            self._print_error(
-                '[EE] `vars` attribute inside the group '
-                f'{self.group_name} is not a dictionary.'
-            )
-            os._exit(MakimError.MAKIM_VARS_ATTRIBUTE_INVALID.value)
-
-        env, variables = self._load_scoped_data('target')
-        for k, v in env.items():
-            os.environ[k] = v
-
-        self.env_scoped = deepcopy(env)
+        return dependencies
 
+    def _load_target_input_args(self, args: dict) -> dict:
         args_input = {'makim_file': args['makim_file']}
         for k, v in self.target_data.get('args', {}).items():
             if not isinstance(v, dict):
@@ -431,7 +673,8 @@ class Makim(PrintPlugin):
             args_input[k_clean] = default
 
             input_flag = f'--{k}'
-            if input_flag in args and args[input_flag]:
+            # note: falsy values (e.g. `0` or `false` in a matrix) are set
+            if args.get(input_flag) is not None:
                 if action == 'store_true':
                     args_input[k_clean] = (
                         True if args[input_flag] is None else args[input_flag]
@@ -444,63 +687,1281 @@ class Makim(PrintPlugin):
                     else args[input_flag]
                 )
             elif v.get('required'):
-                self._print_error(
-                    f'[EE] The argument `{k}` is set as required. '
-                    'Please, provide that argument to proceed.'
+                self._fail(
+                    MakimError.MAKIM_ARGUMENT_REQUIRED,
+                    f'The argument `{k}` is set as required. '
+                    'Please, provide that argument to proceed.',
                 )
-                os._exit(MakimError.MAKIM_ARGUMENT_REQUIRED.value)
+        return args_input
+
+    def _load_target(
+        self,
+        args: dict,
+        env_base: Dict[str, str],
+        graph: TargetGraph,
+    ) -> Optional[int]:
+        """
+        Add the given target and its dependencies to the graph.
+
+        Returns the id of the target node, or None when the target is not
+        executed because its conditional is not satisfied. If the target was
+        already added with the same arguments, the existing node is reused.
+        """
+        with span(str(args['target']), 'resolve'):
+            return self._resolve_target(args, env_base, graph)
+
+    def _resolve_target(
+        self,
+        args: dict,
+        env_base: Dict[str, str],
+        graph: TargetGraph,
+    ) -> Optional[int]:
+        self.args = args
+
+        # setup
+        self._verify_args()
+        self._change_target(args['target'])
+        self._load_target_args()
+
+        if self.target_data.get('if') and not self._verify_target_conditional(
+            self.target_data['if']
+        ):
+            warnings.warn(
+                f'{args["target"]} not executed. '
+                'Condition (if) not satisfied.'
+            )
+            return None
+
+        if self.target_data.get('matrix') and 'matrix_cell' not in args:
+            return self._load_matrix(args, env_base, graph)
+
+        cmd = self.target_data.get('run', '').strip()
+        if not isinstance(self.group_data.get('vars', {}), dict):
+            self._fail(
+                MakimError.MAKIM_VARS_ATTRIBUTE_INVALID,
+                '`vars` attribute inside the group '
+                f'{self.group_name} is not a dictionary.',
+            )
+
+        args_input = self._load_target_input_args(args)
+        target_name = f'{self.group_name}.{self.target_name}'
+        if 'matrix_cell' in args:
+            target_name += self._format_matrix_cell(args['matrix_cell'])
+        key = (
+            target_name,
+            json.dumps(args_input, sort_keys=True, default=str),
+            self._get_env_key(env_base),
+        )
+
+        if key in graph.keys:
+            node_id = graph.keys[key]
+            if node_id is None:
+                self._fail(
+                    MakimError.MAKIM_DEPENDENCY_CYCLE,
+                    'Circular dependency detected for the target '
+                    f'"{target_name}".',
+                )
+            if args.get('verbose'):
+                self._print_info(
+                    f'[II] Target {target_name} already scheduled, '
+                    'reusing its result.'
+                )
+            return node_id
+        graph.keys[key] = None
+
+        env, variables = self._load_scoped_data(
+            'target', env_base, graph.env_layers
+        )
+        self.env_scoped = env
+
+        dependencies = self._load_dependencies(args, env, graph)
 
         cmd = unescape_template_tag(str(cmd))
-        cmd = Template(cmd).render(args=args_input, env=env, vars=variables)
-        if args.get('verbose'):
-            self._print_info('=' * 80)
+        cmd = render_template(cmd, args=args_input, env=env, vars=variables)
+
+        files: Dict[str, List[str]] = {}
+        for attr in ('inputs', 'outputs', 'watch'):
+            paths = self.target_data.get(attr, [])
+            if isinstance(paths, str):
+                paths = [paths]
+            files[attr] = [
+                render_template(
+                    unescape_template_tag(str(path)),
+                    args=args_input,
+                    env=env,
+                    vars=variables,
+                )
+                for path in paths
+            ]
+
+        node = graph.add(key, dependencies)
+        node.context = self._save_context()
+        node.cmd = cmd
+        node.env = env
+        node.args_input = args_input
+        node.variables = variables
+        node.inputs = files['inputs']
+        node.outputs = files['outputs']
+        node.watch = files['watch']
+        timeout = self.target_data.get('timeout')
+        node.timeout = None if timeout is None else float(timeout)
+        if cmd:
+            try:
+                node.resources = parse_resources(
+                    self.target_data.get('resources')
+                )
+            except ValueError as e:
+                self._fail(
+                    MakimError.MAKIM_RESOURCES_INVALID,
+                    f'Invalid resources for the target {target_name}: {e}',
+                )
+        return node.node_id
+
+    def _get_env_key(self, env_base: Dict[str, str]) -> str:
+        """Return the env inherited by the target, for its node key."""
+        # note: a dependency inherits the env of the target that calls it,
+        #       so a dependency called with other env values runs again
+        env_diff = {
+            k: v for k, v in env_base.items() if self.env_base.get(k) != v
+        }
+        return json.dumps(env_diff, sort_keys=True)
+
+    def _format_matrix_cell(self, cell: dict) -> str:
+        values = ', '.join(f'{name}={value}' for name, value in cell.items())
+        return f'[{values}]'
+
+    def _load_matrix(
+        self, args: dict, env_base: Dict[str, str], graph: TargetGraph
+    ) -> int:
+        """
+        Add one node for each cell of the target `matrix` to the graph.
+
+        Each cell runs the target with one combination of the matrix args.
+        Returns the id of a node that depends on all the cells, so the
+        dependents of the target wait for all of them.
+        """
+        matrix = self.target_data['matrix']
+        target_name = f'{self.group_name}.{self.target_name}'
+        target_args = self.target_data.get('args', {})
+        if not isinstance(matrix, dict) or not all(
+            isinstance(values, list) and name in target_args
+            for name, values in matrix.items()
+        ):
+            self._fail(
+                MakimError.MAKIM_MATRIX_INVALID,
+                f'The `matrix` attribute of the target {target_name} '
+                'should map the target arguments to lists of values.',
+            )
+
+        cells = []
+        context = self._save_context()
+        for values in itertools.product(*matrix.values()):
+            cell = dict(zip(matrix, values))
+            cell_args = dict(args)
+            cell_args.update({f'--{name}': v for name, v in cell.items()})
+            cell_args['matrix_cell'] = cell
+            cell_id = self._load_target(cell_args, env_base, graph)
+            self._restore_context(context)
+            if cell_id is not None:
+                cells.append(cell_id)
+
+        # note: the cells are deduplicated by their own keys
+        key = (target_name, json.dumps({'matrix': cells}), '')
+        node_id = graph.keys.get(key)
+        if node_id is not None:
+            return node_id
+        node = graph.add(key, cells)
+        node.context = context
+        node.cells = cells
+        return node.node_id
+
+    def _get_memory_limit(self, node: TargetNode) -> Optional[float]:
+        """Return the memory limit of the target (`--limit-resources`)."""
+        memory = node.resources.get('memory')
+        if not (self.args.get('limit_resources') and memory):
+            return None
+        if not can_limit_memory():
+            self._print_warning(
+                f'[WW] The memory of the target {node.name} was not limited '
+                '(not supported by the platform).'
+            )
+            return None
+        return memory
+
+    def _get_preexec(self, node: TargetNode) -> Optional[Callable[[], Any]]:
+        """Return the function to run in the target process before exec."""
+        memory = self._get_memory_limit(node)
+        if memory is None:
+            return None
+        return functools.partial(set_memory_limit, memory)
+
+    def _check_target_outdated(
+        self, node: TargetNode, nodes: Dict[int, TargetNode]
+    ) -> Optional[str]:
+        """
+        Check if the target needs to be executed.
+
+        Returns the reason why the target should run, or None when its
+        outputs are up to date.
+        """
+        if not node.outputs:
+            return 'no outputs declared'
+
+        if self.args.get('force'):
+            return 'forced by --force'
+
+        for dep_id in node.dependencies:
+            if nodes[dep_id].changed:
+                return f'dependency {nodes[dep_id].name} changed'
+
+        working_dir = node.context.working_directory
+
+        outputs_mtime = []
+        for output in node.outputs:
+            path = working_dir / output
+            if not path.exists():
+                return f'output {output} does not exist'
+            outputs_mtime.append((path.stat().st_mtime, output))
+        oldest_output = min(outputs_mtime)
+
+        for input_path in self._expand_inputs(node):
+            if os.stat(input_path).st_mtime > oldest_output[0]:
+                return (
+                    f'input {input_path} is newer than '
+                    f'output {oldest_output[1]}'
+                )
+        return None
+
+    def _expand_inputs(
+        self, node: TargetNode, patterns: Optional[List[str]] = None
+    ) -> List[str]:
+        working_dir = node.context.working_directory
+        inputs: List[str] = []
+        for pattern in node.inputs if patterns is None else patterns:
+            inputs.extend(
+                path
+                for path in glob.glob(
+                    str(working_dir / pattern), recursive=True
+                )
+                if os.path.isfile(path)
+            )
+        return inputs
+
+    def _get_cache_key(self, node: TargetNode) -> Optional[str]:
+        """Return the cache key for the target, if it can be cached."""
+        if (
+            not node.outputs
+            or self.args.get('no_cache')
+            or not node.context.target_data.get('cache', True)
+        ):
+            return None
+
+        env_diff = {
+            k: v for k, v in node.env.items() if self.env_base.get(k) != v
+        }
+        target_data = {
+            'cmd': node.cmd,
+            'env': env_diff,
+            'vars': node.variables,
+            'shell': node.context.shell_app.__dict__['__name__'],
+            'outputs': node.outputs,
+        }
+        return compute_cache_key(target_data, self._expand_inputs(node))
+
+    def _restore_node(
+        self,
+        node: TargetNode,
+        cache_key: str,
+        outputs: List[Path],
+        output: TargetOutput,
+    ) -> bool:
+        """Restore the outputs of the target from the cache, if possible."""
+        with span(node.name, 'cache'):
+            logs = self.cache.restore(cache_key, outputs)
+        if logs is None:
+            return False
+
+        if self.args.get('verbose'):
             self._print_info(
-                'TARGET: ' + f'{self.group_name}.{self.target_name}'
+                f'[II] Restored target {node.name} from the cache.'
+            )
+        output.stdout(logs[0])
+        output.stderr(logs[1])
+        output.close()
+        return True
+
+    def _print_target_details(self, node: TargetNode, reason: str):
+        import pprint
+
+        if node.outputs:
+            self._print_info(f'[II] Running target {node.name}: {reason}.')
+        self._print_info('=' * 80)
+        self._print_info('TARGET: ' + node.name)
+        self._print_info('ARGS:')
+        self._print_info(pprint.pformat(node.args_input))
+        self._print_info('VARS:')
+        self._print_info(pprint.pformat(node.variables))
+        self._print_info('ENV:')
+        self._print_info(str(node.env))
+        self._print_info('-' * 80)
+        self._print_info('>>> ' + node.cmd.replace('\n', '\n>>> '))
+        self._print_info('=' * 80)
+
+    def _report_node_error(
+        self, node: TargetNode, output: TargetOutput, error: Exception
+    ):
+        node.tail = list(output.tail)
+        self._print_error(str(error))
+        if output.log_path:
+            self._print_error(
+                f'[EE] The output of {node.name} is in {output.log_path}.'
+            )
+
+    def _call_node_shell(
+        self,
+        node: TargetNode,
+        output: TargetOutput,
+        worker: Optional[ShellWorker],
+    ):
+        """Run the target script, with its output sent to `output`."""
+        import sh
+
+        node.executed = True
+        try:
+            try:
+                if output.is_direct:
+                    self._call_shell_app(node, worker=worker)
+                else:
+                    self._call_shell_app(
+                        node,
+                        stdout=output.stdout,
+                        stderr=output.stderr,
+                        worker=worker,
+                    )
+            finally:
+                output.close()
+        except (sh.ErrorReturnCode, MakimShellError, MakimTimeoutError) as e:
+            self._report_node_error(node, output, e)
+            raise
+
+    def _start_node(
+        self, node: TargetNode, nodes: Dict[int, TargetNode]
+    ) -> Optional[Tuple[TargetOutput, Optional[str]]]:
+        """
+        Prepare the execution of the target.
+
+        Returns the output and the cache key of the target, or None when
+        its script should not run (up to date, restored from the cache,
+        `dry_run`, ...).
+        """
+        if (
+            self._selected_nodes is not None
+            and node.node_id not in self._selected_nodes
+        ):
+            return None
+        if node.cells:
+            # the target of a matrix runs just its cells
+            node.changed = any(nodes[cell].changed for cell in node.cells)
+            return None
+        reason = self._check_target_outdated(node, nodes)
+        if reason is None:
+            if self.args.get('verbose'):
+                self._print_info(
+                    f'[II] Skipping target {node.name}: '
+                    'outputs are up to date.'
+                )
+            return None
+
+        node.changed = True
+
+        if self.args.get('verbose'):
+            self._print_target_details(node, reason)
+
+        if self.args.get('dry_run') or not node.cmd:
+            return None
+
+        cache_key = self._get_cache_key(node)
+        output = TargetOutput(
+            node.name,
+            self.args.get('output') or 'stream',
+            Path(self.args.get('log_dir') or OUTPUT_LOG_DIR),
+            capture=bool(cache_key),
+        )
+
+        if (
+            cache_key
+            and not self.args.get('force')
+            and self._restore_node(
+                node, cache_key, self._get_node_outputs(node), output
+            )
+        ):
+            return None
+        return output, cache_key
+
+    def _get_node_outputs(self, node: TargetNode) -> List[Path]:
+        working_dir = node.context.working_directory
+        return [working_dir / output for output in node.outputs]
+
+    def _store_node(
+        self,
+        node: TargetNode,
+        cache_key: Optional[str],
+        output: TargetOutput,
+    ):
+        """Store the outputs of the target in the cache, if possible."""
+        outputs = self._get_node_outputs(node)
+        if cache_key and all(path.exists() for path in outputs):
+            with span(node.name, 'cache'):
+                self.cache.store(
+                    cache_key, node.name, outputs, *output.captured()
+                )
+
+    def _run_node(self, node: TargetNode, nodes: Dict[int, TargetNode]):
+        started = self._start_node(node, nodes)
+        if started is None:
+            return
+        output, cache_key = started
+
+        worker = (
+            self._get_shell_worker(node.context)
+            if self.args.get('shell_worker')
+            else None
+        )
+
+        self._call_node_shell(node, output, worker)
+        self._store_node(node, cache_key, output)
+
+    def _get_shell_worker(self, context: ExecutionContext) -> ShellWorker:
+        """Return the shell worker for the shell used by the given target."""
+        shell = context.shell_app.__dict__['__name__']
+        shell_args = get_shell_args(context.shell_app)
+        key = (shell, *shell_args)
+        with self._shell_workers_lock:
+            if key not in self._shell_workers:
+                self._shell_workers[key] = ShellWorker(shell, shell_args)
+            return self._shell_workers[key]
+
+    def _get_expected_durations(
+        self, nodes: Dict[int, TargetNode]
+    ) -> Dict[int, float]:
+        """Return the expected duration of the nodes found in the history."""
+        from makim.history import DurationHistory, hash_args
+
+        estimates, target_estimates = DurationHistory().estimates(
+            str(Path(self.makim_file).resolve())
+        )
+        durations = {}
+        for node_id, node in nodes.items():
+            duration = estimates.get(
+                (node.name, hash_args(node.args_input)),
+                target_estimates.get(node.name),
+            )
+            if duration is not None:
+                durations[node_id] = duration
+        return durations
+
+    def _get_plan_args(self, node: TargetNode) -> dict:
+        """Return the arguments of the node, as shown in the plan."""
+        return {
+            name: value
+            for name, value in node.args_input.items()
+            if name != 'makim_file'
+        }
+
+    def _get_shard_durations(
+        self, nodes: Dict[int, TargetNode], path: str
+    ) -> Dict[int, float]:
+        """
+        Return the expected durations of the nodes from a plan file.
+
+        The plan (`--plan`) is exported once, e.g. by a setup CI job, so
+        all the shards are balanced with the same durations.
+        """
+        try:
+            plan = json.loads(Path(path).read_text())
+            plan_durations = {
+                (
+                    plan_node['name'],
+                    json.dumps(plan_node['args'], sort_keys=True),
+                ): float(plan_node['duration'])
+                for plan_node in plan['nodes']
+                if plan_node.get('duration') is not None
+            }
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            self._fail(
+                MakimError.MAKIM_SHARD_DURATIONS_INVALID,
+                f'Invalid shard durations file {path}: {e}',
+            )
+
+        durations = {}
+        for node_id, node in nodes.items():
+            key = (
+                node.name,
+                json.dumps(
+                    self._get_plan_args(node), sort_keys=True, default=str
+                ),
+            )
+            if key in plan_durations:
+                durations[node_id] = plan_durations[key]
+        return durations
+
+    def _get_required_nodes(
+        self, nodes: Dict[int, TargetNode], node_ids: List[int]
+    ) -> Set[int]:
+        """Return the given nodes and all their (indirect) dependencies."""
+        required: Set[int] = set()
+        pending = list(node_ids)
+        while pending:
+            node_id = pending.pop()
+            if node_id not in required:
+                required.add(node_id)
+                pending.extend(nodes[node_id].dependencies)
+        return required
+
+    def _get_shard_nodes(
+        self, nodes: Dict[int, TargetNode], index: int, count: int
+    ) -> Set[int]:
+        """
+        Return the nodes to run in the given shard (`--shard index/count`).
+
+        The units split across the shards are the leaf targets of the plan:
+        the requested targets, where the targets without a `run` (e.g. a
+        group of dependencies or a matrix) are replaced by their
+        dependencies. Each shard runs its units and their dependencies.
+        The split is balanced by the expected durations from the plan
+        given with `--shard-durations`, so all the shards compute the same
+        split; without it, the units are split by count, in the order of
+        their names and arguments.
+        """
+        dependents = {
+            dep_id for node in nodes.values() for dep_id in node.dependencies
+        }
+        units: Set[int] = set()
+        pending = [node_id for node_id in nodes if node_id not in dependents]
+        while pending:
+            node = nodes[pending.pop()]
+            if node.cmd or not node.dependencies:
+                units.add(node.node_id)
+            else:
+                pending.extend(node.dependencies)
+
+        # note: the local history is not used, it can differ between the
+        #       CI jobs, and then the shards would overlap or miss units
+        durations_path = self.args.get('shard_durations')
+        durations = (
+            self._get_shard_durations(nodes, durations_path)
+            if durations_path
+            else {}
+        )
+        known = sorted(durations.values())
+        default = known[len(known) // 2] if known else 1.0
+
+        costs = {
+            unit: sum(
+                durations.get(node_id, default)
+                for node_id in self._get_required_nodes(nodes, [unit])
+            )
+            for unit in units
+        }
+
+        # longest processing time first, on the least loaded shard
+        loads = [0.0] * count
+        shards: List[List[int]] = [[] for _ in range(count)]
+        for unit in sorted(
+            units,
+            key=lambda unit: (
+                -costs[unit],
+                nodes[unit].name,
+                json.dumps(
+                    self._get_plan_args(nodes[unit]),
+                    sort_keys=True,
+                    default=str,
+                ),
+            ),
+        ):
+            shard = loads.index(min(loads))
+            loads[shard] += costs[unit]
+            shards[shard].append(unit)
+        return self._get_required_nodes(nodes, shards[index - 1])
+
+    def _get_plan(self, nodes: Dict[int, TargetNode]) -> dict:
+        """
+        Return the execution plan of the graph, for `--plan`.
+
+        The `duration` of each node is its expected duration from the
+        history (None when unknown), see `--shard-durations`.
+        """
+        durations = self._get_expected_durations(nodes)
+        plan_nodes = []
+        for node_id, node in sorted(nodes.items()):
+            if (
+                self._selected_nodes is not None
+                and node_id not in self._selected_nodes
+            ):
+                continue
+            context = node.context
+            plan_nodes.append(
+                {
+                    'id': node_id,
+                    'name': node.name,
+                    'args': self._get_plan_args(node),
+                    'cmd': node.cmd,
+                    'cwd': str(context.working_directory),
+                    'shell': context.shell_app.__dict__['__name__'],
+                    'env': {
+                        name: value
+                        for name, value in node.env.items()
+                        if self.env_base.get(name) != value
+                    },
+                    'inputs': node.inputs,
+                    'outputs': node.outputs,
+                    'resources': node.resources,
+                    'dependencies': node.dependencies,
+                    'duration': durations.get(node_id),
+                }
             )
-            self._print_info('ARGS:')
-            self._print_info(pprint.pformat(args_input))
-            self._print_info('VARS:')
-            self._print_info(pprint.pformat(variables))
-            self._print_info('ENV:')
-            self._print_info(str(env))
-            self._print_info('-' * 80)
-            self._print_info('>>> ' + cmd.replace('\n', '\n>>> '))
-            self._print_info('=' * 80)
+        node_ids = {node['id'] for node in plan_nodes}
+        return {
+            'makim_file': str(Path(self.makim_file).resolve()),
+            'nodes': plan_nodes,
+            'edges': [
+                [dep_id, node_id]
+                for node_id in sorted(node_ids)
+                for dep_id in nodes[node_id].dependencies
+            ],
+        }
 
-        if not args.get('dry_run') and cmd:
-            self._call_shell_app(cmd)
+    def _get_critical_paths(
+        self, nodes: Dict[int, TargetNode]
+    ) -> Dict[int, float]:
+        """
+        Return the expected time from the start of each node to the end.
+
+        The expected durations come from the duration history, so the
+        scheduler can start first the targets of the longest chains.
+        """
+        durations = self._get_expected_durations(nodes)
+        if not durations:
+            return {}
 
-        # move back the environment variable to the previous values
-        os.environ.clear()
-        os.environ.update(self.env_scoped)
+        dependents: Dict[int, List[int]] = {node_id: [] for node_id in nodes}
+        for node in nodes.values():
+            for dep_id in node.dependencies:
+                dependents[dep_id].append(node.node_id)
+
+        paths: Dict[int, float] = {}
+        # note: the dependents always have a higher id than the dependencies
+        for node_id in sorted(nodes, reverse=True):
+            paths[node_id] = durations.get(node_id, 0.0) + max(
+                (paths[dependent] for dependent in dependents[node_id]),
+                default=0.0,
+            )
+        return paths
+
+    def _record_durations(self, nodes: Dict[int, TargetNode]):
+        """Store the duration of the executed targets in the history."""
+        from makim.history import DurationHistory, hash_args
+
+        durations = [
+            (
+                node.name,
+                hash_args(node.args_input),
+                node.duration,
+                node.status == NODE_DONE,
+            )
+            for node in nodes.values()
+            if node.executed and node.duration is not None
+        ]
+        if durations:
+            DurationHistory().record(
+                str(Path(self.makim_file).resolve()), durations
+            )
+
+    def _get_scheduler(self, nodes: Dict[int, TargetNode]) -> Scheduler:
+        budget = get_budget(self.args.get('cpus'), self.args.get('memory'))
+        jobs = self.args.get('jobs')
+        if jobs is None:
+            # note: with a budget, the resources limit the running targets
+            jobs = len(nodes) if budget else 1
+        jobs = int(jobs)
+        return Scheduler(
+            jobs=jobs,
+            keep_going=bool(self.args.get('keep_going')),
+            budget=budget,
+            # note: with one job, the targets run in the declaration order
+            priorities=(
+                self._get_critical_paths(nodes)
+                if jobs != 1 and len(nodes) > 1
+                else None
+            ),
+        )
+
+    def _run_nodes(self, nodes: Dict[int, TargetNode]) -> List[TargetNode]:
+        """Run the targets of the graph, return the ones that failed."""
+        scheduler = self._get_scheduler(nodes)
+        self._prefetch_cache(nodes)
+
+        def run_node(node: TargetNode):
+            start = time.perf_counter()
+            try:
+                with span(node.name, 'target'):
+                    self._run_node(node, nodes)
+            finally:
+                node.duration = time.perf_counter() - start
+
+        self._shell_workers = {}
+        self._shell_workers_lock = threading.Lock()
+        try:
+            failed = scheduler.run(nodes, run_node)
+        except KeyboardInterrupt:
+            for node_id in scheduler.running:
+                process = nodes[node_id].context.process
+                if process is None:
+                    continue
+                pid = process.pid
+                process.kill_group()
+                self._print_error(f'[EE] Process {pid} killed.')
+            self._fail(
+                MakimError.SH_KEYBOARD_INTERRUPT, 'The run was interrupted.'
+            )
+        finally:
+            for worker in self._shell_workers.values():
+                worker.close()
+            self._shell_workers = {}
+            self._shell_workers_lock = None
+
+        self._report_nodes(nodes, failed)
+        return failed
+
+    def _report_nodes(
+        self, nodes: Dict[int, TargetNode], failed: List[TargetNode]
+    ):
+        """Record the durations and show the failures of the run."""
+        self._record_durations(nodes)
+        self._report_matrix(nodes)
+        if failed:
+            for node in failed:
+                if node.tail:
+                    self._print_error(
+                        f'[EE] Last lines of the output of {node.name}:\n'
+                        + ''.join(node.tail).rstrip('\n')
+                    )
+                elif node.tail is None and not isinstance(
+                    node.error, MakimRunError
+                ):
+                    # note: the errors of the scripts are already shown
+                    self._print_error(
+                        f'[EE] The target {node.name} failed: '
+                        f'{type(node.error).__name__}: {node.error}'
+                    )
+            if len(failed) > 1 or len(nodes) > 1:
+                self._print_error(
+                    '[EE] Failed targets: '
+                    + ', '.join(node.name for node in failed)
+                )
+
+    # asyncio engine
+
+    async def _call_shell_async(
+        self, node: TargetNode, output: TargetOutput
+    ):
+        """Run the target script with asyncio, see `_call_shell_app`."""
+        import asyncio
+
+        async def pump(stream: Any, callback: Callable[[str], None]):
+            async for line in stream:
+                callback(line.decode('utf8', errors='replace'))
+
+        context = node.context
+        shell = context.shell_app.__dict__['__name__']
+        pipe = None if output.is_direct else asyncio.subprocess.PIPE
+        with ScriptFile(node.cmd) as script:
+            with span(node.name, 'spawn'):
+                process = await asyncio.create_subprocess_exec(
+                    shell,
+                    *get_shell_args(context.shell_app),
+                    script.path,
+                    stdout=pipe,
+                    stderr=pipe,
+                    env=node.env,
+                    cwd=str(context.working_directory),
+                    start_new_session=True,
+                    pass_fds=script.pass_fds,
+                    preexec_fn=self._get_preexec(node),
+                    limit=ASYNC_LINE_LIMIT,
+                )
+            pumps = (
+                []
+                if output.is_direct
+                else [
+                    pump(process.stdout, output.stdout),
+                    pump(process.stderr, output.stderr),
+                ]
+            )
+            try:
+                with span(node.name, 'wait'):
+                    await asyncio.wait_for(
+                        asyncio.gather(process.wait(), *pumps), node.timeout
+                    )
+            except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+                # note: the shell runs in its own session, like with `sh`
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise MakimTimeoutError(node.name, node.timeout)
+                raise
+
+        if process.returncode:
+            raise MakimShellError(shell, process.returncode)
+
+    async def _run_node_async(
+        self, node: TargetNode, nodes: Dict[int, TargetNode]
+    ):
+        import asyncio
+
+        # note: the cache can pack tarballs and call the remote cache, so
+        #       it runs in a thread instead of blocking the loop
+        loop = asyncio.get_running_loop()
+        started = await loop.run_in_executor(
+            None, self._start_node, node, nodes
+        )
+        if started is None:
+            return
+        output, cache_key = started
+
+        node.executed = True
+        try:
+            try:
+                await self._call_shell_async(node, output)
+            finally:
+                output.close()
+        except (MakimShellError, MakimTimeoutError) as e:
+            self._report_node_error(node, output, e)
+            raise
+        await loop.run_in_executor(
+            None, self._store_node, node, cache_key, output
+        )
+
+    async def _run_nodes_async(
+        self, nodes: Dict[int, TargetNode]
+    ) -> List[TargetNode]:
+        """Run the targets of the graph in the current asyncio loop."""
+        import asyncio
+
+        scheduler = self._get_scheduler(nodes)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._prefetch_cache, nodes
+        )
+
+        async def run_node(node: TargetNode):
+            start = time.perf_counter()
+            try:
+                with span(node.name, 'target'):
+                    await self._run_node_async(node, nodes)
+            finally:
+                node.duration = time.perf_counter() - start
+
+        failed = await scheduler.run_async(nodes, run_node)
+        self._report_nodes(nodes, failed)
+        return failed
+
+    def _report_matrix(self, nodes: Dict[int, TargetNode]):
+        """Show the status and the duration of each matrix cell."""
+        status_names = {
+            NODE_DONE: 'passed',
+            NODE_FAILED: 'failed',
+            NODE_SKIPPED: 'skipped',
+            NODE_PENDING: 'not run',
+        }
+        for node in nodes.values():
+            if not node.cells:
+                continue
+            lines = [f'[II] Matrix {node.name}:']
+            for cell_id in node.cells:
+                if (
+                    self._selected_nodes is not None
+                    and cell_id not in self._selected_nodes
+                ):
+                    # note: the cell runs in another shard
+                    continue
+                cell = nodes[cell_id]
+                duration = (
+                    '-' if cell.duration is None else f'{cell.duration:.2f}s'
+                )
+                values = self._format_matrix_cell(
+                    cell.context.args['matrix_cell']
+                )
+                lines.append(
+                    f'  {status_names[cell.status]:<8} {duration:>9}  {values}'
+                )
+            self._print_info('\n'.join(lines))
+
+    def _report_profile(self):
+        """Show or write the profile of this call, when it is enabled."""
+        profiler = get_profiler()
+        if profiler is None:
+            return
+
+        if self.args.get('profile'):
+            print(profiler.format_summary(), file=sys.stderr)
+
+        profile_out = self.args.get('profile_out')
+        if profile_out:
+            profiler.write_trace(profile_out)
+            self._print_info(f'[II] Profile trace written to {profile_out}.')
+
+    def _get_watch_patterns(
+        self, nodes: Dict[int, TargetNode]
+    ) -> Dict[int, List[str]]:
+        """Return the absolute paths (globs) watched by each target."""
+        patterns = {}
+        for node_id, node in nodes.items():
+            working_dir = Path(node.context.working_directory).absolute()
+            patterns[node_id] = [
+                str(working_dir / pattern)
+                for pattern in [*node.inputs, *node.watch]
+            ]
+        return patterns
+
+    def _get_affected_nodes(
+        self,
+        nodes: Dict[int, TargetNode],
+        patterns: Dict[int, List[str]],
+        changed: Set[str],
+    ) -> Set[int]:
+        """Return the targets affected by the changed files."""
+        affected: Set[int] = set()
+        # note: the dependencies always have a lower id than the dependents
+        for node_id in sorted(nodes):
+            if any(
+                dep_id in affected for dep_id in nodes[node_id].dependencies
+            ) or any(
+                match_patterns(path, patterns[node_id]) for path in changed
+            ):
+                affected.add(node_id)
+        return affected
+
+    def _start_watch_run(
+        self, nodes: Dict[int, TargetNode], selected: Optional[Set[int]]
+    ) -> int:
+        """Run the given targets in a forked process, return its pid."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # note: the forked process has the parsed config and the modules
+        #       already loaded
+        code = 0
+        try:
+            self._selected_nodes = selected
+            if self._run_nodes(nodes):
+                code = MakimError.SH_ERROR_RETURN_CODE.value
+        except MakimRunError as e:
+            code = e.error.value
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _wait_watch_run(
+        self, pid: int, watcher: Any, ignored: List[str]
+    ) -> Set[str]:
+        """
+        Wait for changes in the watched files.
+
+        When there are changes while the target is running, the run is
+        cancelled like with Ctrl+C, killing the running shell processes.
+        """
+        running = True
+        while True:
+            changed = {
+                path
+                for path in watcher.wait(0.1 if running else None)
+                if not any(
+                    path == output or path.startswith(output + os.sep)
+                    for output in ignored
+                )
+            }
+            if running and os.waitpid(pid, os.WNOHANG)[0]:
+                running = False
+                self._print_info('[II] Waiting for changes...')
+            if not changed:
+                continue
+            if running:
+                os.kill(pid, signal.SIGINT)
+                os.waitpid(pid, 0)
+                self._print_warning('[WW] Run cancelled by new changes.')
+            return changed
 
     # public methods
 
     def load(self, makim_file: str):
         """Load makim configuration."""
         self.makim_file = makim_file
-        self._load_config_data()
+        with span(str(makim_file), 'load'):
+            self._load_config_data()
         self._verify_config()
         self._load_shell_app()
         self.env = self._load_dotenv(self.global_data)
 
-    def run(self, args: dict):
-        """Run makim target code."""
-        self.args = args
+    def _load_targets(
+        self,
+        args: Union[dict, List[dict]],
+        graph: TargetGraph,
+        env: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        """
+        Add the given targets and their dependencies to the graph.
+
+        All the targets share the same graph, so a dependency used by more
+        than one of them (with the same arguments) runs just once. Returns
+        False when none of the targets should be executed.
+        """
+        # note: the env of the process is not changed, so many runs can
+        #       have their own env in the same process
+        self.env_base = {
+            **(os.environ if env is None else env),
+            **MAKIM_ENV,
+        }
+        loaded = False
+        for target_args in [args] if isinstance(args, dict) else args:
+            node_id = self._load_target(target_args, self.env_base, graph)
+            if node_id is not None:
+                loaded = True
+        return loaded
+
+    def watch(self, args: Union[dict, List[dict]]):
+        """
+        Run the target, and run it again when its watched files change.
+
+        The watched files are the `inputs` and `watch` patterns of the
+        target and of its dependencies, and the config file. Only the
+        targets affected by the changes (and their dependents) run again.
+        """
+        from makim.watcher import create_watcher
+
+        targets_args = [args] if isinstance(args, dict) else args
+        makim_file = str(Path(self.makim_file).absolute())
+        changed: Optional[Set[str]] = None
+        while True:
+            graph = TargetGraph()
+            self._load_targets(
+                [dict(target_args) for target_args in targets_args], graph
+            )
+            patterns = self._get_watch_patterns(graph.nodes)
+            watched = [path for paths in patterns.values() for path in paths]
+            if not watched:
+                self._print_warning(
+                    '[WW] The target has no `inputs` or `watch` files, '
+                    'just the config file is watched.'
+                )
+            outputs = [
+                str(Path(node.context.working_directory).absolute() / path)
+                for node in graph.nodes.values()
+                for path in node.outputs
+            ]
+
+            watcher = create_watcher([*watched, makim_file])
+            try:
+                selected = (
+                    None
+                    if changed is None
+                    else self._get_affected_nodes(
+                        graph.nodes, patterns, changed
+                    )
+                )
+                pid = self._start_watch_run(graph.nodes, selected)
+                changed = self._wait_watch_run(pid, watcher, outputs)
+            except KeyboardInterrupt:
+                os._exit(MakimError.SH_KEYBOARD_INTERRUPT.value)
+            finally:
+                watcher.close()
 
-        # setup
-        self._verify_args()
-        self._change_target(args['target'])
-        self._load_target_args()
+            self._print_info(
+                '[II] Changes detected: ' + ', '.join(sorted(changed))
+            )
+            if makim_file in changed:
+                self.load(self.makim_file)
+                changed = None
+
+    def _load_run(
+        self, args: List[dict], env: Optional[Dict[str, str]]
+    ) -> Optional[TargetGraph]:
+        """Return the graph of the targets to run, if there is any."""
+        graph = TargetGraph()
+        if not self._load_targets(args, graph, env):
+            return None
+
+        shard = self.args.get('shard')
+        self._selected_nodes = (
+            self._get_shard_nodes(graph.nodes, *shard) if shard else None
+        )
+        if self.args.get('plan'):
+            print(json.dumps(self._get_plan(graph.nodes), indent=2))
+            return None
 
-        # commands
-        if self.target_data.get('if') and not self._verify_target_conditional(
-            self.target_data['if']
+        if self.args.get('remote_cache') or self.args.get(
+            'remote_cache_read_only'
         ):
-            return warnings.warn(
-                f'{args["target"]} not executed. '
-                'Condition (if) not satisfied.'
+            self.cache = TaskCache(
+                self.cache.path,
+                self.cache.max_size,
+                get_remote_cache(
+                    self.args.get('remote_cache'),
+                    self.args.get('remote_cache_read_only', False),
+                ),
+            )
+        return graph
+
+    def _prefetch_cache(self, nodes: Dict[int, TargetNode]):
+        """
+        Download the remote cache entries the targets will probably need.
+
+        The cache key of a target depends on its inputs, that can be
+        written by its dependencies, so the keys are computed up front
+        only for the targets whose dependencies don't declare outputs. The
+        entries of the other targets are downloaded when they start.
+        """
+        if not self.cache.remote or self.args.get('dry_run'):
+            return
+
+        keys = []
+        for node in nodes.values():
+            if (
+                not node.cmd
+                or node.cells
+                or (
+                    self._selected_nodes is not None
+                    and node.node_id not in self._selected_nodes
+                )
+                or any(nodes[dep].outputs for dep in node.dependencies)
+                or self._check_target_outdated(node, nodes) is None
+            ):
+                continue
+            cache_key = self._get_cache_key(node)
+            if cache_key:
+                keys.append(cache_key)
+
+        with span('prefetch', 'cache'):
+            fetched = self.cache.prefetch(keys)
+        if self.args.get('verbose') and fetched:
+            self._print_info(
+                f'[II] Downloaded {fetched} entries from the remote cache.'
+            )
+
+    def _set_result(
+        self,
+        result: RunResult,
+        nodes: Dict[int, TargetNode],
+        failed: List[TargetNode],
+    ):
+        if failed:
+            result.code = MakimError.SH_ERROR_RETURN_CODE.value
+            result.message = 'Failed targets: ' + ', '.join(
+                node.name for node in failed
             )
 
-        self._run_dependencies(args)
-        self._run_command(args)
+        for node in nodes.values():
+            if node.cells or (
+                self._selected_nodes is not None
+                and node.node_id not in self._selected_nodes
+            ):
+                continue
+            if node.status == NODE_DONE:
+                result.done.append(node.name)
+            elif node.status == NODE_FAILED:
+                result.failed.append(node.name)
+            else:
+                result.skipped.append(node.name)
+
+    def execute(
+        self,
+        args: Union[dict, List[dict]],
+        env: Optional[Dict[str, str]] = None,
+    ) -> RunResult:
+        """
+        Run makim targets and return the result, instead of exiting.
+
+        Each call has its own state, so a loaded `Makim` object can be used
+        by many threads at the same time. `env` is the base env for the
+        targets (by default, the env of the process).
+        """
+        start = time.perf_counter()
+        result = RunResult()
+        runner = self._new_runner()
+        try:
+            try:
+                graph = runner._load_run(self._copy_args(args), env)
+                if graph is not None:
+                    failed = runner._run_nodes(graph.nodes)
+                    runner._set_result(result, graph.nodes, failed)
+            finally:
+                runner._report_profile()
+        except MakimRunError as e:
+            result.code = e.error.value
+            result.message = str(e)
+        result.duration = time.perf_counter() - start
+        return result
+
+    async def run_async(
+        self,
+        args: Union[dict, List[dict]],
+        env: Optional[Dict[str, str]] = None,
+    ) -> RunResult:
+        """
+        Run makim targets in the current asyncio loop, see `execute`.
+
+        The target processes are supervised by the loop, without a thread
+        for each one of them, so `jobs` can be as high as the number of
+        targets. Cancelling the call kills the running target processes.
+        `--shell-worker` is not used by this engine.
+        """
+        start = time.perf_counter()
+        result = RunResult()
+        runner = self._new_runner()
+        try:
+            try:
+                # note: loading the graph doesn't wait for any process
+                graph = runner._load_run(self._copy_args(args), env)
+                if graph is not None:
+                    failed = await runner._run_nodes_async(graph.nodes)
+                    runner._set_result(result, graph.nodes, failed)
+            finally:
+                runner._report_profile()
+        except MakimRunError as e:
+            result.code = e.error.value
+            result.message = str(e)
+        result.duration = time.perf_counter() - start
+        return result
+
+    def _new_runner(self) -> 'Makim':
+        """Return a copy of this object, with its own state for a run."""
+        # note: the copy shares the parsed config, that is read-only
+        return copy.copy(self)
+
+    def _copy_args(self, args: Union[dict, List[dict]]) -> List[dict]:
+        # note: the args are changed while the targets are loaded
+        targets_args = [args] if isinstance(args, dict) else args
+        return [dict(target_args) for target_args in targets_args]
+
+    def run(self, args: Union[dict, List[dict]]) -> RunResult:
+        """
+        Run makim target code, exiting with the error code on failures.
+
+        `args` can be a list, with the arguments for each target, to run
+        many targets in the same call (concurrently, with `jobs`).
+        """
+        result = self.execute(args)
+        if result.code:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(result.code)
+        return result
@@ -0,0 +1,135 @@
+"""
+Output of the targets (`--output`).
+
+- `stream` (default): the targets write to the makim stdout and stderr.
+- `prefix`: each line is prefixed by the target name, so the output of
+  concurrent targets (`--jobs`) can be told apart.
+- `group`: the output of each target is spooled (in memory up to a limit,
+  then in a temporary file) and written at once when the target ends.
+- `log`: the output of each target is written to its own log file.
+
+Except for `stream`, the last lines of each target are kept in a ring
+buffer, to be shown in the error summary when the target fails.
+"""
+import shutil
+import sys
+import tempfile
+import threading
+
+from collections import deque
+from pathlib import Path
+from typing import IO, Deque, Dict, List, Optional, Tuple
+
+OUTPUT_MODES = ('stream', 'prefix', 'group', 'log')
+# default directory for the log files of the `log` mode
+OUTPUT_LOG_DIR = '.makim/logs'
+STREAMS = ('stdout', 'stderr')
+# lines of each target kept for the error summary
+TAIL_SIZE = 20
+# max size of the output of a target kept in memory by the `group` mode
+SPOOL_SIZE = 64 * 1024
+
+# the output of the targets running concurrently is written line by line
+# (prefix) or target by target (group)
+_write_lock = threading.Lock()
+
+
+class TargetOutput:
+    """Output streams of one target execution."""
+
+    def __init__(
+        self,
+        name: str,
+        mode: str = 'stream',
+        log_dir: Optional[Path] = None,
+        capture: bool = False,
+    ):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f'The output mode `{mode}` is not valid.')
+        self.name = name
+        self.mode = mode
+        self.tail: Deque[str] = deque(maxlen=TAIL_SIZE)
+        # the whole output, when it is needed by the cache
+        self._captured: Optional[Dict[str, List[str]]] = (
+            {stream: [] for stream in STREAMS} if capture else None
+        )
+        self._spools: Dict[str, IO[str]] = {}
+        self._log: Optional[IO[str]] = None
+        self.log_path: Optional[Path] = None
+
+        if mode == 'group':
+            self._spools = {
+                stream: tempfile.SpooledTemporaryFile(
+                    SPOOL_SIZE, mode='w+', encoding='utf8'
+                )
+                for stream in STREAMS
+            }
+        elif mode == 'log':
+            log_dir = Path(log_dir or '.')
+            log_dir.mkdir(parents=True, exist_ok=True)
+            self.log_path = log_dir / (name.replace('/', '_') + '.log')
+            self._log = self.log_path.open('w', encoding='utf8')
+
+    @property
+    def is_direct(self) -> bool:
+        """Check if the target can write to the makim streams directly."""
+        return self.mode == 'stream' and self._captured is None
+
+    def stdout(self, chunk: str):
+        """Write a chunk (usually a line) of the target stdout."""
+        self._write('stdout', chunk)
+
+    def stderr(self, chunk: str):
+        """Write a chunk (usually a line) of the target stderr."""
+        self._write('stderr', chunk)
+
+    def _write(self, stream_name: str, chunk: str):
+        if not chunk:
+            return
+        if self._captured is not None:
+            self._captured[stream_name].append(chunk)
+
+        if self.mode == 'stream':
+            stream = getattr(sys, stream_name)
+            stream.write(chunk)
+            stream.flush()
+            return
+
+        self.tail.append(chunk)
+        if self.mode == 'prefix':
+            text = ''.join(
+                f'[{self.name}] {line}'
+                for line in chunk.splitlines(keepends=True)
+            )
+            stream = getattr(sys, stream_name)
+            with _write_lock:
+                stream.write(text if text.endswith('\n') else text + '\n')
+                stream.flush()
+        elif self.mode == 'group':
+            self._spools[stream_name].write(chunk)
+        elif self._log is not None:
+            self._log.write(chunk)
+
+    def captured(self) -> Tuple[str, str]:
+        """Return the whole stdout and stderr of the target."""
+        if self._captured is None:
+            return '', ''
+        return (
+            ''.join(self._captured['stdout']),
+            ''.join(self._captured['stderr']),
+        )
+
+    def close(self):
+        """Write the spooled output (`group`) and close the files."""
+        if self._spools:
+            with _write_lock:
+                for stream_name, spool in self._spools.items():
+                    stream = getattr(sys, stream_name)
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, stream)
+                    stream.flush()
+                    spool.close()
+            self._spools = {}
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,123 @@
+"""
+Profiler for the makim phases (`--profile` and `--profile-out`).
+
+The instrumented code wraps each phase (config load, target resolution,
+env rendering, template rendering, shell spawn and wait, ...) with
+`span(name, category)`. While the profiler is disabled (the default),
+`span` returns a shared no-op context manager, so the instrumentation costs
+just one function call.
+
+The collected spans can be shown as a summary table or exported as a Chrome
+trace-event file, which can be opened in `chrome://tracing` or Perfetto.
+"""
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+_NULL_SPAN: ContextManager[None] = nullcontext()
+
+
+class Profiler:
+    """Collect the spans of the makim phases."""
+
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+        self.events: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        """Record the duration of the wrapped code as a complete event."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            # note: list.append is atomic, targets can run in threads
+            self.events.append(
+                {
+                    'name': name,
+                    'cat': category,
+                    'ph': 'X',
+                    'ts': (start - self.start) / 1000,
+                    'dur': (end - start) / 1000,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': args,
+                }
+            )
+
+    def _format_table(self, title: str, rows: Dict[str, List[float]]) -> str:
+        lines = [
+            f'{title:<40} {"calls":>7} {"total ms":>10} '
+            f'{"mean ms":>10} {"max ms":>10}',
+            '-' * 81,
+        ]
+        for name, durations in sorted(
+            rows.items(), key=lambda row: -sum(row[1])
+        ):
+            total = sum(durations) / 1000
+            lines.append(
+                f'{name[:40]:<40} {len(durations):>7} {total:>10.2f} '
+                f'{total / len(durations):>10.2f} '
+                f'{max(durations) / 1000:>10.2f}'
+            )
+        return '\n'.join(lines)
+
+    def format_summary(self) -> str:
+        """Return the summary tables, by phase and by target."""
+        phases: Dict[str, List[float]] = {}
+        targets: Dict[str, List[float]] = {}
+        for event in self.events:
+            phases.setdefault(event['cat'], []).append(event['dur'])
+            if event['cat'] == 'target':
+                targets.setdefault(event['name'], []).append(event['dur'])
+
+        summary = [
+            self._format_table('PHASE', phases),
+            '(the time of nested phases is included in the outer ones)',
+        ]
+        if targets:
+            summary.extend(['', self._format_table('TARGET', targets)])
+        return '\n'.join(summary)
+
+    def write_trace(self, path: str):
+        """Write the spans as a Chrome trace-event JSON file."""
+        with open(path, 'w') as f:
+            json.dump(
+                {'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f
+            )
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    """Start collecting the spans."""
+    global _profiler  # noqa: PLW0603
+
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    """Stop collecting the spans, returning the current profiler."""
+    global _profiler
+
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Return the current profiler, or None when it is disabled."""
+    return _profiler
+
+
+def span(name: str, category: str, **args: Any) -> ContextManager[None]:
+    """Return a context manager that records the wrapped phase."""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, category, **args)
@@ -0,0 +1,177 @@
+"""
+Remote cache for the results of the targets, shared over HTTP.
+
+The protocol is the one used by the HTTP remote caches of Bazel and
+sccache: an entry is downloaded with `GET <url>/<key>` (404 when it doesn't
+exist) and uploaded with `PUT <url>/<key>`. So any server that supports it
+(nginx with WebDAV, bazel-remote, a bucket behind a proxy, ...) can be used,
+and `makim cache serve` is a small reference server, for tests and for
+small teams.
+
+The remote cache is an optimization: any error (network, server, broken
+entry) is handled as a cache miss.
+"""
+import os
+import re
+
+from pathlib import Path
+from typing import Any, Optional
+
+REMOTE_CACHE_TIMEOUT = 30
+# path of an entry in the server: names separated by `/`, without `..`
+REMOTE_KEY_PATTERN = re.compile(r'^[\w-]+(/[\w-]+)*$')
+
+
+def get_remote_cache(
+    url: Optional[str] = None, read_only: bool = False
+) -> Optional['RemoteCache']:
+    """
+    Return the remote cache from the arguments or from the env.
+
+    The env variables are `MAKIM_REMOTE_CACHE` (the URL) and
+    `MAKIM_REMOTE_CACHE_READ_ONLY` (`1` to never upload entries).
+    """
+    url = url or os.environ.get('MAKIM_REMOTE_CACHE')
+    if not url:
+        return None
+    read_only = read_only or os.environ.get(
+        'MAKIM_REMOTE_CACHE_READ_ONLY', ''
+    ) not in ('', '0')
+    return RemoteCache(url, read_only)
+
+
+class RemoteCache:
+    """
+    HTTP client for the remote cache.
+
+    With `read_only`, the entries are downloaded but never uploaded, e.g.
+    for the CI jobs of untrusted branches.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        read_only: bool = False,
+        timeout: float = REMOTE_CACHE_TIMEOUT,
+    ):
+        self.url = url.rstrip('/')
+        self.read_only = read_only
+        self.timeout = timeout
+
+    def _request(self, method: str, key: str, data: Optional[bytes] = None):
+        import urllib.request
+
+        request = urllib.request.Request(
+            f'{self.url}/{key}', data=data, method=method
+        )
+        if data is not None:
+            request.add_header('Content-Type', 'application/octet-stream')
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Download the entry for the given key, None when it is missing."""
+        from http.client import HTTPException
+
+        try:
+            with self._request('GET', key) as response:
+                return response.read()
+        except (OSError, ValueError, HTTPException):
+            # note: urllib errors (including HTTP 404) are OSError, broken
+            #       responses (e.g. IncompleteRead) are HTTPException
+            return None
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Upload the entry for the given key, if not in read-only mode."""
+        from http.client import HTTPException
+
+        if self.read_only:
+            return False
+        try:
+            with self._request('PUT', key, data):
+                return True
+        except (OSError, ValueError, HTTPException):
+            return False
+
+
+def _get_handler(path: Path) -> Any:
+    from http.server import BaseHTTPRequestHandler
+
+    class RemoteCacheHandler(BaseHTTPRequestHandler):
+        """Serve the entries of the remote cache from a directory."""
+
+        def _entry_path(self) -> Optional[Path]:
+            key = self.path.split('?', 1)[0].strip('/')
+            if not REMOTE_KEY_PATTERN.match(key):
+                self.send_error(400, 'Invalid key')
+                return None
+            return path / key
+
+        def _send_entry(self, body: bool):
+            entry_path = self._entry_path()
+            if entry_path is None:
+                return
+            try:
+                data = entry_path.read_bytes()
+            except OSError:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if body:
+                self.wfile.write(data)
+
+        def do_GET(self):
+            """Send an entry."""
+            self._send_entry(body=True)
+
+        def do_HEAD(self):
+            """Check if an entry exists."""
+            self._send_entry(body=False)
+
+        def do_PUT(self):
+            """Store an entry, replacing the previous one (if any)."""
+            entry_path = self._entry_path()
+            if entry_path is None:
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            data = self.rfile.read(length)
+
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            # note: write to a temporary file first, so a concurrent GET
+            #       never sees an incomplete entry
+            tmp_path = entry_path.with_name(
+                f'.{entry_path.name}.{os.getpid()}.{id(self)}'
+            )
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, entry_path)
+
+            self.send_response(201)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format: str, *args: Any):
+            """Log the requests only when the server is verbose."""
+            if self.server.verbose:  # type: ignore[attr-defined]
+                super().log_message(format, *args)
+
+    return RemoteCacheHandler
+
+
+def make_server(
+    path: Path, host: str = '127.0.0.1', port: int = 0, verbose: bool = False
+) -> Any:
+    """
+    Create the reference server for the remote cache.
+
+    The entries are stored as files in `path`. The server has no
+    authentication, so it should be used only in a trusted network (or
+    behind a proxy).
+    """
+    from http.server import ThreadingHTTPServer
+
+    path.mkdir(parents=True, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), _get_handler(path))
+    server.verbose = verbose  # type: ignore[attr-defined]
+    return server
@@ -0,0 +1,69 @@
+"""
+Resources of the targets (`resources`, `--cpus` and `--memory`).
+
+A target can declare how much of the machine it uses, e.g.
+`resources: {cpu: 4, memory: 2G}`. When a budget is given, the scheduler
+starts a target only while the targets already running leave room for it
+in the budget. A target that doesn't declare its resources counts as one
+CPU and no memory.
+"""
+from typing import Any, Dict, Optional
+
+from makim.cache import parse_size
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+RESOURCE_NAMES = ('cpu', 'memory')
+DEFAULT_RESOURCES = {'cpu': 1.0, 'memory': 0.0}
+
+
+def parse_resources(resources: Any) -> Dict[str, float]:
+    """Parse the `resources` attribute of a target."""
+    if resources is None:
+        resources = {}
+    if not isinstance(resources, dict) or any(
+        name not in RESOURCE_NAMES for name in resources
+    ):
+        raise ValueError(
+            'The `resources` attribute should map '
+            f'{" and ".join(RESOURCE_NAMES)} to their amounts.'
+        )
+    parsed = dict(DEFAULT_RESOURCES)
+    if 'cpu' in resources:
+        parsed['cpu'] = float(resources['cpu'])
+    if 'memory' in resources:
+        parsed['memory'] = float(parse_size(resources['memory']))
+    if any(amount < 0 for amount in parsed.values()):
+        raise ValueError('The resources of a target should not be negative.')
+    return parsed
+
+
+def get_budget(
+    cpus: Optional[float] = None, memory: Optional[Any] = None
+) -> Dict[str, float]:
+    """Return the resources available for the targets running at once."""
+    budget = {}
+    if cpus is not None:
+        budget['cpu'] = float(cpus)
+    if memory is not None:
+        budget['memory'] = float(parse_size(memory))
+    return budget
+
+
+def can_limit_memory() -> bool:
+    """Check if the memory of the target processes can be limited."""
+    return resource is not None
+
+
+def set_memory_limit(memory: float):
+    """
+    Limit the address space of the current process (and its children).
+
+    It should be called in the target process, after the fork and before
+    the exec of the shell, so it doesn't import anything.
+    """
+    limit = int(memory)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
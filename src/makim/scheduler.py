@@ -0,0 +1,377 @@
+"""Scheduler for running the target dependency graph."""
+import heapq
+import os
+
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+NODE_PENDING = 'pending'
+NODE_DONE = 'done'
+NODE_FAILED = 'failed'
+NODE_SKIPPED = 'skipped'
+
+
+class ExecutionContext:
+    """
+    Runtime state of one target.
+
+    It holds just references to the parsed config (shared read-only by all
+    the targets), so creating a context doesn't depend on the config size.
+    """
+
+    __slots__ = (
+        'args',
+        'env_scoped',
+        'group_data',
+        'group_name',
+        'process',
+        'shell_app',
+        'target_data',
+        'target_name',
+        'working_directory',
+    )
+
+    def __init__(self):
+        self.args: dict = {}
+        self.group_name = ''
+        self.group_data: dict = {}
+        self.target_name = ''
+        self.target_data: dict = {}
+        self.shell_app: Any = None
+        self.env_scoped: dict = {}
+        self.working_directory: Optional[Path] = None
+        # shell process of the target, when it is running
+        self.process: Any = None
+
+
+class TargetNode:
+    """A target execution inside the dependency graph."""
+
+    __slots__ = (
+        'args_input',
+        'cells',
+        'changed',
+        'cmd',
+        'context',
+        'dependencies',
+        'duration',
+        'env',
+        'error',
+        'executed',
+        'inputs',
+        'name',
+        'node_id',
+        'outputs',
+        'resources',
+        'status',
+        'tail',
+        'timeout',
+        'variables',
+        'watch',
+    )
+
+    def __init__(self, node_id: int, name: str, dependencies: List[int]):
+        self.node_id = node_id
+        self.name = name
+        self.dependencies = dependencies
+        self.status = NODE_PENDING
+        self.error: Optional[BaseException] = None
+        # runtime state of the target (group, target, shell, working dir)
+        self.context: Any = None
+        self.cmd: str = ''
+        self.env: Dict[str, str] = {}
+        self.args_input: dict = {}
+        self.variables: dict = {}
+        # rendered `inputs` (glob patterns) and `outputs` of the target
+        self.inputs: List[str] = []
+        self.outputs: List[str] = []
+        # rendered `watch` patterns of the target (--watch)
+        self.watch: List[str] = []
+        # True when the target was executed (it was not up to date)
+        self.changed = False
+        # execution time, in seconds, once the target was executed
+        self.duration: Optional[float] = None
+        # True when the script of the target was run (not restored from
+        # the cache, not up to date)
+        self.executed = False
+        # for a `matrix` target, the ids of the nodes of its cells
+        self.cells: List[int] = []
+        # last lines of the output, when the script of the target failed
+        # (--output); None when the target failed before or after it
+        self.tail: Optional[List[str]] = None
+        # max execution time of the script, in seconds (`timeout`)
+        self.timeout: Optional[float] = None
+        # resources used by the target while it runs (`resources`)
+        self.resources: Dict[str, float] = {}
+
+
+class TargetGraph:
+    """
+    Dependency graph of the targets for one makim invocation.
+
+    Each node is identified by the qualified name of the target and its
+    resolved arguments, so a target requested more than once with the same
+    arguments is added to the graph (and executed) just once.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[int, TargetNode] = {}
+        # node id for each (target name, arguments) key, None while the
+        # dependencies of the target are still being loaded
+        self.keys: Dict[Tuple[str, str, str], Optional[int]] = {}
+        # resolved env/vars layers of the scopes, see
+        # `Makim._load_scoped_data`
+        self.env_layers: Dict[tuple, tuple] = {}
+
+    def add(
+        self, key: Tuple[str, str, str], dependencies: List[int]
+    ) -> TargetNode:
+        """Add a new node for the given key to the graph."""
+        node = TargetNode(len(self.nodes), key[0], dependencies)
+        self.nodes[node.node_id] = node
+        self.keys[key] = node.node_id
+        return node
+
+
+class Scheduler:
+    """
+    Run the nodes of a dependency graph on a pool of workers.
+
+    A node is started only when all its dependencies are done. When there
+    is more than one node ready, the node with the highest priority (e.g.
+    the longest expected time until the end of the graph) is started first,
+    then the node with the lowest id. So without priorities, the execution
+    order is the same as the declaration order of the dependencies.
+
+    With a `budget` of resources (e.g. `{'cpu': 8}`), a node is started only
+    when the resources of the running nodes leave room for its own ones, so
+    a ready node with a lower priority can start before a bigger one. A
+    node that needs more than the whole budget runs alone.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        keep_going: bool = False,
+        priorities: Optional[Dict[int, float]] = None,
+        budget: Optional[Dict[str, float]] = None,
+    ):
+        if jobs < 0:
+            raise ValueError('The number of jobs should not be negative.')
+        self.jobs = jobs or os.cpu_count() or 1
+        self.keep_going = keep_going
+        self.priorities = priorities or {}
+        self.budget = budget or {}
+        self.running: Set[int] = set()
+        self._used = {name: 0.0 for name in self.budget}
+
+    def _ready_item(self, node_id: int) -> Tuple[float, int]:
+        return (-self.priorities.get(node_id, 0.0), node_id)
+
+    def _prepare(self, nodes: Dict[int, TargetNode]):
+        self._dependents: Dict[int, List[int]] = {k: [] for k in nodes}
+        self._waiting: Dict[int, int] = {}
+        for node_id, node in nodes.items():
+            self._waiting[node_id] = len(set(node.dependencies))
+            for dep_id in set(node.dependencies):
+                self._dependents[dep_id].append(node_id)
+        self._ready = sorted(
+            self._ready_item(k) for k, v in self._waiting.items() if not v
+        )
+        self._failed = False
+
+    def _get_usage(self, node: TargetNode) -> Dict[str, float]:
+        return {
+            name: min(node.resources.get(name, 0.0), amount)
+            for name, amount in self.budget.items()
+        }
+
+    def _fits(self, node: TargetNode) -> bool:
+        return all(
+            # note: a small tolerance for the sums of float amounts
+            self._used[name] + amount <= self.budget[name] + 1e-9
+            for name, amount in self._get_usage(node).items()
+        )
+
+    def _pop_ready(self, nodes: Dict[int, TargetNode]) -> Optional[int]:
+        if not self._ready or (self._failed and not self.keep_going):
+            return None
+        if not self.budget:
+            return heapq.heappop(self._ready)[1]
+
+        # the ready node with the highest priority that fits in the budget
+        skipped = []
+        node_id = None
+        while self._ready:
+            item = heapq.heappop(self._ready)
+            if self._fits(nodes[item[1]]):
+                node_id = item[1]
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self._ready, item)
+        if node_id is not None:
+            for name, amount in self._get_usage(nodes[node_id]).items():
+                self._used[name] += amount
+        return node_id
+
+    def _complete(
+        self,
+        nodes: Dict[int, TargetNode],
+        node_id: int,
+        error: Optional[BaseException],
+    ):
+        self.running.discard(node_id)
+        node = nodes[node_id]
+        for name, amount in self._get_usage(node).items():
+            self._used[name] -= amount
+
+        if error is None:
+            node.status = NODE_DONE
+            for dependent_id in self._dependents[node_id]:
+                self._waiting[dependent_id] -= 1
+                if not self._waiting[dependent_id]:
+                    heapq.heappush(
+                        self._ready, self._ready_item(dependent_id)
+                    )
+            return
+
+        node.status = NODE_FAILED
+        node.error = error
+        self._failed = True
+
+        # nodes that depend on the failed node will never run
+        skipped = list(self._dependents[node_id])
+        while skipped:
+            dependent = nodes[skipped.pop()]
+            if dependent.status != NODE_PENDING:
+                continue
+            dependent.status = NODE_SKIPPED
+            skipped.extend(self._dependents[dependent.node_id])
+
+    def run(
+        self,
+        nodes: Dict[int, TargetNode],
+        execute: Callable[[TargetNode], None],
+    ) -> List[TargetNode]:
+        """
+        Execute all the nodes, respecting their dependencies.
+
+        Returns the list of the nodes that failed.
+        """
+        self._prepare(nodes)
+
+        if self.jobs == 1:
+            self._run_serial(nodes, execute)
+        else:
+            self._run_parallel(nodes, execute)
+
+        return [node for node in nodes.values() if node.status == NODE_FAILED]
+
+    async def run_async(
+        self,
+        nodes: Dict[int, TargetNode],
+        execute: Callable[[TargetNode], Awaitable[None]],
+    ) -> List[TargetNode]:
+        """
+        Execute all the nodes as tasks of the current asyncio loop.
+
+        At most `jobs` nodes run at the same time. When this call is
+        cancelled, the running nodes are cancelled too. Returns the list of
+        the nodes that failed.
+        """
+        import asyncio
+
+        self._prepare(nodes)
+        tasks: Dict[Any, int] = {}
+        try:
+            while True:
+                while len(tasks) < self.jobs:
+                    node_id = self._pop_ready(nodes)
+                    if node_id is None:
+                        break
+                    self.running.add(node_id)
+                    task = asyncio.ensure_future(execute(nodes[node_id]))
+                    tasks[task] = node_id
+
+                if not tasks:
+                    break
+
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    node_id = tasks.pop(task)
+                    self._complete(nodes, node_id, task.exception())
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        return [node for node in nodes.values() if node.status == NODE_FAILED]
+
+    def _run_serial(
+        self,
+        nodes: Dict[int, TargetNode],
+        execute: Callable[[TargetNode], None],
+    ):
+        while True:
+            node_id = self._pop_ready(nodes)
+            if node_id is None:
+                return
+
+            self.running.add(node_id)
+            error: Optional[BaseException] = None
+            try:
+                execute(nodes[node_id])
+            except Exception as e:
+                error = e
+            self._complete(nodes, node_id, error)
+
+    def _run_parallel(
+        self,
+        nodes: Dict[int, TargetNode],
+        execute: Callable[[TargetNode], None],
+    ):
+        # concurrent.futures is imported just when it is needed,
+        # as it is relatively slow to import
+        from concurrent.futures import (
+            FIRST_COMPLETED,
+            Future,
+            ThreadPoolExecutor,
+            wait,
+        )
+
+        futures: Dict[Future, int] = {}
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+
+        # note: don't wait for the workers on shutdown, otherwise a
+        #       KeyboardInterrupt would be blocked by the running targets
+        try:
+            while True:
+                while len(futures) < self.jobs:
+                    node_id = self._pop_ready(nodes)
+                    if node_id is None:
+                        break
+                    self.running.add(node_id)
+                    futures[pool.submit(execute, nodes[node_id])] = node_id
+
+                if not futures:
+                    return
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node_id = futures.pop(future)
+                    self._complete(nodes, node_id, future.exception())
+        finally:
+            pool.shutdown(wait=False)
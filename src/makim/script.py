@@ -0,0 +1,78 @@
+"""
+Deliver the script of a target to the shell.
+
+On Linux, the script is written to an anonymous in-memory file
+(`memfd_create`), and the shell reads it from `/proc/self/fd/N`, with the
+file descriptor inherited by the shell process. So nothing is written to
+the disk, and there is nothing to clean up: the file is gone when the last
+file descriptor is closed.
+
+On other platforms, the script is written to a temporary file, removed as
+soon as the shell process ends.
+
+The script is not given with `-c` or through stdin: the command line of a
+process is visible to the other users (and the rendered script can have
+secrets from the env or the args), and stdin belongs to the target.
+"""
+import os
+import tempfile
+
+from typing import Optional, Tuple
+
+PROC_FD_DIR = '/proc/self/fd'
+
+
+def _create_memfd() -> Optional[int]:
+    memfd_create = getattr(os, 'memfd_create', None)
+    if memfd_create is None or not os.path.isdir(PROC_FD_DIR):
+        return None
+    try:
+        # note: the file descriptor is inheritable, so it is passed to the
+        #       shell; the other processes started by makim close it
+        return memfd_create('makim-script', 0)
+    except OSError:
+        return None
+
+
+class ScriptFile:
+    """File with the script of a target, to be run by the shell."""
+
+    def __init__(self, content: str):
+        self.fd = _create_memfd()
+        self.is_memfd = self.fd is not None
+        if self.fd is not None:
+            self.path = f'{PROC_FD_DIR}/{self.fd}'
+        else:
+            self.fd, self.path = tempfile.mkstemp(suffix='.makim', text=True)
+
+        data = content.encode('utf8')
+        while data:
+            data = data[os.write(self.fd, data) :]
+        if not self.is_memfd:
+            os.close(self.fd)
+            self.fd = None
+
+    @property
+    def pass_fds(self) -> Tuple[int, ...]:
+        """Return the file descriptors the shell process should inherit."""
+        return () if self.fd is None else (self.fd,)
+
+    def close(self):
+        """Release the script, once the shell doesn't need it anymore."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        elif not self.is_memfd and self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = ''
+
+    def __enter__(self) -> 'ScriptFile':
+        """Return the script file."""
+        return self
+
+    def __exit__(self, *args):
+        """Release the script."""
+        self.close()
@@ -0,0 +1,80 @@
+"""
+Render the Jinja2 templates used in the makim config file.
+
+All the templates are rendered by one shared `jinja2.Environment`, which
+keeps the compiled templates in a LRU cache keyed by their source, so the
+same string (e.g. a global env value, rendered once per target) is compiled
+just once per process. The compiled bytecode can also be stored on disk
+(`MAKIM_TEMPLATE_BYTECODE_CACHE=1`), inside the makim cache directory.
+
+Strings without any template tag are returned without using Jinja2 at all.
+"""
+import os
+
+from functools import lru_cache
+from typing import Any, Optional
+
+from makim.cache import get_cache_dir
+from makim.profiler import get_profiler, span
+
+# max number of compiled templates kept in memory
+TEMPLATE_CACHE_SIZE = 4096
+TEMPLATE_TAGS = ('{{', '{%', '{#')
+
+
+def is_constant(source: str) -> bool:
+    """Check if the given source renders to itself (no template tags)."""
+    # note: jinja2 normalizes `\r\n` and `\r`, leave these cases to it
+    return '\r' not in source and not any(
+        tag in source for tag in TEMPLATE_TAGS
+    )
+
+
+def _get_bytecode_cache() -> Optional[Any]:
+    if os.environ.get('MAKIM_TEMPLATE_BYTECODE_CACHE', '') in ('', '0'):
+        return None
+
+    from jinja2 import FileSystemBytecodeCache
+
+    cache_path = get_cache_dir() / 'templates'
+    try:
+        cache_path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(str(cache_path))
+
+
+@lru_cache(maxsize=None)
+def get_environment() -> Any:
+    """Return the Jinja2 environment shared by all the templates."""
+    from jinja2 import BaseLoader, Environment
+
+    class SourceLoader(BaseLoader):
+        """Load a template using its name as its source."""
+
+        def get_source(self, environment, template):
+            return template, None, lambda: True
+
+    return Environment(
+        loader=SourceLoader(),
+        cache_size=TEMPLATE_CACHE_SIZE,
+        auto_reload=False,
+        bytecode_cache=_get_bytecode_cache(),
+    )
+
+
+def render_template(source: str, **data: Any) -> str:
+    """Render the given Jinja2 template source with the given data."""
+    if is_constant(source):
+        # same as jinja2 with `keep_trailing_newline=False`
+        return source[:-1] if source.endswith('\n') else source
+    # note: this is the hottest hook, skip the span when not profiling
+    if get_profiler() is None:
+        return get_environment().get_template(source).render(**data)
+    with span('render', 'render'):
+        return get_environment().get_template(source).render(**data)
+
+
+def clear_template_cache():
+    """Remove the shared environment and its compiled templates."""
+    get_environment.cache_clear()
@@ -0,0 +1,189 @@
+"""
+Watch files for changes, for `makim --watch`.
+
+On Linux, the directories of the watched files are monitored with inotify
+(through ctypes, no extra dependency is needed). On other platforms, or
+when inotify is not available, the files are polled.
+"""
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import time
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# time without new changes before reporting a burst of changes, in seconds
+WATCH_DEBOUNCE = 0.2
+WATCH_POLL_INTERVAL = 0.5
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def match_patterns(path: str, patterns: Iterable[str]) -> bool:
+    """Check if the given path matches any of the glob patterns."""
+    for pattern in patterns:
+        # note: `**/` also matches no directory at all
+        if path == pattern or any(
+            fnmatch.fnmatch(path, alt)
+            for alt in {pattern, pattern.replace('/**/', '/')}
+        ):
+            return True
+    return False
+
+
+def _glob_root(pattern: str) -> str:
+    """Return the directory of the pattern before any glob character."""
+    parts = Path(pattern).parts
+    for index, part in enumerate(parts):
+        if glob.has_magic(part):
+            return str(Path(*parts[:index]))
+    return str(Path(pattern).parent)
+
+
+class PollingWatcher:
+    """Watch files checking their modification time periodically."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = sorted(set(patterns))
+        self._files = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for pattern in self.patterns:
+            for path in glob.glob(pattern, recursive=True):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def matches(self, path: str) -> bool:
+        """Check if the given path is one of the watched files."""
+        return path in self._files or match_patterns(path, self.patterns)
+
+    def _poll(self, timeout: float) -> Set[str]:
+        time.sleep(min(timeout, WATCH_POLL_INTERVAL))
+        files = self._scan()
+        changed = {
+            path
+            for path in set(files) | set(self._files)
+            if files.get(path) != self._files.get(path)
+        }
+        self._files = files
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """
+        Wait for changes in the watched files.
+
+        Returns the changed files, after a burst of changes is over, or an
+        empty set when there is no change until the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: Set[str] = set()
+        while not changed:
+            remaining = (
+                WATCH_POLL_INTERVAL
+                if deadline is None
+                else deadline - time.monotonic()
+            )
+            if remaining <= 0:
+                return set()
+            changed = self._poll(remaining)
+
+        # debounce: wait until there is no new change
+        while True:
+            new_changes = self._poll(WATCH_DEBOUNCE)
+            if not new_changes:
+                return changed
+            changed |= new_changes
+
+    def close(self):
+        """Stop watching the files."""
+
+
+class InotifyWatcher(PollingWatcher):
+    """Watch files using inotify on the directories of the files."""
+
+    def __init__(self, patterns: Iterable[str]):
+        super().__init__(patterns)
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc was not found.')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+
+        directories = {_glob_root(pattern) for pattern in self.patterns}
+        directories |= {os.path.dirname(path) for path in self._files}
+        self._directories: Dict[int, str] = {}
+        for directory in directories:
+            self._add_watch(directory)
+        if not self._directories:
+            os.close(self._fd)
+            raise OSError('There is no directory to watch.')
+
+    def _add_watch(self, directory: str):
+        if not os.path.isdir(directory):
+            return
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), IN_MASK
+        )
+        if wd >= 0:
+            self._directories[wd] = directory
+
+    def _poll(self, timeout: float) -> Set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset : offset + size].rstrip(b'\0'))
+            offset += size
+            path = os.path.join(self._directories.get(wd, ''), name)
+            if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                # new directories can have new files matching the patterns
+                self._add_watch(path)
+            if self.matches(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """Stop watching the files."""
+        os.close(self._fd)
+
+
+def create_watcher(patterns: List[str]) -> PollingWatcher:
+    """Return an inotify watcher, or a polling one as fallback."""
+    try:
+        return InotifyWatcher(patterns)
+    except (AttributeError, OSError):
+        return PollingWatcher(patterns)
@@ -0,0 +1,265 @@
+"""
+Persistent shell worker.
+
+Starting a new shell for each target is expensive, mainly for xonsh, which
+starts a new Python interpreter and imports xonsh every time. A shell
+worker is a long-lived process, started once per shell for the whole makim
+call, that receives the scripts of the targets through a Unix socket and
+runs each one of them in a forked child process. So each script still runs
+in its own process, with its own working directory, environment variables
+and exit code, without sharing any state with the other targets, but the
+shell startup is paid just once.
+
+The worker is started with `python -m makim.worker SOCKET_FD SHELL [ARGS]`.
+"""
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from makim.ipc import recv_message, send_message
+from makim.resources import set_memory_limit
+from makim.script import ScriptFile
+
+# client side
+
+
+class WorkerProcess:
+    """Script running inside a shell worker."""
+
+    def __init__(self, pid: int, results: queue.Queue):
+        self.pid = pid
+        self._results = results
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait for the script and return its exit code.
+
+        Raises TimeoutError when the script doesn't end before the timeout.
+        """
+        try:
+            return self._results.get(timeout=timeout)['returncode']
+        except queue.Empty:
+            raise TimeoutError from None
+
+    def kill_group(self):
+        """Kill the process group of the script."""
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class ShellWorker:
+    """Client for a persistent shell worker process."""
+
+    def __init__(self, shell: str, shell_args: Sequence[str] = ()):
+        self.shell = shell
+        self._sock, worker_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                '-m',
+                'makim.worker',
+                str(worker_sock.fileno()),
+                shell,
+                *shell_args,
+            ],
+            pass_fds=[worker_sock.fileno()],
+            stdin=subprocess.DEVNULL,
+        )
+        worker_sock.close()
+
+        self._lock = threading.Lock()
+        self._results: Dict[int, queue.Queue] = {}
+        self._next_id = 0
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                message, _ = recv_message(self._sock)
+            except OSError:
+                message = None
+            if message is None:
+                break
+            with self._lock:
+                results = self._results.get(message['id'])
+                if 'returncode' in message:
+                    self._results.pop(message['id'], None)
+            if results is not None:
+                results.put(message)
+
+        # the worker is gone, the pending scripts will never finish
+        with self._lock:
+            pending = list(self._results.values())
+            self._results.clear()
+        for results in pending:
+            results.put({'pid': -1, 'returncode': -1})
+
+    def run(
+        self,
+        script: str,
+        env: Dict[str, str],
+        cwd: str,
+        fds: Sequence[int],
+        memory: Optional[float] = None,
+    ) -> WorkerProcess:
+        """
+        Run the script in a new child process of the worker.
+
+        `fds` are the stdin, stdout and stderr for the script, and `memory`
+        is the max address space of the script process, if any.
+        """
+        results: queue.Queue = queue.Queue()
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._results[request_id] = results
+            send_message(
+                self._sock,
+                {
+                    'id': request_id,
+                    'script': script,
+                    'env': env,
+                    'cwd': cwd,
+                    'memory': memory,
+                },
+                fds,
+            )
+        return WorkerProcess(results.get()['pid'], results)
+
+    def close(self):
+        """Stop the worker process."""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self.process.wait()
+
+
+# worker side
+
+
+def _preload_xonsh() -> Any:
+    """Import and warm up xonsh, returning its main function."""
+    try:
+        import xonsh.main
+    except ImportError:
+        return None
+
+    try:
+        xonsh.main.main(['-c', 'pass'])
+    except SystemExit:
+        pass
+    return xonsh.main.main
+
+
+def _run_child(
+    request: dict,
+    fds: List[int],
+    script: ScriptFile,
+    command: List[str],
+    xonsh_main: Any,
+):
+    code = 1
+    try:
+        os.setsid()
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        if request.get('memory'):
+            set_memory_limit(request['memory'])
+
+        if xonsh_main is None:
+            os.execvpe(command[0], [*command, script.path], os.environ)
+
+        sys.argv = [script.path]
+        try:
+            result = xonsh_main([*command[1:], script.path])
+            code = result if isinstance(result, int) else 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(bool(e.code))
+    except BaseException:
+        traceback.print_exc()
+        code = 127
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _wait_child(
+    sock: socket.socket,
+    lock: threading.Lock,
+    request_id: int,
+    pid: int,
+    script: ScriptFile,
+):
+    _, status = os.waitpid(pid, 0)
+    script.close()
+    returncode = (
+        os.WEXITSTATUS(status)
+        if os.WIFEXITED(status)
+        else -os.WTERMSIG(status)
+    )
+    with lock:
+        send_message(sock, {'id': request_id, 'returncode': returncode})
+
+
+def serve(sock: socket.socket, command: List[str]):
+    """Run the scripts received from the socket until it is closed."""
+    is_xonsh = os.path.basename(command[0]).startswith('xonsh')
+    xonsh_main = _preload_xonsh() if is_xonsh else None
+    lock = threading.Lock()
+
+    while True:
+        request, fds = recv_message(sock)
+        if request is None:
+            break
+
+        script = ScriptFile(request['script'])
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            _run_child(request, fds, script, command, xonsh_main)
+
+        for fd in fds:
+            os.close(fd)
+        if script.is_memfd:
+            # note: the child has its own copy of the file descriptor
+            script.close()
+        with lock:
+            send_message(sock, {'id': request['id'], 'pid': pid})
+        threading.Thread(
+            target=_wait_child,
+            args=(sock, lock, request['id'], pid, script),
+            daemon=True,
+        ).start()
+
+
+def main(argv: List[str]):
+    """Start the worker with the given socket fd and shell command."""
+    sock = socket.socket(fileno=int(argv[0]))
+    sock.set_inheritable(False)
+    try:
+        serve(sock, list(argv[1:]))
+    except (ConnectionError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,15 @@
+"""Fixtures for the test suite."""
+from pathlib import Path
+
+import pytest
+
+from makim import config
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch) -> Path:
+    """Use an empty makim cache directory for each test."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('MAKIM_CACHE_DIR', str(path))
+    config.clear_config_cache()
+    return path
@@ -0,0 +1,109 @@
+"""Tests for the local and the remote cache of the targets results."""
+import io
+import socket
+import tarfile
+import threading
+
+import pytest
+
+from makim.cache import TaskCache
+from makim.remote import RemoteCache, make_server
+
+KEY = 'a' * 64
+
+
+@pytest.fixture
+def remote_url(tmp_path):
+    """Start the reference server of the remote cache."""
+    server = make_server(tmp_path / 'remote')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://{}:{}/makim'.format(*server.server_address[:2])
+    server.shutdown()
+    server.server_close()
+
+
+def _make_entry(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in files.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        b'not a tarball',
+        _make_entry(
+            {
+                'outputs.tar.gz': b'truncated',
+                'stdout.log': b'',
+                'stderr.log': b'',
+                'meta.json': b'{"size": 0}',
+            }
+        ),
+    ],
+    ids=['not-a-tarball', 'broken-outputs'],
+)
+def test_restore_corrupt_remote_entry(tmp_path, remote_url, data):
+    """Test a broken remote entry is a cache miss."""
+    remote = RemoteCache(remote_url)
+    assert remote.put(KEY, data)
+
+    output = tmp_path / 'result.txt'
+    output.write_text('previous\n')
+    cache = TaskCache(tmp_path / 'local', remote=remote)
+
+    assert cache.restore(KEY, [output]) is None
+    assert not cache.has(KEY)
+    assert output.read_text() == 'previous\n'
+
+
+def test_restore_unsafe_member(tmp_path, monkeypatch):
+    """Test the members outside of the output directory are rejected."""
+    output = tmp_path / 'result.txt'
+    output.write_text('result\n')
+    cache = TaskCache(tmp_path / 'local')
+    cache.store(KEY, 'tests.unsafe', [output], '', '')
+
+    entry_path = cache.entries_path / KEY[:2] / KEY
+    (entry_path / 'outputs.tar.gz').write_bytes(
+        _make_entry({'../unsafe.txt': b'unsafe\n'})
+    )
+
+    # note: the same checks are done by the `data` filter, when available
+    monkeypatch.delattr(tarfile, 'data_filter', raising=False)
+    assert cache.restore(KEY, [output]) is None
+    assert output.read_text() == 'result\n'
+    assert not list(tmp_path.rglob('unsafe.txt'))
+
+
+def test_remote_broken_response():
+    """Test a broken HTTP response of the remote cache is a miss."""
+    server = socket.create_server(('127.0.0.1', 0))
+    server.settimeout(5)
+
+    def respond():
+        for _ in range(2):
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                conn.recv(65536)
+                # note: the connection is closed before the end of the body
+                conn.sendall(
+                    b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\nshort'
+                )
+
+    thread = threading.Thread(target=respond, daemon=True)
+    thread.start()
+    remote = RemoteCache('http://{}:{}'.format(*server.getsockname()))
+    try:
+        assert remote.get(KEY) is None
+        assert remote.put(KEY, b'entry')
+    finally:
+        server.close()
+        thread.join()
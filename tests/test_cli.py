@@ -0,0 +1,178 @@
+"""Tests for the `makim` CLI."""
+import json
+import sys
+
+from pathlib import Path
+
+import pytest
+
+from makim import cli
+
+MAKIM_FILE = str(Path(__file__).parent / '.makim-unittest.yaml')
+# cells of the `tests.test-14` matrix
+MATRIX_CELLS = 6
+# exit code of argparse for invalid arguments
+USAGE_ERROR = 2
+
+
+@pytest.mark.parametrize(
+    'name,expected,not_expected',
+    [
+        (None, 'tests.test-1 =>', 'No group or target'),
+        ('tests', 'tests.test-2 =>', 'No group or target'),
+        ('tests.test-1', 'tests.test-1 =>', 'tests.test-2 =>'),
+        ('unknown', 'No group or target found', 'tests.test-1 =>'),
+    ],
+)
+def test_help(name, expected, not_expected, monkeypatch, capsys):
+    """Test the help text, filtered by group or target."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--help']
+    monkeypatch.setattr(sys, 'argv', argv + ([name] if name else []))
+    cli.app()
+
+    output = capsys.readouterr().out
+    assert expected in output
+    assert not_expected not in output
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_multiple_targets(jobs, monkeypatch):
+    """Test many targets in one call, with their own args and shared deps."""
+    output = Path('/tmp/makim-test-11.txt')
+    output.unlink(missing_ok=True)
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--jobs', jobs]
+    monkeypatch.setattr(
+        sys,
+        'argv',
+        [
+            *argv,
+            'tests.test-11-build',
+            'tests.test-11-check',
+            '--',
+            'tests.test-2',
+            '--all',
+            '--',
+            'tests.test-1',
+        ],
+    )
+    cli.app()
+
+    # the shared dependency ran just once
+    assert output.read_text().splitlines() == ['setup']
+    output.unlink()
+
+
+@pytest.mark.parametrize('jobs', ['-1', 'x'])
+def test_invalid_jobs(jobs, monkeypatch, capsys):
+    """Test an invalid number of jobs is rejected by the argument parser."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--jobs', jobs]
+    monkeypatch.setattr(sys, 'argv', [*argv, 'tests.test-1'])
+    with pytest.raises(SystemExit) as exc_info:
+        cli.app()
+
+    assert exc_info.value.code == USAGE_ERROR
+    assert 'invalid number of jobs' in capsys.readouterr().err
+
+
+def test_plan(monkeypatch, capsys):
+    """Test the execution plan, that doesn't run any target."""
+    output = Path('/tmp/makim-test-11.txt')
+    output.unlink(missing_ok=True)
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--plan']
+    monkeypatch.setattr(
+        sys, 'argv', [*argv, 'tests.test-11-build', 'tests.test-11-check']
+    )
+    cli.app()
+
+    plan = json.loads(capsys.readouterr().out)
+    assert [node['name'] for node in plan['nodes']] == [
+        'tests.test-11-setup',
+        'tests.test-11-build',
+        'tests.test-11-check',
+    ]
+    assert plan['edges'] == [[0, 1], [0, 2]]
+    assert plan['nodes'][0]['cmd'].startswith('echo "setup"')
+    assert not output.exists()
+
+
+def test_plan_shards(monkeypatch, capsys):
+    """Test that the shards split the matrix cells between them."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--plan', 'tests.test-14']
+    shards = []
+    for index in range(1, 4):
+        monkeypatch.setattr(sys, 'argv', [*argv, '--shard', f'{index}/3'])
+        cli.app()
+        plan = json.loads(capsys.readouterr().out)
+        shards.append({node['name'] for node in plan['nodes']})
+
+    assert [len(shard) for shard in shards] == [2, 2, 2]
+    assert len(set.union(*shards)) == MATRIX_CELLS
+
+
+def test_plan_shard_durations(monkeypatch, capsys, tmp_path):
+    """Test that the shards are balanced by the durations of a plan."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, '--plan', 'tests.test-14']
+    monkeypatch.setattr(sys, 'argv', argv)
+    cli.app()
+    plan = json.loads(capsys.readouterr().out)
+    for node in plan['nodes']:
+        node['duration'] = 1.0
+    slow_cell = plan['nodes'][0]
+    slow_cell['duration'] = 10.0
+    plan_path = tmp_path / 'plan.json'
+    plan_path.write_text(json.dumps(plan))
+
+    shards = []
+    for index in range(1, 4):
+        monkeypatch.setattr(
+            sys,
+            'argv',
+            [
+                *argv,
+                '--shard',
+                f'{index}/3',
+                '--shard-durations',
+                str(plan_path),
+            ],
+        )
+        cli.app()
+        plan = json.loads(capsys.readouterr().out)
+        shards.append({node['name'] for node in plan['nodes']})
+
+    # the slow cell runs alone in its shard
+    assert shards[0] == {slow_cell['name']}
+    assert [len(shard) for shard in shards] == [1, 3, 2]
+    assert len(set.union(*shards)) == MATRIX_CELLS
+
+
+def test_shard_matrix_summary(monkeypatch, capsys):
+    """Test the matrix summary lists only the cells of the shard."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, 'tests.test-14']
+    monkeypatch.setattr(sys, 'argv', [*argv, '--shard', '1/3'])
+    cli.app()
+
+    output = capsys.readouterr().out
+    assert output.count('passed') == MATRIX_CELLS // 3
+    assert 'not run' not in output
+
+
+@pytest.mark.parametrize('has_target', [True, False])
+def test_cache_command(has_target, monkeypatch, capfd, tmp_path):
+    """Test a target called `cache` has precedence over `makim cache`."""
+    monkeypatch.chdir(tmp_path)
+    if has_target:
+        (tmp_path / '.makim.yaml').write_text(
+            'groups:\n'
+            '  main:\n'
+            '    targets:\n'
+            '      cache:\n'
+            '        shell: bash\n'
+            '        run: echo "target cache"\n'
+        )
+    argv = ['makim', 'cache'] if has_target else ['makim', 'cache', 'stats']
+    monkeypatch.setattr(sys, 'argv', argv)
+    cli.app()
+
+    output = capfd.readouterr().out
+    assert ('target cache' in output) == has_target
+    assert ('Cache directory' in output) != has_target
@@ -0,0 +1,79 @@
+"""Tests for the makim daemon (`makim --daemon`)."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+import pytest
+
+from makim.ipc import send_message
+
+from makim import __version__, daemon
+
+MAKIM_FILE = str(Path(__file__).parent / '.makim-unittest.yaml')
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    """Run a makim daemon for the test."""
+    socket_path = tmp_path / 'makim' / 'daemon.sock'
+    socket_path.parent.mkdir(mode=0o700)
+    monkeypatch.setenv('MAKIM_DAEMON_SOCKET', str(socket_path))
+    monkeypatch.delenv('MAKIM_NO_DAEMON', raising=False)
+
+    process = subprocess.Popen([sys.executable, '-m', 'makim', '--daemon'])
+    try:
+        for _ in range(100):
+            if socket_path.exists():
+                break
+            time.sleep(0.1)
+        yield socket_path
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.mark.parametrize(
+    'target,failed',
+    [('tests.test-1', False), ('tests.test-8', True)],
+)
+def test_daemon_call(socket_path, capfd, target, failed):
+    """Test a call forwarded to the daemon, with its output and status."""
+    argv = ['makim', '--makim-file', MAKIM_FILE, target]
+    assert (daemon.forward(argv) != 0) == failed
+    # the daemon writes to the stdio of the client
+    assert ('RAN:' in capfd.readouterr().err) == failed
+
+
+def test_daemon_fallback(tmp_path, monkeypatch):
+    """Test that the calls run in the process without a daemon."""
+    monkeypatch.setenv('MAKIM_DAEMON_SOCKET', str(tmp_path / 'none.sock'))
+    assert daemon.forward(['makim', '--version']) is None
+
+
+@pytest.mark.parametrize(
+    'request_data',
+    [
+        ['not', 'a', 'dict'],
+        {'version': __version__, 'argv': ['makim', '--version']},
+        {
+            'version': __version__,
+            'argv': ['makim', '--version'],
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        },
+    ],
+    ids=['not-a-dict', 'incomplete', 'client-gone'],
+)
+def test_daemon_broken_client(socket_path, request_data):
+    """Test a client that sends a bad request or leaves doesn't stop it."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        send_message(sock, request_data, [0, 1, 2])
+    # the client closes the connection without waiting for the daemon
+
+    argv = ['makim', '--makim-file', MAKIM_FILE, 'tests.test-1']
+    assert daemon.forward(argv) == 0
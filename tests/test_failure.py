@@ -1,4 +1,5 @@
 """Tests for `makim` package."""
+import asyncio
 import os
 import sys
 
@@ -10,6 +11,9 @@ import makim
 
 from makim.errors import MakimError
 
+# the target of the timeout test would run for 10 seconds
+TIMEOUT_MAX_DURATION = 5
+
 
 @pytest.mark.parametrize(
     'target,args,error_code',
@@ -17,6 +21,16 @@ from makim.errors import MakimError
         ('tests.test-7', {}, MakimError.MAKIM_ARGUMENT_REQUIRED.value),
         ('tests.test-8', {}, MakimError.SH_ERROR_RETURN_CODE.value),
         ('tests.test-9', {}, MakimError.SH_ERROR_RETURN_CODE.value),
+        (
+            'tests.test-10',
+            {'jobs': 2, 'keep_going': True},
+            MakimError.SH_ERROR_RETURN_CODE.value,
+        ),
+        (
+            'tests.test-8',
+            {'shell_worker': True},
+            MakimError.SH_ERROR_RETURN_CODE.value,
+        ),
     ],
 )
 def test_failure(target, args, error_code):
@@ -38,3 +52,96 @@ def test_failure(target, args, error_code):
         m.run(args)
     assert pytest_wrapped_e.type == SystemExit
     assert pytest_wrapped_e.value.code == error_code
+
+
+@pytest.mark.parametrize(
+    'target,error_code,failed',
+    [
+        ('tests.test-7', MakimError.MAKIM_ARGUMENT_REQUIRED.value, []),
+        ('tests.test-8', MakimError.SH_ERROR_RETURN_CODE.value, ['test-8']),
+        ('tests.unknown', MakimError.MAKIM_TARGET_NOT_FOUND.value, []),
+    ],
+)
+def test_failure_result(target, error_code, failed):
+    """Test the failures are returned by `execute`, without exiting."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+
+    m = makim.Makim()
+    m.load(makim_file)
+    result = m.execute({'target': target, 'makim_file': makim_file})
+
+    assert not result.ok
+    assert result.code == error_code
+    assert result.message
+    assert result.failed == [f'tests.{name}' for name in failed]
+
+
+def test_failure_internal_error(capsys):
+    """Test an error that doesn't come from the script is shown."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+
+    m = makim.Makim()
+    m.load(makim_file)
+    result = m.execute(
+        {
+            'target': 'tests.test-1',
+            'makim_file': makim_file,
+            'output': 'log',
+            'log_dir': '/proc/nope',
+        }
+    )
+
+    assert not result.ok
+    assert (
+        'The target tests.test-1 failed: FileNotFoundError'
+        in capsys.readouterr().err
+    )
+
+
+@pytest.mark.parametrize('engine', ['execute', 'run_async'])
+def test_failure_timeout(engine, capsys):
+    """Test a target is killed when it runs for longer than its timeout."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+
+    m = makim.Makim()
+    m.load(makim_file)
+    args = {
+        'target': 'tests.test-16',
+        'makim_file': makim_file,
+        'output': 'prefix',
+    }
+    if engine == 'execute':
+        result = m.execute(args)
+    else:
+        result = asyncio.run(m.run_async(args))
+
+    assert result.code == MakimError.SH_ERROR_RETURN_CODE.value
+    assert result.failed == ['tests.test-16']
+    assert result.duration < TIMEOUT_MAX_DURATION
+    assert '[tests.test-16] started' in capsys.readouterr().out
+
+
+def test_failure_async_cancel():
+    """Test cancelling `run_async` kills the target process group."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    pid_file = Path('/tmp/makim-test-16.pid')
+    pid_file.unlink(missing_ok=True)
+
+    m = makim.Makim()
+    m.load(makim_file)
+
+    async def run_and_cancel():
+        task = asyncio.ensure_future(
+            m.run_async({'target': 'tests.test-16', 'makim_file': makim_file})
+        )
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run_and_cancel())
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
+    pid_file.unlink()
@@ -0,0 +1,51 @@
+"""Tests for the duration history and the scheduling by priority."""
+import pytest
+
+from makim.history import DurationHistory, percentile
+from makim.scheduler import Scheduler, TargetGraph
+
+
+@pytest.mark.parametrize(
+    'percent,expected', [(0, 1.0), (50, 5.0), (95, 10.0), (100, 10.0)]
+)
+def test_percentile(percent, expected):
+    """Test the nearest rank percentile."""
+    values = [float(v) for v in range(10, 0, -1)]
+    assert percentile(values, percent) == expected
+
+
+def test_history(tmp_path):
+    """Test the durations are recorded and summarized by target."""
+    history = DurationHistory(tmp_path / 'history.sqlite3')
+    unit_a, unit_b = 10.0, 20.0
+    history.record(
+        'makim.yaml',
+        [
+            ('tests.unit', 'a', unit_a, True),
+            ('tests.unit', 'b', unit_b, True),
+            ('tests.unit', 'b', 99.0, False),
+            ('tests.lint', 'a', 1.0, True),
+        ],
+    )
+    history.record('other.yaml', [('tests.unit', 'a', 50.0, True)])
+
+    assert history.stats('makim.yaml') == [
+        ('tests.lint', 1, 1.0, 1.0),
+        ('tests.unit', 2, unit_a, unit_b),
+    ]
+    estimates, target_estimates = history.estimates('makim.yaml')
+    assert estimates[('tests.unit', 'b')] == unit_b
+    # note: the estimate of a target is its median duration
+    assert target_estimates['tests.unit'] == unit_a
+
+
+def test_scheduler_priorities():
+    """Test the ready nodes with the highest priority are started first."""
+    graph = TargetGraph()
+    for name in ('lint', 'docs', 'tests'):
+        graph.add((name, '', ''), [])
+
+    started = []
+    scheduler = Scheduler(priorities={2: 300.0, 1: 5.0})
+    scheduler.run(graph.nodes, lambda node: started.append(node.name))
+    assert started == ['tests', 'docs', 'lint']
@@ -0,0 +1,48 @@
+"""Tests for the import time of the `makim` CLI."""
+import json
+import subprocess
+import sys
+
+import pytest
+
+# modules that should be imported only when a target is executed
+HEAVY_MODULES = ('sh', 'jinja2', 'dotenv', 'colorama', 'makim.makim')
+# cumulative import time budget for `makim.cli`, in microseconds
+IMPORT_TIME_BUDGET = 150_000
+
+
+def _loaded_modules(code: str) -> set:
+    code += '\nimport json, sys; print(json.dumps(list(sys.modules)))'
+    output = subprocess.check_output([sys.executable, '-c', code], text=True)
+    return set(json.loads(output.splitlines()[-1]))
+
+
+@pytest.mark.parametrize(
+    'code',
+    [
+        'import makim.cli',
+        'import sys; sys.argv = ["makim", "--version"]\n'
+        'from makim.cli import app; app()',
+    ],
+)
+def test_import_lazy_modules(code):
+    """Test the heavy modules are not imported by the fast paths."""
+    modules = _loaded_modules(code)
+    assert not modules.intersection(HEAVY_MODULES)
+
+
+def test_import_time_budget():
+    """Test the import time of `makim.cli` is within the budget."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import makim.cli'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # line format: "import time: self [us] | cumulative | imported package"
+    cumulative = min(
+        int(line.split('|')[1])
+        for line in result.stderr.splitlines()
+        if line.endswith('| makim.cli')
+    )
+    assert cumulative < IMPORT_TIME_BUDGET
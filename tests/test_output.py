@@ -0,0 +1,47 @@
+"""Tests for the output modes of the targets."""
+import pytest
+
+from makim.output import TAIL_SIZE, TargetOutput
+
+
+def _write_lines(output: TargetOutput, count: int):
+    for index in range(count):
+        output.stdout(f'out {index}\n')
+        output.stderr(f'err {index}\n')
+    output.close()
+
+
+def test_output_prefix(capsys):
+    """Test the output lines are prefixed by the target name."""
+    _write_lines(TargetOutput('tests.unit', 'prefix'), 2)
+    captured = capsys.readouterr()
+    assert captured.out == '[tests.unit] out 0\n[tests.unit] out 1\n'
+    assert captured.err == '[tests.unit] err 0\n[tests.unit] err 1\n'
+
+
+def test_output_group(capsys):
+    """Test the output is written just when the target ends."""
+    output = TargetOutput('tests.unit', 'group')
+    output.stdout('out 0\n')
+    assert capsys.readouterr().out == ''
+    output.close()
+    assert capsys.readouterr().out == 'out 0\n'
+
+
+def test_output_log(tmp_path, capsys):
+    """Test the output is written to the log file of the target."""
+    output = TargetOutput('tests.unit', 'log', tmp_path / 'logs')
+    _write_lines(output, 1)
+    assert capsys.readouterr().out == ''
+    assert output.log_path == tmp_path / 'logs' / 'tests.unit.log'
+    assert output.log_path.read_text() == 'out 0\nerr 0\n'
+
+
+@pytest.mark.parametrize('mode', ['prefix', 'group', 'log'])
+def test_output_tail(mode, tmp_path):
+    """Test just the last lines are kept for the error summary."""
+    output = TargetOutput('tests.unit', mode, tmp_path, capture=True)
+    _write_lines(output, TAIL_SIZE)
+    assert len(output.tail) == TAIL_SIZE
+    assert output.tail[-1] == f'err {TAIL_SIZE - 1}\n'
+    assert output.captured()[0].count('\n') == TAIL_SIZE
@@ -0,0 +1,51 @@
+"""Tests for the makim profiler."""
+import json
+
+from pathlib import Path
+
+import makim
+
+from makim import profiler
+
+
+def test_profile(tmp_path, capsys):
+    """Test the profile summary and the Chrome trace file."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    trace_path = tmp_path / 'trace.json'
+
+    profiler.enable()
+    try:
+        m = makim.Makim()
+        m.load(makim_file)
+        m.run(
+            {
+                'target': 'tests.test-4',
+                '--trigger-dep': True,
+                'makim_file': makim_file,
+                'profile': True,
+                'profile_out': str(trace_path),
+            }
+        )
+    finally:
+        profiler.disable()
+
+    summary = capsys.readouterr().err
+    assert 'PHASE' in summary
+    assert 'tests.test-4-dep' in summary
+
+    events = json.loads(trace_path.read_text())['traceEvents']
+    categories = {event['cat'] for event in events}
+    assert {'load', 'resolve', 'env', 'target', 'spawn', 'wait'} <= categories
+    resolve = {e['name']: e for e in events if e['cat'] == 'resolve'}
+    # the span of the dependency is nested in the span of the target
+    parent, dep = resolve['tests.test-4'], resolve['test-4-dep']
+    assert parent['ts'] <= dep['ts']
+    assert dep['ts'] + dep['dur'] <= parent['ts'] + parent['dur']
+
+
+def test_profile_disabled():
+    """Test the spans are not recorded when the profiler is disabled."""
+    assert profiler.get_profiler() is None
+    with profiler.span('name', 'category'):
+        pass
+    assert profiler.get_profiler() is None
@@ -0,0 +1,66 @@
+"""Tests for the resources of the targets and the scheduler budget."""
+import threading
+import time
+
+import pytest
+
+from makim.resources import parse_resources, parse_size
+from makim.scheduler import Scheduler, TargetGraph
+
+CPU_BUDGET = 4.0
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (1024, 1024),
+        ('512M', 512 * 1024**2),
+        ('2G', 2 * 1024**3),
+        ('1.5G', int(1.5 * 1024**3)),
+        ('64 kb', 64 * 1024),
+    ],
+)
+def test_parse_size(value, expected):
+    """Test the memory sizes, in bytes."""
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize(
+    'resources', [['cpu'], {'gpu': 1}, {'memory': '2X'}, {'cpu': -1}]
+)
+def test_parse_resources_invalid(resources):
+    """Test the invalid `resources` attributes are rejected."""
+    with pytest.raises(ValueError):
+        parse_resources(resources)
+
+
+def test_scheduler_budget():
+    """Test the running nodes never use more than the budget."""
+    graph = TargetGraph()
+    resources = {'unit': 4.0, 'lint': 1.0, 'docs': 1.0, 'e2e': 8.0}
+    for name, cpu in resources.items():
+        node = graph.add((name, '', ''), [])
+        node.resources = {'cpu': cpu, 'memory': 0.0}
+
+    lock = threading.Lock()
+    running: set = set()
+    concurrent = []
+
+    def execute(node):
+        with lock:
+            running.add(node.name)
+            concurrent.append(set(running))
+        time.sleep(0.05)
+        with lock:
+            running.discard(node.name)
+
+    scheduler = Scheduler(jobs=4, budget={'cpu': CPU_BUDGET})
+    assert not scheduler.run(graph.nodes, execute)
+
+    for names in concurrent:
+        # a node bigger than the budget runs alone
+        assert (
+            sum(min(resources[name], CPU_BUDGET) for name in names)
+            <= CPU_BUDGET
+        )
+    assert {'lint', 'docs'} in concurrent
@@ -1,10 +1,25 @@
 """Tests for `makim` package."""
+import asyncio
+import os
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
 
+from makim.remote import make_server
+from makim.scheduler import TargetGraph
+
 import makim
 
+from makim import cache, config
+
+# cells of the `tests.test-14` matrix
+MATRIX_CELLS = 6
+
 
 @pytest.mark.parametrize(
     'target,args',
@@ -18,6 +33,15 @@ import makim
         ('tests.test-4', {'--trigger-dep': True}),
         ('tests.test-5', {}),
         ('tests.test-6', {}),
+        ('tests.test-3-b', {'jobs': 2}),
+        ('tests.test-4', {'--trigger-dep': True, 'jobs': 0}),
+        ('tests.test-11', {}),
+        ('tests.test-3-b', {'shell_worker': True}),
+        ('tests.test-4', {'--trigger-dep': True, 'shell_worker': True}),
+        ('tests.test-3-b', {'jobs': 2, 'output': 'prefix'}),
+        ('tests.test-4', {'--trigger-dep': True, 'output': 'group'}),
+        ('tests.test-17', {'limit_resources': True}),
+        ('tests.test-17', {'limit_resources': True, 'shell_worker': True}),
     ],
 )
 def test_success(target, args):
@@ -35,3 +59,405 @@ def test_success(target, args):
     )
 
     m.run(args)
+
+
+def test_success_up_to_date():
+    """Test makim skips targets with up to date outputs."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    output_dir = Path('/tmp/makim-test-12')
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    def run_target(args: dict) -> int:
+        m = makim.Makim()
+        m.load(makim_file)
+        args.update({'target': 'tests.test-12', 'makim_file': makim_file})
+        m.run(args)
+        result = output_dir / 'output' / 'result.txt'
+        return len(result.read_text().splitlines())
+
+    runs = run_target({})
+    assert runs == 1
+    assert run_target({}) == runs
+    assert run_target({'force': True}) == runs + 1
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def test_success_cache():
+    """Test makim restores the outputs of a target from the cache."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    output_dir = Path('/tmp/makim-test-13')
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    for _ in range(2):
+        m = makim.Makim()
+        m.load(makim_file)
+        m.run({'target': 'tests.test-13', 'makim_file': makim_file})
+        shutil.rmtree(output_dir / 'output')
+
+    m = makim.Makim()
+    m.load(makim_file)
+    m.run({'target': 'tests.test-13', 'makim_file': makim_file})
+
+    assert (output_dir / 'count.txt').read_text() == 'run\n'
+    assert (output_dir / 'output' / 'result.txt').read_text() == 'result\n'
+    assert m.cache.stats()['entries'] == 1
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def test_success_remote_cache(tmp_path, monkeypatch):
+    """Test the cache entries are shared through the remote cache."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    output_dir = Path('/tmp/makim-test-13')
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    server = make_server(tmp_path / 'remote')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/makim'.format(*server.server_address[:2])
+
+    def run_target(machine: str, read_only: bool = False) -> makim.Makim:
+        # each machine has its own local cache
+        monkeypatch.setenv('MAKIM_CACHE_DIR', str(tmp_path / machine))
+        shutil.rmtree(output_dir / 'output', ignore_errors=True)
+        m = makim.Makim()
+        m.load(makim_file)
+        result = m.execute(
+            {
+                'target': 'tests.test-13',
+                'makim_file': makim_file,
+                'remote_cache': url,
+                'remote_cache_read_only': read_only,
+            }
+        )
+        assert result.ok
+        return m
+
+    try:
+        run_target('untrusted', read_only=True)
+        assert not list((tmp_path / 'remote').rglob('*'))
+
+        run_target('ci')
+        m = run_target('laptop')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert (output_dir / 'count.txt').read_text() == 'run\nrun\n'
+    assert (output_dir / 'output' / 'result.txt').read_text() == 'result\n'
+    assert m.cache.stats()['entries'] == 1
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def test_success_config_cache(tmp_path):
+    """Test the parsed config is cached and invalidated by changes."""
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n  main:\n    targets:\n      build:\n        run: echo 1\n'
+    )
+
+    data = config.load_config(str(makim_file))
+    assert config.load_config(str(makim_file)) is data
+
+    # load from the disk cache, as a new process would do
+    config.clear_config_cache()
+    assert config.load_config(str(makim_file)) == data
+
+    makim_file.write_text(
+        'groups:\n  main:\n    targets:\n      test:\n        run: echo 22\n'
+    )
+    assert 'test' in config.load_config(str(makim_file))['groups']['main'][
+        'targets'
+    ]
+
+
+def test_success_env_layers():
+    """Test the resolved env layers are reused by the next targets."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    m = makim.Makim()
+    m.load(makim_file)
+    m._change_target('tests.test-1')
+
+    layers: dict = {}
+    env, _ = m._load_scoped_data('target', {'BASE': '1'}, layers)
+    assert env['ENV'] == 'dev'
+    assert env['BASE'] == '1'
+    # the global layer (from the .env file) doesn't depend on the base env
+    assert (('global',), None) in layers
+
+    env_cached, _ = m._load_scoped_data('target', {'BASE': '2'}, layers)
+    assert env_cached['ENV'] == 'dev'
+    assert env_cached['BASE'] == '2'
+
+
+def test_success_dependencies_context():
+    """Test the dependencies share the parsed config with the target."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    m = makim.Makim()
+    m.load(makim_file)
+
+    graph = TargetGraph()
+    args = {
+        'target': 'tests.test-4',
+        'makim_file': makim_file,
+        '--trigger-dep': True,
+        'dry_run': True,
+    }
+    node_id = m._load_target(args, {}, graph)
+
+    node = graph.nodes[node_id]
+    dep = graph.nodes[node.dependencies[0]]
+    assert dep.context.target_name == 'test-4-dep'
+    assert dep.context.group_data is node.context.group_data
+    # the state of the target is restored after loading its dependencies
+    assert m.target_name == 'test-4'
+    assert node.cmd == 'true'
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_success_matrix(jobs, capsys):
+    """Test a matrix target runs every cell and reports each one."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    shutil.rmtree('/tmp/makim-test-14', ignore_errors=True)
+
+    m = makim.Makim()
+    m.load(makim_file)
+    m.run({'target': 'tests.test-14', 'makim_file': makim_file, 'jobs': jobs})
+
+    cells = sorted(p.name for p in Path('/tmp/makim-test-14').iterdir())
+    assert cells == ['1-a', '1-b', '1-c', '2-a', '2-b', '2-c']
+    output = capsys.readouterr().out
+    assert output.count('passed') == len(cells)
+    assert '[number=2, letter=c]' in output
+    shutil.rmtree('/tmp/makim-test-14')
+
+
+def test_success_concurrent_runs():
+    """Test runs of the same object in many threads, with their own env."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    output_dir = Path('/tmp/makim-test-15')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    environ = dict(os.environ)
+
+    m = makim.Makim()
+    m.load(makim_file)
+
+    def run(index: int):
+        return m.execute(
+            {
+                'target': 'tests.test-15',
+                'makim_file': makim_file,
+                '--name': f'run-{index}',
+            },
+            env={**environ, 'MAKIM_TEST_15': f'value-{index}'},
+        )
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(run, range(8)))
+
+    assert all(result.ok for result in results)
+    assert results[0].done == ['tests.test-15']
+    for index in range(8):
+        path = output_dir / f'run-{index}.txt'
+        assert path.read_text() == f'value-{index}\n'
+    # the env of the process is not changed by the runs
+    assert dict(os.environ) == environ
+    shutil.rmtree(output_dir)
+
+
+def test_success_dependency_env(tmp_path):
+    """Test a dependency runs again when it inherits another env."""
+    log_file = tmp_path / 'setup.log'
+    targets = ''.join(
+        f'      {name}:\n'
+        f'        env: {{NAME: {env}}}\n'
+        '        dependencies: [{target: setup}]\n'
+        '        run: "true"\n'
+        for name, env in (('first', 'a'), ('second', 'b'), ('third', 'a'))
+    )
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n'
+        '  main:\n'
+        '    shell: bash\n'
+        '    targets:\n'
+        '      setup:\n'
+        f'        run: echo "$NAME" >> {log_file}\n' + targets
+    )
+    m = makim.Makim()
+    m.load(makim_file)
+    result = m.execute(
+        [
+            {'target': f'main.{name}', 'makim_file': makim_file}
+            for name in ('first', 'second', 'third')
+        ]
+    )
+
+    assert result.ok
+    assert sorted(log_file.read_text().split()) == ['a', 'b']
+
+
+def test_success_dependency_and_target(tmp_path):
+    """Test a target called directly and as a dependency runs once."""
+    log_file = tmp_path / 'setup.log'
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n'
+        '  main:\n'
+        '    shell: bash\n'
+        '    targets:\n'
+        '      setup:\n'
+        f'        run: echo setup >> {log_file}\n'
+        '      build:\n'
+        '        dependencies: [{target: main.setup}]\n'
+        '        run: "true"\n'
+    )
+    m = makim.Makim()
+    m.load(makim_file)
+    result = m.execute(
+        [
+            {'target': f'main.{name}', 'makim_file': makim_file}
+            for name in ('setup', 'build')
+        ]
+    )
+
+    assert result.ok
+    assert log_file.read_text().split() == ['setup']
+
+
+def test_success_matrix_falsy_values(tmp_path):
+    """Test the falsy matrix values are not replaced by the defaults."""
+    cells_dir = tmp_path / 'cells'
+    cells_dir.mkdir()
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n'
+        '  main:\n'
+        '    shell: bash\n'
+        '    targets:\n'
+        '      cells:\n'
+        '        args:\n'
+        '          level: {type: int, default: 5, help: level}\n'
+        '          flag: {type: bool, default: true, help: flag}\n'
+        '        matrix:\n'
+        '          level: [0, 1]\n'
+        '          flag: [false, true]\n'
+        f'        run: touch {cells_dir}/{{{{ args.level }}}}-'
+        '{{ args.flag }}\n'
+    )
+    m = makim.Makim()
+    m.load(makim_file)
+    assert m.execute({'target': 'main.cells', 'makim_file': makim_file}).ok
+
+    cells = sorted(path.name for path in cells_dir.iterdir())
+    assert cells == ['0-False', '0-True', '1-False', '1-True']
+
+
+def test_success_shell_worker_xonsh(tmp_path, capfd):
+    """Test the xonsh worker runs the script of each target."""
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n'
+        '  main:\n'
+        '    shell: xonsh\n'
+        '    targets:\n'
+        '      first:\n'
+        '        run: print("first-body")\n'
+        '      second:\n'
+        '        run: print("second-body")\n'
+    )
+    m = makim.Makim()
+    m.load(makim_file)
+    for _ in range(2):
+        result = m.execute(
+            [
+                {
+                    'target': target,
+                    'makim_file': makim_file,
+                    'shell_worker': True,
+                }
+                for target in ('main.first', 'main.second')
+            ]
+        )
+        assert result.ok
+        assert capfd.readouterr().out.split() == [
+            'first-body',
+            'second-body',
+        ]
+
+
+def test_success_run_async(capsys):
+    """Test the asyncio engine runs many targets with their own env."""
+    makim_file = Path(__file__).parent / '.makim-unittest.yaml'
+    shutil.rmtree('/tmp/makim-test-14', ignore_errors=True)
+
+    m = makim.Makim()
+    m.load(makim_file)
+    result = asyncio.run(
+        m.run_async(
+            [
+                {'target': 'tests.test-14', 'makim_file': makim_file},
+                {
+                    'target': 'tests.test-2',
+                    'makim_file': makim_file,
+                    '--all': True,
+                },
+            ],
+            env={**os.environ, 'MAKIM_TEST': '1'},
+        )
+    )
+
+    assert result.ok
+    assert len(result.done) == MATRIX_CELLS + 1
+    cells = sorted(p.name for p in Path('/tmp/makim-test-14').iterdir())
+    assert len(cells) == MATRIX_CELLS
+    shutil.rmtree('/tmp/makim-test-14')
+
+
+def test_success_run_async_slow_cache(tmp_path, monkeypatch):
+    """Test a slow cache store doesn't block the asyncio loop."""
+    makim_file = tmp_path / '.makim.yaml'
+    makim_file.write_text(
+        'groups:\n'
+        '  main:\n'
+        '    shell: bash\n'
+        f'    working-directory: {tmp_path}\n'
+        '    targets:\n'
+        '      build:\n'
+        '        outputs: [result.txt]\n'
+        '        run: echo result > result.txt\n'
+        '      check:\n'
+        '        run: sleep 0.2\n'
+    )
+    store_delay = 1.0
+    store = cache.TaskCache.store
+
+    def slow_store(*args):
+        time.sleep(store_delay)
+        store(*args)
+
+    monkeypatch.setattr(cache.TaskCache, 'store', slow_store)
+
+    async def run() -> float:
+        m = makim.Makim()
+        m.load(makim_file)
+        task = asyncio.ensure_future(
+            m.run_async(
+                [
+                    {'target': target, 'makim_file': makim_file, 'jobs': 2}
+                    for target in ('main.build', 'main.check')
+                ]
+            )
+        )
+        # the longest time the loop was blocked
+        max_delay = 0.0
+        while not task.done():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_delay = max(max_delay, time.perf_counter() - start)
+        assert task.result().ok
+        return max_delay
+
+    assert asyncio.run(run()) < store_delay / 2
+    assert (tmp_path / 'result.txt').exists()
@@ -0,0 +1,33 @@
+"""Tests for the rendering of the templates."""
+import pytest
+
+from jinja2 import Template
+
+from makim import template
+
+
+@pytest.mark.parametrize(
+    'source',
+    [
+        'echo "constant"\n',
+        'line 1\n\n',
+        'echo {{ args.name }}\n',
+        '{% if args.name %}echo yes{% endif %}',
+        '{# comment #}echo\r\nwindows\n',
+        '',
+    ],
+)
+def test_render_template(source, monkeypatch):
+    """Test the shared environment renders like `jinja2.Template`."""
+    monkeypatch.setenv('MAKIM_TEMPLATE_BYTECODE_CACHE', '1')
+    template.clear_template_cache()
+    data = {'args': {'name': 'makim'}}
+
+    expected = Template(source).render(**data)
+    assert template.render_template(source, **data) == expected
+    # compiled template from the memory cache
+    assert template.render_template(source, **data) == expected
+    # compiled template from the bytecode cache
+    template.clear_template_cache()
+    assert template.render_template(source, **data) == expected
+    template.clear_template_cache()
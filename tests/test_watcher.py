@@ -0,0 +1,45 @@
+"""Tests for the file watcher used by `makim --watch`."""
+import threading
+import time
+
+import pytest
+
+from makim import watcher
+
+
+def test_match_patterns():
+    """Test the glob patterns matching."""
+    patterns = ['/src/**/*.py', '/data/input.txt']
+    assert watcher.match_patterns('/src/main.py', patterns)
+    assert watcher.match_patterns('/src/a/b/main.py', patterns)
+    assert watcher.match_patterns('/data/input.txt', patterns)
+    assert not watcher.match_patterns('/src/main.txt', patterns)
+    assert not watcher.match_patterns('/data/output.txt', patterns)
+
+
+@pytest.mark.parametrize(
+    'watcher_class', [watcher.PollingWatcher, watcher.create_watcher]
+)
+def test_watcher_changes(tmp_path, watcher_class):
+    """Test that the watcher reports the changed files only."""
+    (tmp_path / 'src').mkdir()
+    source = tmp_path / 'src' / 'main.py'
+    source.write_text('1')
+    (tmp_path / 'notes.txt').write_text('1')
+
+    files_watcher = watcher_class([str(tmp_path / 'src' / '**' / '*.py')])
+    try:
+        assert files_watcher.wait(0.1) == set()
+
+        def change():
+            time.sleep(0.2)
+            (tmp_path / 'notes.txt').write_text('22')
+            source.write_text('22')
+
+        thread = threading.Thread(target=change)
+        thread.start()
+        changed = files_watcher.wait(5)
+        thread.join()
+        assert changed == {str(source)}
+    finally:
+        files_watcher.close()